@@ -0,0 +1,120 @@
+import asyncio
+import os
+import time
+
+from parallel_uploader import (BULK_FILTER_PATH, CHUNK_SIZE, INITIAL_BACKOFF, MAX_CHUNK_BYTES, MAX_RETRIES, backoff,
+                               read_chunks, split_results)
+
+# Uploads all indices at once from a single event loop. Every index has its own pool of workers, so meetings,
+# places and attendees are not held up behind the words, and every worker takes the largest file of its index that
+# is left, so the long files start first and the upload does not end waiting on one of them. The chunks and the
+# bulk bodies are the same as in the threaded upload (parallel_uploader), the AsyncElasticsearch client needs the
+# aiohttp package.
+
+# workers, i.e. bulk requests in flight, per index when not given otherwise
+DEFAULT_CONCURRENCY = 2
+
+
+# AsyncElasticsearch only fails once it sends the first request without aiohttp, the upload checks for it before
+# creating any index
+def require_aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ImportError("The async upload mode needs the aiohttp package (pip install aiohttp)")
+
+
+# the async counterpart of parallel_uploader.send_bulk; waiting for the limiter blocks, so it is done in a thread
+async def send_bulk(es, index_name, entries, max_retries=MAX_RETRIES, initial_backoff=INITIAL_BACKOFF, limiter=None):
+    failed = []
+    positions = range(len(entries))
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            await asyncio.sleep(backoff(attempt, initial_backoff))
+
+        body = b"".join(entries)
+        if limiter is not None:
+            await asyncio.to_thread(limiter.acquire)
+        start_time = time.time()
+        try:
+            response = await es.bulk(operations=body, index=index_name, filter_path=BULK_FILTER_PATH)
+        except Exception:
+            if limiter is not None:
+                limiter.release(time.time() - start_time, failed=True)
+            raise
+
+        rejected, rejections, attempt_failed = split_results(response, positions, entries, attempt < max_retries)
+        failed += attempt_failed
+        if limiter is not None:
+            limiter.release(time.time() - start_time, len(entries), len(body), rejections)
+
+        if not rejected:
+            return failed
+        positions = [position for position, _ in rejected]
+        entries = [entry for _, entry in rejected]
+
+    return failed
+
+
+async def send_chunk(es, chunk, max_retries=MAX_RETRIES, limiter=None):
+    if not chunk.actions:
+        return []
+
+    try:
+        return await send_bulk(es, chunk.index_name, chunk.actions, max_retries, limiter=limiter)
+    except Exception as e:
+        # the whole chunk is lost, e.g. the cluster could not be reached even after the client's retries
+        return [(position, {"error": repr(e)}) for position in range(len(chunk.actions))]
+
+
+# sends the chunks of one file one after another; the file is read in a thread, so the reading of one file does not
+# stall the requests of the others
+async def upload_file(es, file, read_actions, on_chunk_done, on_file_done, chunk_size, max_chunk_bytes, limiter):
+    chunks = read_chunks([file], read_actions, chunk_size, max_chunk_bytes)
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            return
+
+        failed = await send_chunk(es, chunk, limiter=limiter)
+        for _, result in failed[:1]:
+            print(f"{chunk.index_name}: failed to index a document of {chunk.file_name}: {result}")
+        on_chunk_done(chunk, failed)
+
+        if chunk.last:
+            print(f"{chunk.index_name}: uploaded {chunk.file_name}")
+            on_file_done(chunk.file_name, chunk.end_line)
+
+
+# Uploads the files, (file name, path, index name, skip) as for parallel_uploader.upload_files, with
+# concurrency[index name] workers per index. on_chunk_done and on_file_done are called in the event loop, i.e. in the
+# calling thread. Returns the number of documents sent.
+async def upload_files(es, files, read_actions, on_chunk_done, on_file_done, concurrency, chunk_size=CHUNK_SIZE,
+                       max_chunk_bytes=MAX_CHUNK_BYTES, limiter=None):
+    queues = {}
+    for file in sorted(files, key=lambda file: os.path.getsize(file[1]), reverse=True):
+        queues.setdefault(file[2], []).append(file)
+
+    sent_documents = [0]
+
+    def chunk_done(chunk, failed):
+        sent_documents[0] += len(chunk.actions)
+        on_chunk_done(chunk, failed)
+
+    # the queues are only touched from the event loop, popping the largest file needs no lock
+    async def work(index_files):
+        while index_files:
+            file = index_files.pop(0)
+            await upload_file(es, file, read_actions, chunk_done, on_file_done, chunk_size, max_chunk_bytes, limiter)
+
+    start_time = time.time()
+    workers = [
+        work(index_files)
+        for index_name, index_files in queues.items()
+        for _ in range(min(concurrency.get(index_name, DEFAULT_CONCURRENCY), len(index_files)))
+    ]
+    await asyncio.gather(*workers)
+
+    elapsed = max(time.time() - start_time, 1e-9)
+    print(f"Sent {sent_documents[0]} documents in {elapsed:.0f}s, {sent_documents[0] / elapsed:.0f} documents/s")
+    return sent_documents[0]
@@ -0,0 +1,202 @@
+import threading
+import time
+
+# The number of bulk requests in flight is adapted to the cluster the way TCP adapts its window (AIMD): it grows by
+# one per round of successful requests and is halved when the cluster pushes back, i.e. when documents are rejected
+# (429, es_rejected_execution_exception), when bulk requests become slow or when the write thread pool queue of a
+# node fills up. Once a single request at a time is still too much, the requests are also spaced out; the pause only
+# grows while requests fail as a whole or most of their documents are rejected, and shrinks again once per round
+# otherwise, a few rejected documents (which are retried) only hold the limit down.
+
+MIN_CONCURRENCY = 1
+
+# added to the limit per round of successful requests, and the factor the limit is multiplied with on overload
+INCREASE = 1
+DECREASE = 0.5
+
+# seconds a bulk request may take (smoothed) before the cluster is considered overloaded
+TARGET_LATENCY = 10.0
+LATENCY_SMOOTHING = 0.3
+
+# requests queued in the write thread pool of the busiest node before the cluster is considered overloaded
+QUEUE_LIMIT = 200
+
+# seconds between polls of the node stats, the upload rate is logged at the same interval
+STATS_INTERVAL = 10.0
+
+# pause between requests once the limit is down to a single request
+MIN_DELAY = 1.0
+MAX_DELAY = 60.0
+
+# share of the documents of a request that must be rejected for the pause to grow
+PAUSE_REJECTED_SHARE = 0.5
+
+REJECTED_ERROR = "es_rejected_execution_exception"
+
+
+# whether the result of a bulk item says the document was rejected because the cluster is overloaded
+def is_rejection(result):
+    if result.get("status") == 429:
+        return True
+    error = result.get("error")
+    return isinstance(error, dict) and error.get("type") == REJECTED_ERROR
+
+
+class AdaptiveLimiter:
+
+    def __init__(self, es=None, max_concurrency=1, min_concurrency=MIN_CONCURRENCY, target_latency=TARGET_LATENCY,
+                 queue_limit=QUEUE_LIMIT, stats_interval=STATS_INTERVAL):
+        self.es = es
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max(max_concurrency, min_concurrency)
+        self.target_latency = target_latency
+        self.queue_limit = queue_limit
+        self.stats_interval = stats_interval
+
+        # the limit grows by one per response until the cluster pushes back for the first time (slow start)
+        self.limit = float(min_concurrency)
+        self.slow_start = True
+        self.in_flight = 0
+        self.delay = 0.0
+        self.latency = None
+        self.last_decrease = 0.0
+        self.last_relax = 0.0
+
+        # write thread pool of the nodes at the last poll
+        self.queue = 0
+        self.node_rejections = None
+
+        self.documents = 0
+        self.bytes = 0
+        self.rejections = 0
+
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._monitor = None
+        self._logged = (time.monotonic(), 0, 0)
+
+    def start(self):
+        self._monitor = threading.Thread(target=self._poll, name="upload-backpressure", daemon=True)
+        self._monitor.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._monitor is not None:
+            self._monitor.join()
+        self.log()
+
+    # blocks until another request may be sent
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+            delay = self.delay
+
+        if delay > 0:
+            time.sleep(delay)
+
+    # reports the outcome of a request: its latency in seconds, the documents and bytes sent, the documents the
+    # cluster rejected, and whether the request failed as a whole
+    def release(self, latency, documents=0, size=0, rejected=0, failed=False):
+        with self._condition:
+            self.in_flight -= 1
+            self.documents += documents - rejected
+            self.bytes += size
+            self.rejections += rejected
+
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency += LATENCY_SMOOTHING * (latency - self.latency)
+
+            severe = failed or (documents > 0 and rejected / documents >= PAUSE_REJECTED_SHARE)
+            if severe or rejected > 0 or self.latency > self.target_latency:
+                self._decrease(pause=severe)
+            else:
+                self._increase()
+            if not severe:
+                self._relax()
+            self._condition.notify_all()
+
+    # the round the limit is adapted in, the time requests sent together take to report back
+    def _round(self):
+        return max(self.latency or 0.0, MIN_DELAY)
+
+    # the caller holds the lock; pause grows the pause between requests once the limit is at its minimum
+    def _decrease(self, pause=False):
+        self.slow_start = False
+
+        # the requests in flight when the cluster pushed back report it too, the limit is cut once per round
+        now = time.monotonic()
+        if now - self.last_decrease < self._round():
+            return
+        self.last_decrease = now
+
+        if pause and self.limit <= self.min_concurrency:
+            self.delay = min(max(self.delay * 2, MIN_DELAY), MAX_DELAY)
+        self.limit = max(float(self.min_concurrency), self.limit * DECREASE)
+
+    # the caller holds the lock; halves the pause once per round
+    def _relax(self):
+        now = time.monotonic()
+        if self.delay == 0 or now - self.last_relax < self._round():
+            return
+        self.last_relax = now
+        self.delay = self.delay / 2 if self.delay / 2 >= MIN_DELAY else 0.0
+
+    # the caller holds the lock
+    def _increase(self):
+        # the limit grows again once the requests are no longer spaced out
+        if self.delay > 0:
+            return
+
+        # hold the limit while the nodes are still working through a deep queue
+        if self.queue > self.queue_limit / 2:
+            return
+
+        step = INCREASE if self.slow_start else INCREASE / max(int(self.limit), 1)
+        self.limit = min(float(self.max_concurrency), self.limit + step)
+
+    def _poll(self):
+        while not self._stop.wait(self.stats_interval):
+            self.poll_node_stats()
+            self.log()
+
+    # reads the write thread pool queue and rejections of every node
+    def poll_node_stats(self):
+        if self.es is None:
+            return
+
+        try:
+            stats = self.es.nodes.stats(metric="thread_pool", filter_path="nodes.*.thread_pool.write")
+        except Exception as e:
+            print(f"Could not read the node stats: {e}")
+            return
+
+        pools = [node["thread_pool"]["write"] for node in stats.body.get("nodes", {}).values()]
+        queue = max((pool.get("queue", 0) for pool in pools), default=0)
+        node_rejections = sum(pool.get("rejected", 0) for pool in pools)
+
+        with self._condition:
+            rejected = self.node_rejections is not None and node_rejections > self.node_rejections
+            self.queue = queue
+            self.node_rejections = node_rejections
+            # rejections on the nodes may come from other clients, only a full queue is reason to pause
+            if rejected or queue > self.queue_limit:
+                self._decrease(pause=queue > self.queue_limit)
+
+    def log(self):
+        with self._condition:
+            now = time.monotonic()
+            last_time, last_documents, last_bytes = self._logged
+            elapsed = max(now - last_time, 1e-9)
+            self._logged = (now, self.documents, self.bytes)
+
+            print(
+                f"upload: {(self.documents - last_documents) / elapsed:.0f} documents/s, "
+                f"{(self.bytes - last_bytes) / elapsed / (1 << 20):.1f} MiB/s, "
+                f"concurrency {int(self.limit)}/{self.max_concurrency} ({self.in_flight} in flight), "
+                f"latency {self.latency or 0.0:.2f}s, write queue {self.queue}, {self.rejections} rejected"
+                + (f", pausing {self.delay:.0f}s between requests" if self.delay > 0 else "")
+            )
@@ -0,0 +1,76 @@
+import os
+
+# bounds for the automatically chosen token budget (padded source tokens per batch)
+MIN_TOKEN_BUDGET = 512
+MAX_TOKEN_BUDGET_CPU = 8192
+MAX_TOKEN_BUDGET_CUDA = 65536
+
+# share of the free memory that batches may use, the rest is left for the model and fragmentation
+MEMORY_FRACTION = 0.4
+
+# environment variable with the number of worker processes translating at once (parse --workers), set by
+# parallel_parse in every worker; they share the free memory, so each gets its part of the budget
+WORKERS_VARIABLE = "PARSE_WORKERS"
+
+# generated tokens per source token assumed when estimating the size of the decoder cache
+OUTPUT_LENGTH_RATIO = 1.5
+
+
+# groups inputs of similar length into batches whose padded size (batch size * longest input) stays within
+# token_budget; returns lists of indices into lengths, the longest inputs come first so that running out of
+# memory shows up at the start of a meeting and not at its end
+def plan_batches(lengths, token_budget, max_batch_size=64):
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i], reverse=True)
+
+    batches = []
+    batch = []
+    batch_length = 0
+    for i in order:
+        length = max(lengths[i], 1)
+        if batch and (len(batch) >= max_batch_size or (len(batch) + 1) * max(batch_length, length) > token_budget):
+            batches.append(batch)
+            batch = []
+            batch_length = 0
+
+        batch.append(i)
+        batch_length = max(batch_length, length)
+
+    if batch:
+        batches.append(batch)
+
+    return batches
+
+
+def available_memory(device):
+    if device == "cuda":
+        import torch
+        free, _ = torch.cuda.mem_get_info()
+        return free
+
+    # MemAvailable accounts for reclaimable page cache, unlike the free page count
+    try:
+        with open("/proc/meminfo", "r", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+
+
+# estimates how many padded source tokens fit into a batch from the free memory on the device and the size of
+# the decoder's key/value caches (self and cross attention) that beam search keeps for every token and beam; the
+# free memory is split evenly between the worker processes
+def auto_token_budget(model, device, num_beams=1):
+    config = model.config
+    layers = getattr(config, "decoder_layers", None) or getattr(config, "num_hidden_layers", 12)
+    hidden_size = getattr(config, "d_model", None) or getattr(config, "hidden_size", 1024)
+    element_size = next(model.parameters()).element_size()
+
+    bytes_per_token = 4 * layers * hidden_size * element_size * max(num_beams, 1) * (1 + OUTPUT_LENGTH_RATIO)
+    workers = max(int(os.environ.get(WORKERS_VARIABLE, 1)), 1)
+    budget = int(available_memory(device) * MEMORY_FRACTION / workers / bytes_per_token)
+
+    max_budget = MAX_TOKEN_BUDGET_CUDA if device == "cuda" else MAX_TOKEN_BUDGET_CPU
+    return max(MIN_TOKEN_BUDGET, min(budget, max_budget))
@@ -0,0 +1,105 @@
+# Compares the translation engines on the sentences of a sample meeting: throughput of every engine and how
+# closely its translations agree with the PyTorch (transformers) backend.
+#
+#   python benchmarks/compare_translation_engines.py -x DezelniZborKranjski-18610406-1.xml \
+#       --source-lang deu_Latn --target-lang slv_Latn --ct2-model nllb-ct2-int8 --limit 200
+
+import argparse
+import difflib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import translator
+from tei_reader import TeiReader
+from utils import parse_tag
+
+GENERATION_PARAMS = {
+    "num_beams": 3,
+    "early_stopping": False,
+    "length_penalty": 1.3,
+    "max_new_tokens": 512,
+}
+
+
+# collects the original text of every sentence, joined the same way as the parsers do it
+def read_sentences(path, limit):
+    sentences = []
+    for event, segment in TeiReader(path).events():
+        if event == "speaker":
+            continue
+
+        for sentence in segment:
+            if parse_tag(sentence) != "s":
+                continue
+
+            text = ""
+            for word in sentence:
+                word_text = word.text or ""
+                if parse_tag(word) != "pc" and word_text != "":
+                    text += " "
+                text += word_text
+            sentences.append(text.strip())
+
+            if len(sentences) >= limit:
+                return sentences
+
+    return sentences
+
+
+def run_engine(engine_name, sentences, source_lang, target_lang, **options):
+    translator.configure_translation_engine(engine_name, **options)
+
+    start = time.time()
+    engine = translator.get_translation_engine()
+    load_time = time.time() - start
+
+    start = time.time()
+    translations = engine.translate_batches_multi(
+        sentences, source_lang, [{target_lang}] * len(sentences), GENERATION_PARAMS
+    )[target_lang]
+    translate_time = time.time() - start
+
+    return [translations[text] for text in sentences], load_time, translate_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare translation engines on a sample meeting")
+    parser.add_argument("-x", "--xml", required=True, help="TEI file of the sample meeting")
+    parser.add_argument("--source-lang", default="deu_Latn", help="NLLB code of the meeting's language")
+    parser.add_argument("--target-lang", default="slv_Latn", help="NLLB code of the target language")
+    parser.add_argument("--ct2-model", required=True, help="Path to the converted CTranslate2 model")
+    parser.add_argument("--limit", type=int, default=200, help="Number of sentences to translate")
+    parser.add_argument("--intra-threads", type=int, default=0, help="Threads per translation (0 = engine default)")
+    parser.add_argument("--inter-threads", type=int, default=0, help="Parallel translations (0 = engine default)")
+    args = parser.parse_args()
+
+    sentences = list(dict.fromkeys(read_sentences(args.xml, args.limit)))
+    source_tokens = sum(len(text.split()) for text in sentences)
+    print(f"Translating {len(sentences)} distinct sentences ({source_tokens} words) from {args.xml}\n")
+
+    threads = {"intra_threads": args.intra_threads, "inter_threads": args.inter_threads}
+    reference, load_time, translate_time = run_engine(
+        "transformers", sentences, args.source_lang, args.target_lang, **threads
+    )
+    results = {"transformers": (reference, load_time, translate_time)}
+    results["ctranslate2"] = run_engine(
+        "ctranslate2", sentences, args.source_lang, args.target_lang, model_path=args.ct2_model, **threads
+    )
+
+    print(f"{'engine':<14}{'load [s]':>10}{'time [s]':>10}{'sent/s':>10}{'words/s':>10}{'exact':>8}{'similarity':>12}")
+    for engine_name, (translations, load_time, translate_time) in results.items():
+        exact = sum(a == b for a, b in zip(translations, reference)) / max(len(sentences), 1)
+        similarity = sum(
+            difflib.SequenceMatcher(None, a, b).ratio() for a, b in zip(translations, reference)
+        ) / max(len(sentences), 1)
+
+        print(f"{engine_name:<14}{load_time:>10.1f}{translate_time:>10.1f}"
+              f"{len(sentences) / translate_time:>10.2f}{source_tokens / translate_time:>10.1f}"
+              f"{exact:>8.1%}{similarity:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
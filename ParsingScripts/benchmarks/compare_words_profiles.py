@@ -0,0 +1,172 @@
+# Loads the same words files into an index with the default and one with the lean words-index profile and reports
+# the store size of both and the latency of the application's word searches on them, side by side.
+#
+#   python benchmarks/compare_words_profiles.py -s parsed/ --limit-files 200 --queries 300
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import parallel_uploader
+import uploader
+from elasticsearch import Elasticsearch
+
+INDEX_PREFIX = "words-profile-"
+
+
+def words_files(source_dir, limit):
+    files = sorted(
+        file_name for file_name in os.listdir(source_dir)
+        if uploader.index_for_file(file_name) == uploader.WORDS_INDEX_NAME
+    )
+    return [os.path.join(source_dir, file_name) for file_name in files[:limit]]
+
+
+# a sample of the loaded words the queries are made of
+def sample_words(paths, size, seed):
+    rng = random.Random(seed)
+    sample = []
+    seen = 0
+    for path in paths:
+        for element in uploader.iter_elements(path):
+            seen += 1
+            if len(sample) < size:
+                sample.append(element)
+            elif rng.random() < size / seen:
+                sample[rng.randrange(size)] = element
+
+    words = [json.loads(element) if isinstance(element, (bytes, str)) else element for element in sample]
+    return [word for word in words if word.get("text")]
+
+
+def load(es, index_name, profile, paths, chunk_size):
+    settings, mappings = uploader.WORDS_INDEX_PROFILES[profile]
+    if es.indices.exists(index=index_name):
+        es.indices.delete(index=index_name)
+    es.indices.create(index=index_name, settings=settings, mappings=mappings)
+
+    files = [(os.path.basename(path), path, index_name, None) for path in paths]
+    start = time.time()
+    documents = 0
+    for chunk in parallel_uploader.read_chunks(files, uploader.read_actions, chunk_size=chunk_size):
+        failed = parallel_uploader.send_chunk(es, chunk)
+        documents += len(chunk.actions) - len(failed)
+    load_time = time.time() - start
+
+    # merged like after a blue/green build, so the sizes compare the final indices
+    es.indices.put_settings(index=index_name, settings={"index.refresh_interval": "1s"})
+    es.indices.refresh(index=index_name)
+    es.options(request_timeout=3600).indices.forcemerge(index=index_name, max_num_segments=1)
+    es.indices.refresh(index=index_name)
+
+    stats = es.indices.stats(index=index_name, metric="store,docs")["indices"][index_name]["primaries"]
+    return {
+        "documents": documents,
+        "load": load_time,
+        "store": stats["store"]["size_in_bytes"],
+    }
+
+
+# the words query of the backend (wordsIndexQueryBuildersUtils.wordsSearchQueryBuilder), paged by word_id.sort
+def words_query(word, loose):
+    return {
+        "bool": {
+            "filter": [{"term": {"meeting_id": word["meeting_id"]}}],
+            "must": [{
+                "multi_match": {
+                    "query": word["text"],
+                    "type": "best_fields",
+                    "fields": ["text", "lemma"],
+                    "minimum_should_match": 1,
+                    "fuzziness": "AUTO:3,6" if loose else "0"
+                }
+            }]
+        }
+    }
+
+
+# the query of the words at given positions of a sentence (positionWordSearchQueryBuilder)
+def position_query(word):
+    return {
+        "bool": {
+            "filter": [
+                {"term": {"sentence_id": word["sentence_id"]}},
+                {"term": {"lang": word["lang"]}},
+                {"terms": {"wpos": [word["wpos"]]}}
+            ]
+        }
+    }
+
+
+def measure(es, index_name, queries):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        es.search(index=index_name, query=query, size=1000, sort=[{"word_id.sort": {"order": "asc"}}],
+                  request_cache=False)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the default and the lean words-index profile")
+    parser.add_argument("-s", "--source", required=True, help="Directory with the parsed *_words files")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--limit-files", type=int, default=100, help="Number of words files loaded")
+    parser.add_argument("--queries", type=int, default=200, help="Queries of every kind per index")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="Keep the two indices afterwards")
+    args = parser.parse_args()
+
+    es = Elasticsearch([{"host": args.host, "port": args.port, "scheme": "http"}], request_timeout=600)
+    paths = words_files(args.source, args.limit_files)
+    if not paths:
+        raise SystemExit(f"No words files in {args.source}")
+
+    results = {}
+    for profile in uploader.WORDS_INDEX_PROFILES:
+        print(f"Loading {len(paths)} file(s) into {INDEX_PREFIX + profile}")
+        results[profile] = load(es, INDEX_PREFIX + profile, profile, paths, args.chunk_size)
+
+    words = sample_words(paths, args.queries, args.seed)
+    query_sets = {
+        "exact search": [words_query(word, False) for word in words],
+        "loose search": [words_query(word, True) for word in words],
+        "positions": [position_query(word) for word in words],
+    }
+
+    for name, queries in query_sets.items():
+        # a warm-up round, then the profiles take turns so neither profits from a warmer cache
+        for profile in results:
+            measure(es, INDEX_PREFIX + profile, queries[:20])
+        for profile in results:
+            results[profile][name] = measure(es, INDEX_PREFIX + profile, queries)
+
+    profiles = list(results)
+    print()
+    print(f"{'':<24}" + "".join(f"{profile:>18}" for profile in profiles))
+    print(f"{'documents':<24}" + "".join(f"{results[p]['documents']:>18}" for p in profiles))
+    print(f"{'load time (s)':<24}" + "".join(f"{results[p]['load']:>18.1f}" for p in profiles))
+    print(f"{'store size (MiB)':<24}" + "".join(f"{results[p]['store'] / (1 << 20):>18.1f}" for p in profiles))
+    print(f"{'bytes per word':<24}" +
+          "".join(f"{results[p]['store'] / max(results[p]['documents'], 1):>18.1f}" for p in profiles))
+    for name in query_sets:
+        print(f"{name + ' p50/p95 (ms)':<24}" +
+              "".join(f"{results[p][name][0]:>11.1f}/{results[p][name][1]:<6.1f}" for p in profiles))
+
+    if not args.keep:
+        for profile in profiles:
+            es.indices.delete(index=INDEX_PREFIX + profile)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+# A local stand-in for Elasticsearch that speaks enough of the API to take the uploader's traffic: indices
+# (exists, create, delete, settings, refresh, force merge), aliases, _bulk and the node stats the upload's
+# backpressure reads. Documents are counted, not stored. Bulk requests can be slowed down and documents rejected
+# with 429 the way an overloaded cluster does: all of them once more bulk requests are in flight than the simulated
+# cluster takes (--capacity), or a share of them (--reject-rate) while the request overlaps others, so the rejections
+# fade once the client backs off to one request at a time.
+#
+#   python benchmarks/fake_elasticsearch.py --port 9299 --latency 0.02 --capacity 4
+#
+# GET /_bench/stats returns the documents, bytes and requests received per index, POST /_bench/reset clears them.
+
+import argparse
+import fnmatch
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+class ClusterState:
+
+    def __init__(self, latency=0.0, latency_per_document=0.0, reject_rate=0.0, capacity=None, seed=None):
+        self.latency = latency
+        self.latency_per_document = latency_per_document
+        self.reject_rate = reject_rate
+        self.capacity = capacity
+        self.random = random.Random(seed)
+
+        self.lock = threading.Lock()
+        self.indices = {}
+        self.aliases = {}
+        self.in_flight = 0
+        self.rejected = 0
+        self.stats = {}
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {}
+            self.rejected = 0
+
+    def record(self, index_name, documents, size, rejected):
+        with self.lock:
+            stats = self.stats.setdefault(index_name, {
+                "documents": 0, "bytes": 0, "requests": 0, "rejected": 0, "first": time.time(), "last": 0.0
+            })
+            stats["documents"] += documents
+            stats["bytes"] += size
+            stats["requests"] += 1
+            stats["rejected"] += rejected
+            stats["last"] = time.time()
+            self.rejected += rejected
+
+    def resolve(self, name):
+        if name in self.indices:
+            return [name]
+        return [index_name for index_name, aliases in self.aliases.items() if name in aliases]
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are written separately, with Nagle's algorithm every response would wait for the
+    # client's delayed ACK
+    disable_nagle_algorithm = True
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("X-Elastic-Product", "Elasticsearch")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except ConnectionError:
+            # the client is gone, e.g. a benchmark run stopped at its time limit
+            self.close_connection = True
+
+    def read_body(self):
+        data = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.headers.get("Content-Encoding") == "gzip":
+            data = gzip.decompress(data)
+        return data
+
+    def do_HEAD(self):
+        self.route("HEAD")
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_DELETE(self):
+        self.route("DELETE")
+
+    def route(self, method):
+        body = self.read_body()
+        parts = [part for part in urlparse(self.path).path.split("/") if part]
+        state = self.state
+
+        if not parts:
+            return self.reply(200, {"name": "fake", "cluster_name": "fake", "version": {"number": "8.15.1"},
+                                    "tagline": "You Know, for Search"})
+        if parts[0] == "_bench":
+            if parts[-1] == "reset":
+                state.reset_stats()
+                return self.reply(200, {"acknowledged": True})
+            with state.lock:
+                return self.reply(200, {"indices": state.stats, "rejected": state.rejected})
+        if parts[0] == "_nodes":
+            with state.lock:
+                queue = max(0, state.in_flight - (state.capacity or state.in_flight))
+                write = {"threads": state.capacity or 1, "queue": queue, "active": state.in_flight,
+                         "rejected": state.rejected}
+            return self.reply(200, {"nodes": {"fake": {"thread_pool": {"write": write}}}})
+        if parts[0] == "_alias":
+            return self.alias(method, parts[1])
+        if parts[0] == "_aliases":
+            return self.update_aliases(json.loads(body))
+        if parts[0] == "_bulk" or (len(parts) > 1 and parts[1] == "_bulk"):
+            return self.bulk(parts[0] if parts[0] != "_bulk" else None, body)
+        if len(parts) > 1:
+            return self.index_operation(method, parts[0], parts[1], body)
+        return self.index(method, parts[0], body)
+
+    def alias(self, method, name):
+        with self.state.lock:
+            indices = [index_name for index_name, aliases in self.state.aliases.items() if name in aliases]
+        if method == "HEAD":
+            return self.reply(200 if indices else 404)
+        return self.reply(200 if indices else 404, {index_name: {"aliases": {name: {}}} for index_name in indices})
+
+    def update_aliases(self, request):
+        with self.state.lock:
+            for action in request["actions"]:
+                (kind, options), = action.items()
+                if kind == "add":
+                    self.state.aliases.setdefault(options["index"], set()).add(options["alias"])
+                elif kind == "remove":
+                    self.state.aliases.get(options["index"], set()).discard(options["alias"])
+                elif kind == "remove_index":
+                    self.state.indices.pop(options["index"], None)
+                    self.state.aliases.pop(options["index"], None)
+        return self.reply(200, {"acknowledged": True})
+
+    def index(self, method, name, body):
+        with self.state.lock:
+            if method == "HEAD":
+                return self.reply(200 if self.state.resolve(name) else 404)
+            if method == "PUT":
+                if name in self.state.indices:
+                    return self.reply(400, {"error": {"type": "resource_already_exists_exception"}, "status": 400})
+                self.state.indices[name] = json.loads(body or b"{}")
+                return self.reply(200, {"acknowledged": True, "index": name})
+            if method == "DELETE":
+                self.state.indices.pop(name, None)
+                self.state.aliases.pop(name, None)
+                return self.reply(200, {"acknowledged": True})
+            indices = [index_name for index_name in self.state.indices if fnmatch.fnmatch(index_name, name)]
+            return self.reply(200, {index_name: self.state.indices[index_name] for index_name in indices})
+
+    # the aliases of an index; _settings, _refresh, _forcemerge, _stats, ... are acknowledged
+    def index_operation(self, method, name, operation, body):
+        if not self.state.resolve(name.split(",")[0]) and "*" not in name:
+            return self.reply(404, {"error": {"type": "index_not_found_exception"}, "status": 404})
+        if operation == "_alias" and method == "GET":
+            with self.state.lock:
+                aliases = self.state.aliases.get(name, set())
+                return self.reply(200, {name: {"aliases": {alias: {} for alias in aliases}}})
+        return self.reply(200, {"acknowledged": True, "_shards": {"total": 1, "successful": 1, "failed": 0}})
+
+    def bulk(self, index_name, body):
+        state = self.state
+        lines = body.split(b"\n")
+        with state.lock:
+            state.in_flight += 1
+            overloaded = state.capacity is not None and state.in_flight > state.capacity
+            busy = state.in_flight > 1
+
+        try:
+            items = []
+            errors = False
+            documents = 0
+            rejected = 0
+            for i in range(0, len(lines) - 1, 2):
+                action = json.loads(lines[i])
+                (op_type, meta), = action.items()
+                target = meta.get("_index", index_name)
+                if overloaded or (busy and state.reject_rate > 0 and state.random.random() < state.reject_rate):
+                    errors = True
+                    rejected += 1
+                    items.append({op_type: {"_index": target, "status": 429, "error": {
+                        "type": "es_rejected_execution_exception", "reason": "rejected execution (simulated)"}}})
+                else:
+                    documents += 1
+                    items.append({op_type: {"_index": target, "_id": meta.get("_id"), "status": 201}})
+
+            time.sleep(state.latency + state.latency_per_document * (len(lines) // 2))
+            state.record(index_name or "_bulk", documents, len(body), rejected)
+            return self.reply(200, {"took": 1, "errors": errors, "items": items})
+        finally:
+            with state.lock:
+                state.in_flight -= 1
+
+
+# starts the stand-in in a background thread, returns the server (server.server_address[1] is the port)
+def serve(port=0, **options):
+    handler = type("BoundHandler", (Handler,), {"state": ClusterState(**options)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-elasticsearch", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stand-in for Elasticsearch")
+    parser.add_argument("--port", type=int, default=9299)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds every bulk request takes")
+    parser.add_argument("--latency-per-document", type=float, default=0.0, help="Seconds added per document")
+    parser.add_argument("--reject-rate", type=float, default=0.0,
+                        help="Share of documents rejected with 429 while bulk requests overlap")
+    parser.add_argument("--capacity", type=int, default=None,
+                        help="Bulk requests handled at once, the documents of further requests are rejected")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    server = serve(args.port, latency=args.latency, latency_per_document=args.latency_per_document,
+                   reject_rate=args.reject_rate, capacity=args.capacity, seed=args.seed)
+    print(f"Fake Elasticsearch listening on http://127.0.0.1:{server.server_address[1]}", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# Measures lemmatization throughput (tokens/s) per language: the full spaCy pipelines in a single process (as
+# batch_lemmatize used to run), the lean lemmatizer profiles in a single process (as inside the translate/lemmatize
+# pipeline of a meeting) and the lean profiles fanned out over the processes batch_lemmatize chooses from the cores,
+# or over --processes. Sentences are taken from TEI files, a DZK file gives German and Slovene, a Yu1Parl file
+# Slovene, Croatian and Serbian.
+#
+#   python benchmarks/lemmatizer_throughput.py -x DezelniZborKranjski-18610406-1.xml Yu1Parl_1919-03-20.xml --limit 5000
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lemmatizer
+from tei_reader import TeiReader
+from utils import parse_attribs, parse_tag
+
+
+# collects the original text of the sentences by language, joined the same way as the parsers do it
+def read_sentences(paths, limit):
+    sentences = {}
+    for path in paths:
+        for event, segment in TeiReader(path).events():
+            if event == "speaker":
+                continue
+
+            for sentence in segment:
+                if parse_tag(sentence) != "s":
+                    continue
+
+                lang = parse_attribs(sentence).get("lang")
+                texts = sentences.setdefault(lang, [])
+                if len(texts) >= limit:
+                    continue
+
+                text = ""
+                for word in sentence:
+                    word_text = word.text or ""
+                    if parse_tag(word) != "pc" and word_text != "":
+                        text += " "
+                    text += word_text
+                texts.append(text.strip())
+
+    return sentences
+
+
+def run(nlp, texts, batch_size, n_process):
+    start = time.time()
+    tokens = sum(len(doc) for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process))
+    return tokens, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lemmatization throughput per language")
+    parser.add_argument("-x", "--xml", nargs="+", required=True, help="TEI files to take the sentences from")
+    parser.add_argument("-l", "--langs", nargs="+", default=["sl", "de", "hr", "sr"], help="Languages to measure")
+    parser.add_argument("--limit", type=int, default=5000, help="Sentences per language")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Processes of the fan-out, chosen from the cores and sentences by default")
+    args = parser.parse_args()
+
+    sentences = read_sentences(args.xml, args.limit)
+
+    print(f"{'lang':<6}{'sentences':>10}{'setup':>9}{'processes':>11}{'pipes':>48}{'tokens/s':>12}")
+    for lang in args.langs:
+        texts = sentences.get(lang)
+        if not texts:
+            print(f"{lang:<6}no sentences in the given files")
+            continue
+
+        # the old batch_lemmatize: every component enabled, batches of 64, one process
+        nlp = lemmatizer.load_pipeline(lang, lean=False)
+        setups = [("before", nlp, 64, 1)]
+
+        nlp = lemmatizer.load_pipeline(lang)
+        batch_size = lemmatizer.LEMMATIZER_PROFILES[lang]["batch_size"]
+        n_process = args.processes or lemmatizer.pipe_processes(lang, len(texts))
+        setups += [("lean", nlp, batch_size, 1), ("fan-out", nlp, batch_size, n_process)]
+
+        for setup, nlp, batch_size, n_process in setups:
+            tokens, elapsed = run(nlp, texts, batch_size, n_process)
+            print(f"{lang:<6}{len(texts):>10}{setup:>9}{n_process:>11}{','.join(nlp.pipe_names):>48}"
+                  f"{tokens / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+# Measures the throughput of uploader.upload in the sequential, parallel and async modes against the local
+# Elasticsearch stand-in (fake_elasticsearch.py). Every mode uploads the meetings, sentences and words on their own
+# and then all of them together, each run in a process of its own that is stopped after --time-limit seconds, so a
+# slow mode reports what it managed instead of holding up the rest; reported are documents/s, MiB/s of bulk bodies
+# and the uploader's CPU time. Needs no network and no cluster.
+#
+#   python benchmarks/upload_throughput.py --meetings 20 --latency 0.01 --capacity 6
+#   python benchmarks/upload_throughput.py --source parsed/ --modes parallel async --reject-rate 0.01
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import socket
+import string
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uploader
+import utils
+from jsonl_io import COMPRESSION_SUFFIXES, write_jsonl
+from meeting_model import Meeting, Sentence, Word
+
+FAKE_ELASTICSEARCH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_elasticsearch.py")
+
+INDEX_TYPES = {
+    "meetings": uploader.MEETINGS_INDEX_NAME,
+    "sentences": uploader.SENTENCES_INDEX_NAME,
+    "words": uploader.WORDS_INDEX_NAME,
+}
+
+
+def make_vocabulary(rng, size=5000):
+    return ["".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 12))) for _ in range(size)]
+
+
+# a meeting in two languages shaped like the parsers' output, with coordinates for the original words
+def make_meeting(rng, vocabulary, number, sentences, words_per_sentence):
+    meeting_id = f"DezelniZborKranjski-1861{number:04d}-1"
+    speakers = [" ".join(rng.choice(vocabulary).capitalize() for _ in range(2)) for _ in range(8)]
+    coords_index = {}
+
+    meeting_sentences = []
+    for s in range(sentences):
+        segment_id = f"{meeting_id}.seg{s // 5}"
+        sentence = Sentence(f"{segment_id}.s{s}", s // 40 + 1, segment_id, rng.choice(speakers))
+        for lang, original in (("de", 1), ("sl", 0)):
+            words = []
+            for w in range(rng.randint(words_per_sentence // 2, words_per_sentence * 3 // 2)):
+                text = rng.choice(vocabulary)
+                word_id = f"{sentence.id}.w{w}" if original else f"{sentence.id}.w{w}.{lang}"
+                words.append(Word(word_id, "w", text[:-1] or text, text, None, int(rng.random() < 0.05)))
+                if original:
+                    x0 = rng.uniform(0, 500)
+                    y0 = rng.uniform(0, 800)
+                    coords_index[word_id] = [{"page": sentence.segment_page, "x0": x0, "y0": y0,
+                                              "x1": x0 + 40, "y1": y0 + 10}]
+            sentence.add_translation(lang, " ".join(word.text for word in words), words, original)
+        sentence.original_language = "de"
+        meeting_sentences.append(sentence)
+
+    titles = [{"lang": "sl", "title": " ".join(rng.choice(vocabulary) for _ in range(6))}]
+    return Meeting(meeting_id, "06.04.1861", titles, [], meeting_sentences, [], "dzk"), coords_index
+
+
+# writes a synthetic corpus into one directory per index type
+def generate_corpus(directory, meetings, sentences, words_per_sentence, compression, seed):
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(rng)
+    suffix = ".jsonl" + COMPRESSION_SUFFIXES[compression]
+    for index_type in INDEX_TYPES:
+        os.makedirs(os.path.join(directory, index_type), exist_ok=True)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        for number in range(meetings):
+            meeting, coords_index = make_meeting(rng, vocabulary, number, sentences, words_per_sentence)
+            base = meeting.id
+            write_jsonl([meeting.to_dict()], os.path.join(directory, "meetings", base + "_meeting" + suffix))
+            write_jsonl(utils.transform_sentences_fast(meeting, coords_index),
+                        os.path.join(directory, "sentences", base + "_sentences" + suffix))
+            write_jsonl(utils.transform_words_fast(meeting, coords_index),
+                        os.path.join(directory, "words", base + "_words" + suffix))
+
+
+# links the files of an existing directory of parser output into one directory per index type
+def link_corpus(source, directory):
+    for index_type in INDEX_TYPES:
+        os.makedirs(os.path.join(directory, index_type), exist_ok=True)
+
+    for file_name in os.listdir(source):
+        index_name = uploader.index_for_file(file_name)
+        for index_type, type_index_name in INDEX_TYPES.items():
+            if index_name == type_index_name:
+                os.symlink(os.path.abspath(os.path.join(source, file_name)),
+                           os.path.join(directory, index_type, file_name))
+
+
+def link_all(directory):
+    all_directory = os.path.join(directory, "all")
+    os.makedirs(all_directory, exist_ok=True)
+    for index_type in INDEX_TYPES:
+        for file_name in os.listdir(os.path.join(directory, index_type)):
+            os.symlink(os.path.realpath(os.path.join(directory, index_type, file_name)),
+                       os.path.join(all_directory, file_name))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_elasticsearch(port, args):
+    command = [sys.executable, FAKE_ELASTICSEARCH, "--port", str(port), "--latency", str(args.latency),
+               "--latency-per-document", str(args.latency_per_document), "--reject-rate", str(args.reject_rate),
+               "--seed", "1"]
+    if args.capacity is not None:
+        command += ["--capacity", str(args.capacity)]
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    process.stdout.readline()
+    return process
+
+
+def bench_request(port, path, method="GET"):
+    request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", method=method)
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+
+def _upload(source_dir, port, mode, threads, chunk_size, journal_path, verbose):
+    with contextlib.redirect_stdout(sys.stdout if verbose else io.StringIO()):
+        uploader.upload(source_dir, "127.0.0.1", port, mode=mode, threads=threads, chunk_size=chunk_size,
+                        journal_path=journal_path)
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(port, source_dir, mode, args, work_dir):
+    bench_request(port, "/_bench/reset", "POST")
+    journal_path = os.path.join(work_dir, f"journal-{mode}-{os.path.basename(source_dir)}.sqlite")
+
+    # the stand-in is a child too, but it is only reaped at the end, so the difference is the upload's CPU time
+    cpu_start = _children_cpu()
+    wall_start = time.perf_counter()
+    process = multiprocessing.Process(
+        target=_upload, args=(source_dir, port, mode, args.threads, args.chunk_size, journal_path, args.verbose)
+    )
+    process.start()
+    process.join(args.time_limit)
+    timed_out = process.is_alive()
+    if timed_out:
+        process.terminate()
+        process.join()
+    wall = time.perf_counter() - wall_start
+    cpu = _children_cpu() - cpu_start
+
+    stats = bench_request(port, "/_bench/stats")
+    return {
+        "documents": sum(index["documents"] for index in stats["indices"].values()),
+        "bytes": sum(index["bytes"] for index in stats["indices"].values()),
+        "requests": sum(index["requests"] for index in stats["indices"].values()),
+        "rejected": stats["rejected"],
+        "wall": wall,
+        "cpu": cpu,
+        "timed_out": timed_out,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload throughput against a local Elasticsearch stand-in")
+    parser.add_argument("--source", default=None, help="Directory of parser output (default: a synthetic corpus)")
+    parser.add_argument("--meetings", type=int, default=10, help="Meetings of the synthetic corpus")
+    parser.add_argument("--sentences", type=int, default=400, help="Sentences per synthetic meeting")
+    parser.add_argument("--words-per-sentence", type=int, default=20)
+    parser.add_argument("--compression", default=None, choices=["gzip", "zstd"])
+    parser.add_argument("--modes", nargs="+", default=["sequential", "parallel", "async"],
+                        choices=["sequential", "parallel", "async"])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.005, help="Seconds every bulk request takes")
+    parser.add_argument("--latency-per-document", type=float, default=0.0)
+    parser.add_argument("--reject-rate", type=float, default=0.0,
+                        help="Share of documents rejected with 429 while bulk requests overlap")
+    parser.add_argument("--capacity", type=int, default=None, help="Bulk requests the stand-in handles at once")
+    parser.add_argument("--time-limit", type=float, default=120.0, help="Seconds after which a run is stopped")
+    parser.add_argument("--verbose", action="store_true", help="Show the uploader's output")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="upload-throughput-") as work_dir:
+        corpus = os.path.join(work_dir, "corpus")
+        if args.source:
+            link_corpus(args.source, corpus)
+        else:
+            generate_corpus(corpus, args.meetings, args.sentences, args.words_per_sentence, args.compression, 1)
+        link_all(corpus)
+
+        port = free_port()
+        server = start_fake_elasticsearch(port, args)
+        try:
+            print(f"{'mode':<12}{'index':<11}{'documents':>10}{'docs/s':>10}{'MiB/s':>8}{'CPU s':>8}"
+                  f"{'CPU %':>7}{'requests':>10}{'rejected':>10}")
+            for mode in args.modes:
+                for index_type in list(INDEX_TYPES) + ["all"]:
+                    result = run(port, os.path.join(corpus, index_type), mode, args, work_dir)
+                    wall = max(result["wall"], 1e-9)
+                    print(f"{mode:<12}{index_type:<11}{result['documents']:>10}"
+                          f"{result['documents'] / wall:>10.0f}{result['bytes'] / wall / (1 << 20):>8.1f}"
+                          f"{result['cpu']:>8.2f}{100 * result['cpu'] / wall:>7.0f}"
+                          f"{result['requests']:>10}{result['rejected']:>10}"
+                          + ("  stopped at the time limit" if result["timed_out"] else ""), flush=True)
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    main()
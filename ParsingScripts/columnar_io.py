@@ -0,0 +1,138 @@
+import os
+
+# Columnar output of the sentences and words indices. Repeated strings (meeting, sentence and segment ids,
+# speakers, languages, lemmas, ...) are dictionary encoded and the numbers are stored as integers, so the files are
+# a fraction of the size of JSONL and can be scanned column by column. pyarrow is optional, it is only needed when
+# parsing with --output-format arrow/parquet and when uploading such files.
+
+# file name suffixes of the columnar formats; Arrow files are written in the IPC stream format, which, unlike the
+# IPC file format, allows the dictionaries to differ between record batches
+COLUMNAR_SUFFIXES = {
+    "arrow": ".arrows",
+    "parquet": ".parquet",
+}
+
+# rows converted to a record batch at once
+BATCH_SIZE = 65536
+
+PARQUET_COMPRESSION = "zstd"
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError("Arrow and Parquet files need the pyarrow package (pip install pyarrow)")
+    return pyarrow
+
+
+def _coordinates_type(pa):
+    return pa.list_(pa.struct([
+        ("page", pa.int32()),
+        ("x0", pa.float64()),
+        ("y0", pa.float64()),
+        ("x1", pa.float64()),
+        ("y1", pa.float64()),
+    ]))
+
+
+# schema of the documents produced by utils.transform_sentences_fast
+def sentences_schema():
+    pa = _pyarrow()
+    repeated = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("meeting_id", repeated),
+        ("sentence_id", pa.string()),
+        ("segment_id", repeated),
+        ("speaker", repeated),
+        ("coordinates", _coordinates_type(pa)),
+        ("translations", pa.list_(pa.struct([
+            ("text", pa.string()),
+            ("lang", pa.string()),
+            ("original", pa.int8()),
+        ]))),
+    ])
+
+
+# schema of the documents produced by utils.transform_words_fast
+def words_schema():
+    pa = _pyarrow()
+    repeated = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("meeting_id", repeated),
+        ("sentence_id", repeated),
+        ("segment_id", repeated),
+        ("word_id", pa.string()),
+        ("type", repeated),
+        ("join", repeated),
+        ("text", repeated),
+        ("lemma", repeated),
+        ("speaker", repeated),
+        ("pos", pa.int32()),
+        ("wpos", pa.int32()),
+        ("coordinates", _coordinates_type(pa)),
+        ("lang", repeated),
+        ("original", pa.int8()),
+        ("propn", pa.int8()),
+    ])
+
+
+def format_of(path):
+    for output_format, suffix in COLUMNAR_SUFFIXES.items():
+        if path.endswith(suffix):
+            return output_format
+    return None
+
+
+def _batches(elements, schema):
+    pa = _pyarrow()
+    rows = []
+    for element in elements:
+        rows.append(element)
+        if len(rows) >= BATCH_SIZE:
+            yield pa.RecordBatch.from_pylist(rows, schema=schema)
+            rows = []
+    if rows:
+        yield pa.RecordBatch.from_pylist(rows, schema=schema)
+
+
+# writes the elements (any iterable, e.g. a generator) batch by batch, the format follows from the suffix of the path
+def save_to_columnar(elements, file_path, schema):
+    pa = _pyarrow()
+
+    count = 0
+    if format_of(file_path) == "parquet":
+        import pyarrow.parquet as pq
+        with pq.ParquetWriter(file_path, schema, compression=PARQUET_COMPRESSION) as writer:
+            for batch in _batches(elements, schema):
+                writer.write_batch(batch)
+                count += batch.num_rows
+    else:
+        with pa.ipc.new_stream(file_path, schema) as writer:
+            for batch in _batches(elements, schema):
+                writer.write_batch(batch)
+                count += batch.num_rows
+
+    print("Saved " + str(count) + " elements to " + file_path)
+
+
+# yields the rows of an Arrow or Parquet file as dicts; the file is memory mapped instead of read into memory
+def read_columnar(file_path, batch_size=BATCH_SIZE):
+    pa = _pyarrow()
+
+    if format_of(file_path) == "parquet":
+        import pyarrow.parquet as pq
+        batches = pq.ParquetFile(file_path, memory_map=True).iter_batches(batch_size=batch_size)
+    else:
+        batches = pa.ipc.open_stream(pa.memory_map(file_path))
+
+    for batch in batches:
+        yield from batch.to_pylist()
+
+
+# the JSONL name the columnar file stands in for, e.g. "x_words.parquet" -> "x_words.jsonl"
+def jsonl_name(path):
+    output_format = format_of(path)
+    if output_format is None:
+        return path
+    return os.path.splitext(path)[0] + ".jsonl"
@@ -0,0 +1,137 @@
+import statistics
+
+import fitz
+
+# Classifies the page images of a PDF so the optimizer can pick the Ghostscript image settings per document instead
+# of one preset for all of them. Scans come in four kinds:
+#   mono     1-bit images
+#   bitonal  gray or colour scans of text that are nearly all black and white, best stored as 1 bit
+#   gray     gray scans with real shades (drawings, faded print)
+#   color    colour scans and photos
+# and vector for documents without page images, where the image settings do not matter. Reducing to 1 bit is lossy
+# for the whole document, so every image on every page is classified and a document is only bitonal when all of its
+# images are bitonal or 1 bit; a volume of text scans with a single photo or map plate is mixed and keeps the fixed
+# settings.
+
+IMAGE_CLASSES = ("mono", "bitonal", "gray", "color", "mixed", "vector")
+
+# images smaller than this (pixels per side) are decorations and do not count
+MIN_IMAGE_SIZE = 64
+
+# pixels between these values are mid tones; an image is bitonal when fewer of them than BITONAL_MAX_MIDTONES are.
+# Paper of old scans is far from white, the light end of the range is well below it
+MIDTONE_RANGE = (80, 176)
+BITONAL_MAX_MIDTONES = 0.06
+
+# pixels counted per image; they are picked spread over the image rather than averaged into a smaller pixmap, which
+# would turn the edges of the letters into mid tones
+MIDTONE_SAMPLES = 65536
+
+# below this resolution 1 bit loses the strokes of the letters, such scans are kept gray
+MIN_BITONAL_DPI = 200
+
+# resolution bitonal scans are reduced to, 1 bit at the 150 dpi of the gray images would break the letters
+BITONAL_RESOLUTION = 300
+
+# maps a gray sample to 1 if it is a mid tone, used to count them with bytes.count
+_MIDTONE_TABLE = bytes(1 if MIDTONE_RANGE[0] <= value < MIDTONE_RANGE[1] else 0 for value in range(256))
+
+
+def _midtone_share(doc, xref):
+    pixmap = fitz.Pixmap(doc, xref)
+    if pixmap.alpha:
+        pixmap = fitz.Pixmap(pixmap, 0)
+    if pixmap.n != 1:
+        pixmap = fitz.Pixmap(fitz.csGRAY, pixmap)
+
+    # every step-th pixel; a step dividing the width would only pick a few columns
+    samples = pixmap.samples
+    step = max(1, len(samples) // MIDTONE_SAMPLES)
+    if step > 1 and pixmap.width % step == 0:
+        step += 1
+    samples = samples[::step]
+    return samples.translate(_MIDTONE_TABLE).count(1) / max(len(samples), 1)
+
+
+# the class of one image and its effective resolution, i.e. its pixels per inch of the page it is shown on;
+# midtone_share(xref) returns the share of mid tones of the image
+def classify_image(info, midtone_share):
+    x0, y0, x1, y1 = info["bbox"]
+    dpi = info["width"] / max((x1 - x0) / 72, 1e-6)
+
+    if info["bpc"] == 1:
+        return "mono", dpi
+    if dpi >= MIN_BITONAL_DPI and midtone_share(info["xref"]) < BITONAL_MAX_MIDTONES:
+        return "bitonal", dpi
+    if info["colorspace"] == 1:
+        return "gray", dpi
+    return "color", dpi
+
+
+def _page_images(doc, page_number):
+    seen = set()
+    for info in doc[page_number].get_image_info(xrefs=True):
+        if info["xref"] in seen or min(info["width"], info["height"]) < MIN_IMAGE_SIZE:
+            continue
+        seen.add(info["xref"])
+        yield info
+
+
+# Returns the class of the document, the median effective resolution of its images and the class mix, the share of
+# the image area per class. Every image of every page is classified, the mid tones of an image shown on several pages
+# are counted once. The class is the one covering the largest area, except that bitonal needs every image to be
+# bitonal or 1 bit, otherwise the document is mixed.
+def analyze_pdf(path):
+    areas = dict.fromkeys(IMAGE_CLASSES, 0.0)
+    resolutions = {image_class: [] for image_class in IMAGE_CLASSES}
+    midtone_shares = {}
+
+    with fitz.open(path) as doc:
+        def midtone_share(xref):
+            if xref not in midtone_shares:
+                midtone_shares[xref] = _midtone_share(doc, xref)
+            return midtone_shares[xref]
+
+        for page_number in range(doc.page_count):
+            for info in _page_images(doc, page_number):
+                image_class, dpi = classify_image(info, midtone_share)
+                x0, y0, x1, y1 = info["bbox"]
+                areas[image_class] += abs((x1 - x0) * (y1 - y0))
+                resolutions[image_class].append(dpi)
+
+    total = sum(areas.values())
+    if total == 0:
+        return {"class": "vector", "dpi": None, "mix": {}}
+    mix = {image_class: area / total for image_class, area in areas.items() if area > 0}
+
+    image_class = max(areas, key=areas.get)
+    if image_class == "bitonal" and (resolutions["gray"] or resolutions["color"]):
+        image_class = "mixed"
+    if image_class == "mixed":
+        dpi = statistics.median(dpi for class_resolutions in resolutions.values() for dpi in class_resolutions)
+    else:
+        dpi = statistics.median(resolutions[image_class])
+    return {"class": image_class, "dpi": dpi, "mix": mix}
+
+
+# the class mix as text, e.g. "bitonal 62%, color 38%"
+def format_mix(mix):
+    shares = sorted(mix.items(), key=lambda item: item[1], reverse=True)
+    return ", ".join(f"{image_class} {share:.0%}" for image_class, share in shares)
+
+
+# Ghostscript options for a document of the class, given after the optimizer's fixed image options they override.
+# The fixed ones (1-bit images CCITT encoded at 300 dpi, gray and colour JPEG at 150 dpi) suit mono, gray, colour and
+# mixed documents; bitonal scans are converted to gray and their images reduced to 1 bit, Flate encoded as JPEG
+# needs 8 bits, at BITONAL_RESOLUTION or the median resolution of the scans (dpi) if that is lower
+def ghostscript_image_settings(image_class, dpi=None):
+    if image_class != "bitonal":
+        return []
+    resolution = min(BITONAL_RESOLUTION, round(dpi)) if dpi else BITONAL_RESOLUTION
+    return [
+        '-sColorConversionStrategy=Gray',
+        '-dProcessColorModel=/DeviceGray',
+        '-dGrayImageFilter=/FlateEncode',
+        '-dGrayImageDepth=1',
+        f'-dGrayImageResolution={resolution}',
+    ]
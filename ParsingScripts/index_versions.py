@@ -0,0 +1,128 @@
+import datetime
+
+# Blue/green builds of the indices. Every upload goes into a new set of versioned indices (words-index-v2024-05-01)
+# created with settings for bulk loading. Once all documents are in, the production settings are restored, the
+# indices are force merged and the aliases the application queries (words-index, ...) are moved to them in a single
+# atomic request, so the site keeps serving the previous version until the new one is complete.
+
+# applied on top of the index settings while loading: no refreshes, no replicas to copy every document to and no
+# fsync of the translog on every bulk request
+BULK_LOAD_SETTINGS = {
+    "index.refresh_interval": "-1",
+    "index.number_of_replicas": 0,
+    "index.translog.durability": "async",
+}
+
+PRODUCTION_REFRESH_INTERVAL = "1s"
+PRODUCTION_REPLICAS = 0
+
+# segments per shard left by the force merge, the indices are read only until the next build
+MAX_SEGMENTS = 1
+
+# previous versions kept besides the live one, to switch back to
+KEEP_VERSIONS = 1
+
+# a force merge of the words index takes long, the request waits for it
+FORCE_MERGE_TIMEOUT = 6 * 60 * 60
+
+
+def default_version():
+    return datetime.date.today().isoformat()
+
+
+# today's date, or the date and time if an index of today's version exists already, e.g. the one a build earlier
+# today made live; versions of the same day sort after the plain date
+def new_version(es, aliases):
+    version = default_version()
+    if any(es.indices.exists(index=versioned_name(alias, version)) for alias in aliases):
+        version = datetime.datetime.now().strftime("%Y-%m-%d-%H%M%S")
+    return version
+
+
+def versioned_name(alias, version):
+    return f"{alias}-v{version}"
+
+
+def production_settings(replicas=PRODUCTION_REPLICAS):
+    return {
+        "index.refresh_interval": PRODUCTION_REFRESH_INTERVAL,
+        "index.number_of_replicas": replicas,
+        "index.translog.durability": "request",
+    }
+
+
+# the aliases pointing to the index
+def serving_aliases(es, index_name):
+    if not es.indices.exists(index=index_name):
+        return []
+    return list(es.indices.get_alias(index=index_name).body.get(index_name, {}).get("aliases", {}))
+
+
+# creates the versioned index with the bulk load settings, unless it exists already (an interrupted build); an index
+# an alias points to is live and is neither deleted nor loaded into
+def create_versioned_index(es, index_name, settings, mappings, delete_index_if_exists=False):
+    aliases = serving_aliases(es, index_name)
+    if aliases:
+        raise ValueError(f"Index '{index_name}' is served by the alias(es) {', '.join(aliases)}, "
+                         f"build a new version instead")
+
+    if es.indices.exists(index=index_name) and delete_index_if_exists:
+        print("Deleting index: " + index_name)
+        es.indices.delete(index=index_name)
+
+    if not es.indices.exists(index=index_name):
+        print("Creating index: " + index_name + "\n")
+        es.indices.create(index=index_name, settings={**settings, **BULK_LOAD_SETTINGS}, mappings=mappings)
+    else:
+        es.indices.put_settings(index=index_name, settings=BULK_LOAD_SETTINGS)
+
+
+# restores the production settings and merges the segments of the loaded index
+def finish_index(es, index_name, replicas=PRODUCTION_REPLICAS, max_segments=MAX_SEGMENTS):
+    es.indices.put_settings(index=index_name, settings=production_settings(replicas))
+    es.indices.refresh(index=index_name)
+    print(f"Force merging '{index_name}' to {max_segments} segment(s) per shard")
+    es.options(request_timeout=FORCE_MERGE_TIMEOUT).indices.forcemerge(
+        index=index_name, max_num_segments=max_segments, wait_for_completion=True
+    )
+
+
+def _aliased_indices(es, alias):
+    if not es.indices.exists_alias(name=alias):
+        return []
+    return list(es.indices.get_alias(name=alias).body.keys())
+
+
+# points every alias to its new index in one request; an index that still goes by the alias name (from before the
+# indices were versioned) is removed in the same request. Returns the indices the aliases pointed to before.
+def swap_aliases(es, targets):
+    actions = []
+    previous = {}
+    for alias, index_name in targets.items():
+        previous[alias] = [old for old in _aliased_indices(es, alias) if old != index_name]
+        for old in previous[alias]:
+            actions.append({"remove": {"index": old, "alias": alias}})
+        if es.indices.exists(index=alias) and not es.indices.exists_alias(name=alias):
+            actions.append({"remove_index": {"index": alias}})
+        actions.append({"add": {"index": index_name, "alias": alias}})
+
+    es.indices.update_aliases(actions=actions)
+    for alias, index_name in targets.items():
+        print(f"Alias '{alias}' now points to '{index_name}'")
+    return previous
+
+
+# deletes the versions of the alias older than the live one, except the keep most recent of them
+def delete_old_versions(es, alias, live_index, keep=KEEP_VERSIONS):
+    versions = sorted(
+        (index_name for index_name in es.indices.get(index=f"{alias}-v*").body if index_name != live_index),
+        reverse=True
+    )
+    for index_name in versions:
+        if index_name > live_index:
+            continue
+        if keep > 0:
+            keep -= 1
+            continue
+        print("Deleting old index: " + index_name)
+        es.indices.delete(index=index_name)
@@ -0,0 +1,88 @@
+import gzip
+import io
+import json
+
+# orjson serializes several times faster than json, it is optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# file name suffixes of the supported compressions
+COMPRESSION_SUFFIXES = {
+    None: "",
+    "gzip": ".gz",
+    "zstd": ".zst",
+}
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+# bytes collected before they are handed to the (compressing) file, and read ahead from it
+WRITE_BUFFER_SIZE = 1 << 20
+READ_BUFFER_SIZE = 1 << 20
+
+
+def dumps(element):
+    if orjson is not None:
+        return orjson.dumps(element)
+    return json.dumps(element, ensure_ascii=False).encode("utf-8")
+
+
+def compression_of(path):
+    for compression, suffix in COMPRESSION_SUFFIXES.items():
+        if compression is not None and path.endswith(suffix):
+            return compression
+    return None
+
+
+# file name without the compression suffix, e.g. "x_words.jsonl.zst" -> "x_words.jsonl"
+def strip_compression(path):
+    compression = compression_of(path)
+    return path[:-len(COMPRESSION_SUFFIXES[compression])] if compression else path
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compressed files need the zstandard package (pip install zstandard)")
+    return zstandard
+
+
+# opens a binary file for writing, compressed according to the suffix of the path
+def open_output(path):
+    compression = compression_of(path)
+    if compression == "gzip":
+        raw = gzip.open(path, "wb", compresslevel=GZIP_LEVEL)
+    elif compression == "zstd":
+        raw = _zstandard().ZstdCompressor(level=ZSTD_LEVEL).stream_writer(
+            open(path, "wb"), closefd=True, write_return_read=True
+        )
+    else:
+        return open(path, "wb", buffering=WRITE_BUFFER_SIZE)
+    return io.BufferedWriter(raw, WRITE_BUFFER_SIZE)
+
+
+# opens a (possibly compressed) text file for reading; binary files yield the lines as bytes, undecoded
+def open_input(path, binary=False):
+    compression = compression_of(path)
+    if compression == "gzip":
+        return gzip.open(path, "rb") if binary else gzip.open(path, "rt", encoding="utf-8")
+    if compression == "zstd":
+        raw = _zstandard().ZstdDecompressor().stream_reader(open(path, "rb"), closefd=True)
+        return io.BufferedReader(raw, READ_BUFFER_SIZE) if binary else io.TextIOWrapper(raw, encoding="utf-8")
+    if binary:
+        return open(path, "rb", buffering=READ_BUFFER_SIZE)
+    return open(path, "r", encoding="utf-8")
+
+
+# writes the elements (any iterable, e.g. a generator) one JSON document per line, returns their count
+def write_jsonl(elements, path):
+    count = 0
+    with open_output(path) as file:
+        for element in elements:
+            file.write(dumps(element))
+            file.write(b"\n")
+            count += 1
+    return count
@@ -0,0 +1,102 @@
+import hashlib
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+# default name of the cache file, created in the parser's destination directory
+LEMMA_CACHE_FILE = "lemma_cache.sqlite"
+
+# analyses kept in memory, procedural phrases and names recur thousands of times within and across meetings
+LEMMA_CACHE_SIZE = 200000
+
+# SQLite limits the number of host parameters in a single statement
+_LOOKUP_BATCH_SIZE = 500
+
+# open caches by path, so every process opens each cache file only once
+_open_caches = {}
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Persistent cache of spaCy analyses of whole sentences. An analysis is the list of (type, lemma, text, join, propn)
+# tuples of the sentence's tokens, without ids, keyed by the pipeline, the language and the hash of the exact text.
+# Recently used analyses are kept in an in-memory LRU in front of the SQLite file.
+class LemmaCache:
+
+    def __init__(self, path, memory_size=LEMMA_CACHE_SIZE):
+        self.path = path
+        self.memory_size = memory_size
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=120, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS analyses ("
+            " key TEXT PRIMARY KEY,"
+            " pipeline TEXT NOT NULL,"
+            " lang TEXT NOT NULL,"
+            " analysis TEXT NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(pipeline, lang, text):
+        return _sha256("\0".join([pipeline, lang, _sha256(text)]))
+
+    def _remember(self, key, analysis):
+        self.memory[key] = analysis
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    # returns the cache key of every text and the analyses of those that are cached
+    def lookup(self, pipeline, lang, texts):
+        keys = [self.make_key(pipeline, lang, text) for text in texts]
+
+        found = {}
+        missing = []
+        with self.lock:
+            for key in set(keys):
+                if key in self.memory:
+                    self.memory.move_to_end(key)
+                    found[key] = self.memory[key]
+                else:
+                    missing.append(key)
+
+            for start in range(0, len(missing), _LOOKUP_BATCH_SIZE):
+                batch = missing[start:start + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT key, analysis FROM analyses WHERE key IN ({placeholders})", batch
+                )
+                for key, analysis in rows:
+                    analysis = [tuple(token) for token in json.loads(analysis)]
+                    found[key] = analysis
+                    self._remember(key, analysis)
+
+        return keys, found
+
+    def store(self, pipeline, lang, keys, analyses):
+        with self.lock:
+            for key, analysis in zip(keys, analyses):
+                self._remember(key, analysis)
+
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO analyses (key, pipeline, lang, analysis) VALUES (?, ?, ?, ?)",
+                [
+                    (key, pipeline, lang, json.dumps(analysis, ensure_ascii=False))
+                    for key, analysis in zip(keys, analyses)
+                ]
+            )
+            self.connection.commit()
+
+
+def get_lemma_cache(path):
+    if path not in _open_caches:
+        _open_caches[path] = LemmaCache(path)
+    return _open_caches[path]
@@ -0,0 +1,192 @@
+import importlib.metadata
+import os
+
+from alive_progress import alive_bar
+
+from lemma_cache import get_lemma_cache
+from meeting_model import Word
+
+# Pipeline components needed for lemmas, POS tags (proper nouns) and punctuation; punctuation and whitespace are
+# lexical attributes of the tokens, everything else (parser, ner, senter, ...) is disabled
+LEMMA_COMPONENTS = ("tok2vec", "transformer", "tagger", "morphologizer", "attribute_ruler", "lemmatizer",
+                    "trainable_lemmatizer")
+
+# spaCy pipeline per language; transformer pipelines are not split across processes, every process would load its
+# own copy of the transformer and they already use all cores for the matrix multiplications
+LEMMATIZER_PROFILES = {
+    "sl": {"model": "sl_core_news_md", "batch_size": 256, "multiprocess": True},
+    "de": {"model": "de_core_news_md", "batch_size": 256, "multiprocess": True},
+    "hr": {"model": "hr_core_news_md", "batch_size": 256, "multiprocess": True},
+    "sr": {"model": "Tanor/sr_Spacy_Serbian_Model_SrpKor4Tagging_BERTICOVO", "hub": True, "transformer": True,
+           "batch_size": 32, "multiprocess": False},
+}
+
+# Processes used by nlp.pipe, None chooses them from the available cores and the number of texts
+LEMMATIZER_PROCESSES = None
+
+# a process only pays off if it gets at least this many texts, starting one copies the pipeline
+MIN_TEXTS_PER_PROCESS = 2000
+
+# Persistent cache of analyses, opened by the parsers' parse_file
+lemma_cache = None
+
+# pipelines loaded so far, every language is loaded on first use
+_pipelines = {}
+
+
+# loads the spaCy pipeline of the language; with lean=True only the components in LEMMA_COMPONENTS stay enabled
+def load_pipeline(lang, lean=True):
+    import spacy
+
+    profile = LEMMATIZER_PROFILES[lang]
+
+    if profile.get("transformer"):
+        # registers the transformer pipeline components with spaCy
+        import spacy_transformers
+
+    model = profile["model"]
+    if profile.get("hub"):
+        from huggingface_hub import snapshot_download
+        model = snapshot_download(repo_id=model)
+
+    nlp = spacy.load(model)
+    if lean:
+        for name in nlp.pipe_names:
+            if name not in LEMMA_COMPONENTS:
+                nlp.disable_pipe(name)
+
+    return nlp
+
+
+# the model of the language's profile and its installed version, known without loading the pipeline
+def profile_identifier(lang):
+    model = LEMMATIZER_PROFILES[lang]["model"]
+    try:
+        return model + "-" + importlib.metadata.version(model)
+    except importlib.metadata.PackageNotFoundError:
+        return model
+
+
+def get_pipeline(lang):
+    if lang not in _pipelines:
+        _pipelines[lang] = load_pipeline(lang)
+    return _pipelines[lang]
+
+
+def available_cores():
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count() or 1
+
+    # parallel_parse limits the threads of every worker process, the lemmatizer stays within that share
+    limit = os.environ.get("OMP_NUM_THREADS")
+    if limit and limit.isdigit():
+        cores = min(cores, int(limit))
+
+    return max(cores, 1)
+
+
+def pipe_processes(lang, n_texts):
+    if not LEMMATIZER_PROFILES[lang]["multiprocess"]:
+        return 1
+    if LEMMATIZER_PROCESSES is not None:
+        return LEMMATIZER_PROCESSES
+    return max(1, min(available_cores(), n_texts // MIN_TEXTS_PER_PROCESS))
+
+
+def open_lemma_cache(path):
+    global lemma_cache
+    lemma_cache = get_lemma_cache(path)
+
+
+# identifies the pipeline in the cache keys, another model version or set of components produces misses instead
+# of stale lemmas
+def pipeline_identifier(nlp):
+    return f"{nlp.meta.get('lang')}_{nlp.meta.get('name')}-{nlp.meta.get('version')}:{','.join(nlp.pipe_names)}"
+
+
+# identifies the lean pipeline of the language's profile in the cache keys without loading it
+def lean_pipeline_identifier(lang):
+    return f"{profile_identifier(lang)}:{','.join(LEMMA_COMPONENTS)}"
+
+
+# runs the pipeline and returns the (type, lemma, text, join, propn) tuples of every text's tokens; n_process=None
+# chooses the processes of nlp.pipe with pipe_processes
+def analyze(nlp, texts, lang, progress=True, n_process=None):
+    batch_size = LEMMATIZER_PROFILES[lang]["batch_size"]
+    if n_process is None:
+        n_process = pipe_processes(lang, len(texts))
+
+    analyses = []
+    title = f"Lemmatizing ({lang}, {n_process} processes)"
+    with alive_bar(len(texts), title=title, force_tty=True, disable=not progress) as bar:
+        bar(0)
+        for doc in nlp.pipe(texts, batch_size=batch_size, n_process=n_process):
+            analysis = []
+            for i, token in enumerate(doc):
+                # Adjust join attribute (needed to reconstruct the original text)
+                join = "natural"
+                if i < len(doc) - 1 and not token.whitespace_:
+                    join = "right"
+
+                analysis.append((
+                    "pc" if token.is_punct else "w",
+                    token.lemma_,
+                    token.text,
+                    join,
+                    1 if token.pos_ == "PROPN" else 0
+                ))
+
+            analyses.append(analysis)
+            bar()
+
+    return analyses
+
+
+# lemmatizes the texts and returns a list of Words for every text, word ids are built from the sentence ids;
+# lemmas of proper nouns are added to proper_nouns if a set is given. Every distinct text is analyzed only once
+# and only if it is missing from the lemma cache. Pass n_process=1 when lemmatizing next to other running threads,
+# forking pipe processes then may deadlock them.
+def batch_lemmatize(texts, lang, sentence_ids=None, proper_nouns=None, nlp=None, progress=True, n_process=None):
+    if lang not in LEMMATIZER_PROFILES:
+        print(f"batch_lemmatize(): language '{lang}' not supported")
+        return [[] for _ in texts]
+
+    if sentence_ids is None:
+        sentence_ids = ["0" for _ in texts]
+
+    # the profile's pipeline is only loaded when some texts are not cached
+    pipeline = pipeline_identifier(nlp) if nlp is not None else lean_pipeline_identifier(lang)
+    if lemma_cache is not None:
+        keys, found = lemma_cache.lookup(pipeline, lang, texts)
+    else:
+        keys, found = list(texts), {}
+
+    pending = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            pending.setdefault(key, text)
+
+    print(f"Lemmatizing ({lang}): {len(pending)}/{len(texts)} sentences not cached")
+    analyses = analyze(
+        nlp or get_pipeline(lang), list(pending.values()), lang, progress, n_process
+    ) if pending else []
+    found.update(zip(pending, analyses))
+
+    if lemma_cache is not None and pending:
+        lemma_cache.store(pipeline, lang, list(pending), analyses)
+
+    results = []
+    for key, sid in zip(keys, sentence_ids):
+        words = []
+        for i, (word_type, lemma, text, join, propn) in enumerate(found[key]):
+            words.append(Word(sid + "." + str(i + 1) + ".(" + lang + ")", word_type, lemma, text, join, propn))
+
+            # proper nouns are collected from cached analyses as well
+            if propn and proper_nouns is not None:
+                proper_nouns.add(lemma)
+
+        results.append(words)
+
+    return results
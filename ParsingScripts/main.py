@@ -1,8 +1,8 @@
 import argparse
 
 import optimizer
-#import parser_dzk
-#import parser_yuparl
+import parser_dzk
+import parser_yuparl
 import renamer
 import thumbnailer
 import uploader
@@ -112,6 +112,50 @@ def main():
         help='Ending index for optimizing files',
         default=-1
     )
+    optimize_parser.add_argument(
+        '-j', '--jobs',
+        type=int,
+        required=False,
+        help='Number of files optimized at once, each runs its own Ghostscript and qpdf',
+        default=1
+    )
+    optimize_parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Optimize all selected files, also those whose output is newer than the input or already linearized'
+    )
+    optimize_parser.add_argument(
+        '--report',
+        type=str,
+        required=False,
+        help='Write a CSV with the time and the input and output size of every file',
+        default=None
+    )
+    optimize_parser.add_argument(
+        '--engine',
+        type=str,
+        required=False,
+        help='Linearize with the qpdf command or in-process with pikepdf, which reads the Ghostscript output from '
+             'a memory backed scratch directory instead of a temporary file next to the output (needs pikepdf)',
+        default='qpdf',
+        choices=['qpdf', 'pikepdf']
+    )
+    optimize_parser.add_argument(
+        '--scratch-dir',
+        type=str,
+        required=False,
+        help='Directory for the Ghostscript output with the pikepdf engine (default: /dev/shm if present)',
+        default=optimizer.SCRATCH_DIR
+    )
+    optimize_parser.add_argument(
+        '--image-profile',
+        type=str,
+        required=False,
+        help='Image settings: fixed for all files, or adaptive, which classifies the page images of every file '
+             '(1-bit, bitonal scans, gray, colour) and reduces bitonal scans to 1 bit',
+        default='fixed',
+        choices=['fixed', 'adaptive']
+    )
 
     # -------------------------------
     # Subcommand: parse
@@ -150,6 +194,77 @@ def main():
         help='Ending index for parsing files',
         default=-1
     )
+    parse_parser.add_argument(
+        '-w', '--workers',
+        type=int,
+        required=False,
+        help='Number of worker processes, each loads its own models (1 parses in the current process)',
+        default=1
+    )
+    parse_parser.add_argument(
+        '--compression',
+        type=str,
+        required=False,
+        help='Compress the output files (.jsonl.gz or .jsonl.zst, zstd needs the zstandard package)',
+        default=None,
+        choices=['gzip', 'zstd']
+    )
+    parse_parser.add_argument(
+        '--output-format',
+        type=str,
+        required=False,
+        help='Format of the sentences and words files: JSONL, Arrow IPC stream (.arrows) or Parquet (needs pyarrow)',
+        default='jsonl',
+        choices=['jsonl', 'arrow', 'parquet']
+    )
+    parse_parser.add_argument(
+        '--force',
+        action='store_true',
+        help='Parse all selected files, also those whose outputs are up to date according to parse_manifest.json'
+    )
+    parse_parser.add_argument(
+        '--translation-cache',
+        type=str,
+        required=False,
+        help='Path to the SQLite translation cache (defaults to translation_cache.sqlite in the destination directory)',
+        default=None
+    )
+    parse_parser.add_argument(
+        '--lemma-cache',
+        type=str,
+        required=False,
+        help='Path to the SQLite lemma cache (defaults to lemma_cache.sqlite in the destination directory)',
+        default=None
+    )
+    parse_parser.add_argument(
+        '--translation-engine',
+        type=str,
+        required=False,
+        help='Backend used to run the NLLB translation model',
+        default='transformers',
+        choices=['transformers', 'ctranslate2']
+    )
+    parse_parser.add_argument(
+        '--translation-model-path',
+        type=str,
+        required=False,
+        help='Path to the converted (e.g. int8 CTranslate2) translation model',
+        default=None
+    )
+    parse_parser.add_argument(
+        '--intra-threads',
+        type=int,
+        required=False,
+        help='Threads used within a single translation operation (0 lets the engine decide)',
+        default=0
+    )
+    parse_parser.add_argument(
+        '--inter-threads',
+        type=int,
+        required=False,
+        help='Translation operations run in parallel (0 lets the engine decide)',
+        default=0
+    )
 
     # -------------------------------
     # Subcommand: upload
@@ -180,6 +295,102 @@ def main():
         help='Whether to delete existing indexes before upload',
         default=False
     )
+    upload_parser.add_argument(
+        '-m', '--mode',
+        type=str,
+        required=False,
+        help='sequential sends one bulk request at a time, parallel reads ahead and sends from several threads, '
+             'async uploads all indices at once with workers per index (needs aiohttp)',
+        default='sequential',
+        choices=['sequential', 'parallel', 'async']
+    )
+    upload_parser.add_argument(
+        '--threads',
+        type=int,
+        required=False,
+        help='Maximum number of bulk requests in flight in parallel mode, fewer are sent while the cluster is loaded',
+        default=4
+    )
+    upload_parser.add_argument(
+        '--chunk-size',
+        type=int,
+        required=False,
+        help='Maximum number of documents per bulk request in parallel mode',
+        default=500
+    )
+    upload_parser.add_argument(
+        '--max-chunk-bytes',
+        type=int,
+        required=False,
+        help='Maximum size of a bulk request in bytes in parallel mode',
+        default=10 * 1024 * 1024
+    )
+    upload_parser.add_argument(
+        '--target-latency',
+        type=float,
+        required=False,
+        help='Seconds a bulk request may take before fewer requests are sent at once',
+        default=10.0
+    )
+    upload_parser.add_argument(
+        '--index-concurrency',
+        type=str,
+        required=False,
+        help='Bulk requests in flight per index in async mode, e.g. words=6,sentences=2',
+        default=None
+    )
+    upload_parser.add_argument(
+        '--words-profile',
+        type=str,
+        required=False,
+        help='Mapping of the words index: default, or lean, which indexes only the searched fields and compresses '
+             'the documents more (applies to newly created indices)',
+        default='default',
+        choices=['default', 'lean']
+    )
+    upload_parser.add_argument(
+        '--blue-green',
+        action='store_true',
+        required=False,
+        help='Upload into new versioned indices and move the aliases to them once they are complete',
+        default=False
+    )
+    upload_parser.add_argument(
+        '--index-version',
+        type=str,
+        required=False,
+        help='Version of the indices built in blue/green mode, e.g. words-index-v<version> (default: the unfinished '
+             'build recorded in the journal, otherwise today\'s date)',
+        default=None
+    )
+    upload_parser.add_argument(
+        '--replicas',
+        type=int,
+        required=False,
+        help='Replicas of the indices once a blue/green build is complete',
+        default=0
+    )
+    upload_parser.add_argument(
+        '--max-segments',
+        type=int,
+        required=False,
+        help='Segments per shard the indices of a blue/green build are force merged to',
+        default=1
+    )
+    upload_parser.add_argument(
+        '--keep-versions',
+        type=int,
+        required=False,
+        help='Previous versions of the indices kept after a blue/green build',
+        default=1
+    )
+    upload_parser.add_argument(
+        '--journal',
+        type=str,
+        required=False,
+        help='SQLite journal of the sent chunks and of the documents to retry, an interrupted upload resumes from it',
+        default='upload_journal.sqlite'
+    )
 
 
     args = parser.parse_args()
@@ -196,15 +407,49 @@ def main():
             quality=args.quality,
             ghostscript_path=args.ghostscript_path,
             from_index=args.from_index,
-            to_index=args.to_index
+            to_index=args.to_index,
+            jobs=args.jobs,
+            force=args.force,
+            report_path=args.report,
+            engine=args.engine,
+            scratch_dir=args.scratch_dir,
+            image_profile=args.image_profile
         )
     elif args.command == 'parse':
+        translation_engine = {
+            'engine': args.translation_engine,
+            'model_path': args.translation_model_path,
+            'intra_threads': args.intra_threads,
+            'inter_threads': args.inter_threads
+        }
         if args.corpus == 'dzk':
-            ...
-            # parser_dzk.parse(args.source, args.destination, args.from_index, args.to_index)
+            parser_dzk.parse(
+                args.source,
+                args.destination,
+                args.from_index,
+                args.to_index,
+                workers=args.workers,
+                translation_cache_path=args.translation_cache,
+                translation_engine=translation_engine,
+                lemma_cache_path=args.lemma_cache,
+                force=args.force,
+                compression=args.compression,
+                output_format=args.output_format
+            )
         elif args.corpus == 'yuparl':
-            ...
-            # parser_yuparl.parse(args.source, args.destination, args.from_index, args.to_index)
+            parser_yuparl.parse(
+                args.source,
+                args.destination,
+                args.from_index,
+                args.to_index,
+                workers=args.workers,
+                translation_cache_path=args.translation_cache,
+                translation_engine=translation_engine,
+                lemma_cache_path=args.lemma_cache,
+                force=args.force,
+                compression=args.compression,
+                output_format=args.output_format
+            )
         else:
             raise NotImplementedError(f"Parsing for corpus '{args.corpus}' is not implemented.")
     elif args.command == 'upload':
@@ -212,7 +457,20 @@ def main():
             args.source,
             args.elasticsearch_host,
             args.elasticsearch_port,
-            delete_index_if_exists=args.delete_index
+            delete_index_if_exists=args.delete_index,
+            mode=args.mode,
+            threads=args.threads,
+            chunk_size=args.chunk_size,
+            max_chunk_bytes=args.max_chunk_bytes,
+            target_latency=args.target_latency,
+            journal_path=args.journal,
+            index_concurrency=uploader.parse_index_concurrency(args.index_concurrency),
+            blue_green=args.blue_green,
+            version=args.index_version,
+            replicas=args.replicas,
+            max_segments=args.max_segments,
+            keep_versions=args.keep_versions,
+            words_profile=args.words_profile
         )
     else:
         raise NotImplementedError(f"Command '{args.command}' is not implemented.")
@@ -0,0 +1,112 @@
+# Compact in-memory representation of a parsed meeting. Millions of words per meeting are kept as __slots__
+# objects instead of dicts, translations read the speaker from their sentence instead of copying it, and the
+# meeting indexes its sentences by id. to_dict() produces exactly the structure written to _meeting.jsonl.
+
+
+class Word:
+    __slots__ = ("id", "type", "lemma", "text", "join", "propn")
+
+    def __init__(self, id, type=None, lemma=None, text=None, join=None, propn=0):
+        self.id = id
+        self.type = type
+        self.lemma = lemma
+        self.text = text
+        self.join = join
+        self.propn = propn
+
+    def to_dict(self):
+        word = {"id": self.id}
+        # words of the original Yu1Parl text have no type and join
+        if self.type is not None:
+            word["type"] = self.type
+        word["lemma"] = self.lemma
+        word["text"] = self.text
+        if self.join is not None:
+            word["join"] = self.join
+        word["propn"] = self.propn
+        return word
+
+
+class Translation:
+    __slots__ = ("sentence", "lang", "original", "text", "words", "has_speaker")
+
+    def __init__(self, sentence, lang, original, text="", words=None, has_speaker=True):
+        self.sentence = sentence
+        self.lang = lang
+        self.original = original
+        self.text = text
+        self.words = words if words is not None else []
+        # whether the speaker is written out with the translation (it is always the sentence's speaker)
+        self.has_speaker = has_speaker
+
+    @property
+    def speaker(self):
+        return self.sentence.speaker
+
+    def to_dict(self):
+        translation = {"lang": self.lang, "original": self.original}
+        if self.has_speaker:
+            translation["speaker"] = self.sentence.speaker
+        translation["text"] = self.text
+        translation["words"] = [word.to_dict() for word in self.words]
+        return translation
+
+
+class Sentence:
+    __slots__ = ("id", "segment_page", "segment_id", "speaker", "translations", "original_language")
+
+    def __init__(self, id, segment_page, segment_id, speaker):
+        self.id = id
+        self.segment_page = segment_page
+        self.segment_id = segment_id
+        self.speaker = speaker
+        self.translations = []
+        self.original_language = None
+
+    # the translation in the language the sentence was spoken in
+    @property
+    def original(self):
+        return next((t for t in self.translations if t.original == 1), None)
+
+    def add_translation(self, lang, text, words, original=0, has_speaker=True):
+        translation = Translation(self, lang, original, text, words, has_speaker)
+        self.translations.append(translation)
+        return translation
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "segment_page": self.segment_page,
+            "segment_id": self.segment_id,
+            "speaker": self.speaker,
+            "translations": [translation.to_dict() for translation in self.translations],
+            "original_language": self.original_language,
+        }
+
+
+class Meeting:
+    __slots__ = ("id", "date", "titles", "agendas", "sentences", "notes", "corpus", "_sentences_by_id")
+
+    def __init__(self, id, date, titles, agendas, sentences, notes, corpus=None):
+        self.id = id
+        self.date = date
+        self.titles = titles
+        self.agendas = agendas
+        self.sentences = sentences
+        self.notes = notes
+        self.corpus = corpus
+        self._sentences_by_id = {sentence.id: sentence for sentence in sentences}
+
+    def sentence(self, sentence_id):
+        return self._sentences_by_id.get(sentence_id)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "date": self.date,
+            "titles": self.titles,
+            "agendas": self.agendas,
+            "sentences": [sentence.to_dict() for sentence in self.sentences],
+            "notes": self.notes,
+            "corpus": self.corpus,
+        }
@@ -0,0 +1,93 @@
+import queue
+import threading
+import time
+
+# sentences translated together; the lemmatizer works on chunk k while the model translates chunk k + 1
+PIPELINE_CHUNK_SIZE = 1024
+
+# translated chunks waiting for lemmatization, bounds the memory held by the pipeline
+PIPELINE_QUEUE_SIZE = 2
+
+_DONE = object()
+
+
+class _Failure:
+    __slots__ = ("error",)
+
+    def __init__(self, error):
+        self.error = error
+
+
+def _chunks(directions, chunk_size):
+    for source_lang, targets, sentence_ids, texts in directions:
+        for start in range(0, len(texts), chunk_size):
+            yield source_lang, targets, sentence_ids[start:start + chunk_size], texts[start:start + chunk_size]
+
+
+# Translates and lemmatizes the sentences of a meeting as a two stage producer/consumer pipeline: a background
+# thread translates chunk after chunk, across all language directions, while the calling thread lemmatizes the
+# chunks that are already translated, so a meeting takes about as long as its slowest stage instead of the sum.
+#
+# directions is a list of (source_lang, targets, sentence_ids, texts) where targets maps the model's target
+# language codes to the languages of the lemmatizer, e.g. ("deu_Latn", {"slv_Latn": "sl"}, ids, texts);
+#   translate(texts, source_lang, target_codes) returns {target_code: translations}
+#   lemmatize(texts, lang, sentence_ids) returns the words of every text; it runs while the translation thread is
+#     busy and must not fork processes (batch_lemmatize with n_process=1), forking next to a running thread may
+#     deadlock the children
+#   attach(sentence_id, lang, text, words) stores a translation
+# Translations of a sentence are attached in the order of its targets. Returns the time spent in each stage.
+def translate_and_lemmatize(directions, translate, lemmatize, attach, chunk_size=None, queue_size=None):
+    chunks = queue.Queue(maxsize=queue_size or PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    timings = {"translate": 0.0, "lemmatize": 0.0}
+
+    def put(item):
+        # gives up once the consumer stopped, so a failing lemmatizer never leaves the producer blocked
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for source_lang, targets, sentence_ids, texts in _chunks(directions, chunk_size or PIPELINE_CHUNK_SIZE):
+                if stop.is_set():
+                    return
+
+                start = time.time()
+                translations = translate(texts, source_lang, list(targets))
+                timings["translate"] += time.time() - start
+
+                put((targets, sentence_ids, translations))
+            put(_DONE)
+        except BaseException as error:
+            put(_Failure(error))
+
+    producer = threading.Thread(target=produce, name="translate", daemon=True)
+    producer.start()
+
+    try:
+        while True:
+            item = chunks.get()
+            if item is _DONE:
+                break
+            if isinstance(item, _Failure):
+                raise item.error
+
+            targets, sentence_ids, translations = item
+            start = time.time()
+            for target_code, lang in targets.items():
+                texts = translations[target_code]
+                for sentence_id, text, words in zip(sentence_ids, texts, lemmatize(texts, lang, sentence_ids)):
+                    attach(sentence_id, lang, text, words)
+            timings["lemmatize"] += time.time() - start
+
+            print(f"translate_and_lemmatize(): {len(sentence_ids)} sentences done "
+                  f"(translating {timings['translate']:.1f}s, lemmatizing {timings['lemmatize']:.1f}s)")
+    finally:
+        stop.set()
+        producer.join()
+
+    return timings
@@ -1,8 +1,43 @@
+import csv
+import io
 import os
 import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
+import image_analysis
 
-def optimize_pdf(input_file, output_file, quality='ebook', ghostscript_path='gs'):
+# slowest files listed in the summary
+SLOWEST_FILES = 10
+
+# qpdf runs the qpdf command on a temporary file next to the output, pikepdf (the qpdf library) linearizes in the
+# optimizing process, reading Ghostscript's output from the scratch directory
+LINEARIZE_ENGINES = ("qpdf", "pikepdf")
+
+# a memory backed directory for Ghostscript's output when linearizing with pikepdf, so only the final file is written
+# to disk (None is the system's temporary directory)
+SCRATCH_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def _pikepdf():
+    try:
+        import pikepdf
+    except ImportError:
+        raise ImportError("The pikepdf engine needs the pikepdf package (pip install pikepdf)")
+    return pikepdf
+
+
+# writes the linearized copy of the PDF with the qpdf library, the same linearization qpdf --linearize produces
+def linearize_in_process(input_file, output_file):
+    pikepdf = _pikepdf()
+    with pikepdf.open(input_file) as pdf:
+        pdf.save(output_file, linearize=True)
+
+
+# image_settings are further Ghostscript options, given after the fixed image options so they override them
+def optimize_pdf(input_file, output_file, quality='ebook', ghostscript_path='gs', engine='qpdf',
+                 scratch_dir=SCRATCH_DIR, image_settings=()):
     quality_settings = {
         'screen': '/screen',     # lowest quality
         'ebook': '/ebook',       # good quality
@@ -10,7 +45,15 @@ def optimize_pdf(input_file, output_file, quality='ebook', ghostscript_path='gs'
         'prepress': '/prepress'  # highest quality
     }
 
-    temp_output = output_file + ".tmp.pdf"
+    name = os.path.basename(input_file)
+    if engine == "pikepdf":
+        scratch_file, temp_output = tempfile.mkstemp(suffix=".pdf", dir=scratch_dir)
+        os.close(scratch_file)
+    else:
+        temp_output = output_file + ".tmp.pdf"
+    # qpdf writes next to the output and the file is renamed once complete, so an interrupted run never leaves an
+    # output that looks up to date
+    partial_output = output_file + ".part.pdf"
 
     # Ghostscript for compression and font embedding
     gs_command = [
@@ -46,6 +89,9 @@ def optimize_pdf(input_file, output_file, quality='ebook', ghostscript_path='gs'
         "-dDownsampleMonoImages=true",
         "-dMonoImageResolution=300",
 
+        # Per document image settings (see image_analysis)
+        *image_settings,
+
         # General flags
         '-dNOPAUSE',
         '-dQUIET',
@@ -55,36 +101,160 @@ def optimize_pdf(input_file, output_file, quality='ebook', ghostscript_path='gs'
         input_file
     ]
 
-    print("🔧 Compressing and embedding fonts...")
+    print(f"🔧 {name}: compressing and embedding fonts...")
     try:
         subprocess.run(gs_command, check=True)
     except subprocess.CalledProcessError as e:
-        print("❌ Ghostscript compression failed:", e)
-        return
+        print(f"❌ {name}: Ghostscript compression failed:", e)
+        if os.path.exists(temp_output):
+            os.remove(temp_output)
+        return False
 
     # qpdf for linearization (fast web view)
     qpdf_command = [
         'qpdf',
         '--linearize',
         temp_output,
-        output_file
+        partial_output
     ]
 
-    print("📦 Linearizing PDF for fast web view...")
+    print(f"📦 {name}: linearizing PDF for fast web view...")
     try:
-        subprocess.run(qpdf_command, check=True)
+        if engine == "pikepdf":
+            linearize_in_process(temp_output, partial_output)
+        else:
+            subprocess.run(qpdf_command, check=True)
+        os.replace(partial_output, output_file)
         print(f"✅ Optimization successful: {output_file}")
-    except subprocess.CalledProcessError as e:
-        print("❌ Linearization failed:", e)
+        return True
+    except Exception as e:
+        print(f"❌ {name}: linearization failed:", e)
+        return False
     finally:
-        # Clean up temporary file
-        if os.path.exists(temp_output):
-            os.remove(temp_output)
+        # Clean up temporary files
+        for path in (temp_output, partial_output):
+            if os.path.exists(path):
+                os.remove(path)
+
 
+def is_linearized(path, engine="qpdf"):
+    if engine == "pikepdf":
+        pikepdf = _pikepdf()
+        try:
+            # check_linearization of a file that is not linearized at all ends the process, hence is_linearized first
+            with pikepdf.open(path) as pdf:
+                return pdf.is_linearized and pdf.check_linearization(stream=io.StringIO())
+        except pikepdf.PdfError:
+            return False
 
-def optimize_pdfs(input_dir, output_dir, quality="ebook", ghostscript_path='gs', from_index=0, to_index=-1):
+    result = subprocess.run(['qpdf', '--check-linearization', path], stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+
+# an output is up to date when it is newer than its input and a linearized PDF, i.e. it was finished and not left
+# behind half written
+def is_up_to_date(input_file, output_file, engine="qpdf"):
+    if not os.path.exists(output_file):
+        return False
+    if os.path.getmtime(output_file) < os.path.getmtime(input_file):
+        return False
+    return is_linearized(output_file, engine)
+
+
+# optimizes one file unless its output is up to date, returns what was done, how long it took and the sizes
+def _optimize_file(input_file, output_file, quality, ghostscript_path, force, engine, scratch_dir, adaptive):
+    start_time = time.time()
+    analysis = {"class": None, "dpi": None, "mix": {}}
+    if not force and is_up_to_date(input_file, output_file, engine):
+        status = "skipped"
+    else:
+        if adaptive:
+            try:
+                analysis = image_analysis.analyze_pdf(input_file)
+            except Exception as e:
+                # the fixed settings are used for a file that cannot be analyzed
+                print(f"⚠️  {os.path.basename(input_file)}: image analysis failed:", e)
+        image_settings = image_analysis.ghostscript_image_settings(analysis["class"], analysis["dpi"])
+        if optimize_pdf(input_file, output_file, quality=quality, ghostscript_path=ghostscript_path, engine=engine,
+                        scratch_dir=scratch_dir, image_settings=image_settings):
+            status = "optimized"
+        else:
+            status = "failed"
+
+    return {
+        "file": os.path.basename(input_file),
+        "status": status,
+        "image_class": analysis["class"],
+        "dpi": round(analysis["dpi"]) if analysis["dpi"] else None,
+        "class_mix": image_analysis.format_mix(analysis["mix"]),
+        "seconds": time.time() - start_time,
+        "input_bytes": os.path.getsize(input_file),
+        "output_bytes": os.path.getsize(output_file) if status != "failed" and os.path.exists(output_file) else 0,
+    }
+
+
+def write_report(results, report_path):
+    with open(report_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=["file", "status", "image_class", "dpi", "class_mix", "seconds",
+                                               "input_bytes", "output_bytes"])
+        writer.writeheader()
+        for result in results:
+            writer.writerow({**result, "seconds": f"{result['seconds']:.2f}"})
+
+
+def print_summary(results, elapsed):
+    optimized = [result for result in results if result["status"] == "optimized"]
+    skipped = sum(1 for result in results if result["status"] == "skipped")
+    failed = [result for result in results if result["status"] == "failed"]
+    input_bytes = sum(result["input_bytes"] for result in optimized)
+    output_bytes = sum(result["output_bytes"] for result in optimized)
+    busy = sum(result["seconds"] for result in optimized)
+
+    print(f"\nOptimized {len(optimized)}, skipped {skipped} up to date, {len(failed)} failed in {elapsed:.0f}s")
+    if optimized:
+        print(f"Input {input_bytes / (1 << 20):.1f} MiB, output {output_bytes / (1 << 20):.1f} MiB "
+              f"({100 * output_bytes / max(input_bytes, 1):.0f}%), {busy / len(optimized):.1f}s per file")
+        print("Slowest files:")
+        for result in sorted(optimized, key=lambda result: result["seconds"], reverse=True)[:SLOWEST_FILES]:
+            print(f"  {result['file']}: {result['seconds']:.1f}s, {result['input_bytes'] / (1 << 20):.1f} MiB -> "
+                  f"{result['output_bytes'] / (1 << 20):.1f} MiB")
+    for result in failed:
+        print(f"Failed: {result['file']}")
+
+    classes = {}
+    for result in optimized:
+        if result["image_class"] is not None:
+            classes.setdefault(result["image_class"], []).append(result)
+    if classes:
+        print(f"\n{'class':<10}{'files':>7}{'input MiB':>11}{'output MiB':>12}{'saved MiB':>11}{'saved':>7}")
+        for image_class in image_analysis.IMAGE_CLASSES:
+            class_results = classes.get(image_class, [])
+            if not class_results:
+                continue
+            class_input = sum(result["input_bytes"] for result in class_results)
+            class_output = sum(result["output_bytes"] for result in class_results)
+            print(f"{image_class:<10}{len(class_results):>7}{class_input / (1 << 20):>11.1f}"
+                  f"{class_output / (1 << 20):>12.1f}{(class_input - class_output) / (1 << 20):>11.1f}"
+                  f"{100 * (class_input - class_output) / max(class_input, 1):>6.0f}%")
+
+
+# Optimizes the PDF files of input_dir with jobs files at a time. Ghostscript and qpdf run as their own processes,
+# so a thread per job is enough to keep jobs of them busy; linearizing with pikepdf holds the interpreter and fitz,
+# used by the adaptive image profile, must not be used from several threads, so these run the jobs in worker
+# processes. With the adaptive profile the images of every file are classified first (image_analysis) and the
+# Ghostscript image settings picked for its class, the summary then reports the bytes saved per class. Files whose
+# output is up to date are skipped unless force is set; the largest files are started first so the run does not end
+# waiting on one of them. A CSV with the time and the sizes of every file is written to report_path if given.
+def optimize_pdfs(input_dir, output_dir, quality="ebook", ghostscript_path='gs', from_index=0, to_index=-1, jobs=1,
+                  force=False, report_path=None, engine="qpdf", scratch_dir=SCRATCH_DIR, image_profile="fixed"):
     print("Optimizing PDF files in directory:", input_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    if engine == "pikepdf":
+        # fail before the first file rather than on every one of them
+        _pikepdf()
 
+    paths = []
     for i, file in enumerate(os.listdir(input_dir)):
 
         if i < from_index:
@@ -96,7 +266,33 @@ def optimize_pdfs(input_dir, output_dir, quality="ebook", ghostscript_path='gs',
         if not file.lower().endswith(".pdf"):
             continue
 
-        path = os.path.join(input_dir, file)
+        paths.append(os.path.join(input_dir, file))
+
+    paths.sort(key=os.path.getsize, reverse=True)
+
+    start_time = time.time()
+    results = []
+    adaptive = image_profile == "adaptive"
+    in_processes = engine == "pikepdf" or adaptive
+    executor_class = ProcessPoolExecutor if in_processes and jobs > 1 else ThreadPoolExecutor
+    with executor_class(max_workers=max(1, jobs)) as executor:
+        futures = [
+            executor.submit(_optimize_file, path, os.path.join(output_dir, os.path.basename(path)), quality,
+                            ghostscript_path, force, engine, scratch_dir, adaptive)
+            for path in paths
+        ]
+        for i, future in enumerate(as_completed(futures)):
+            result = future.result()
+            results.append(result)
+            image_class = ""
+            if result["image_class"]:
+                dpi = f", {result['dpi']} dpi" if result["dpi"] else ""
+                mix = f", {result['class_mix']}" if result["image_class"] == "mixed" else ""
+                image_class = f" ({result['image_class']}{dpi}{mix})"
+            print(f"{i + 1}/{len(paths)} {result['file']}: {result['status']}{image_class} in "
+                  f"{result['seconds']:.1f}s, {result['input_bytes']} -> {result['output_bytes']} bytes")
 
-        optimized_file_path = os.path.join(output_dir, file)
-        optimize_pdf(path, optimized_file_path, quality=quality, ghostscript_path=ghostscript_path)
\ No newline at end of file
+    if report_path:
+        write_report(results, report_path)
+    print_summary(results, time.time() - start_time)
+    return results
@@ -0,0 +1,116 @@
+import importlib
+import multiprocessing
+import os
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from batching import WORKERS_VARIABLE
+
+# Parser module and the name of its global proper nouns set, set once per worker process by _init_worker
+_parser = None
+_nouns_attr = None
+
+
+def _init_worker(parser_module_name, nouns_attr, threads_per_worker, workers):
+    global _parser, _nouns_attr
+
+    # limit math library threads so the workers do not oversubscribe the machine
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[variable] = str(threads_per_worker)
+
+    # the translation batches of every worker take only its share of the free memory
+    os.environ[WORKERS_VARIABLE] = str(workers)
+
+    # models are loaded on first use and kept for the following files, so every worker loads them exactly once
+    _parser = importlib.import_module(parser_module_name)
+    _nouns_attr = nouns_attr
+
+
+def _parse_file_in_worker(path, destination, options):
+    # collect only the proper nouns found in this file, the main process merges them
+    proper_nouns = getattr(_parser, _nouns_attr)
+    proper_nouns.clear()
+
+    try:
+        outputs = _parser.parse_file(path, destination, **options)
+        error = None
+    except Exception:
+        outputs = None
+        error = traceback.format_exc()
+
+    return path, error, set(proper_nouns), outputs
+
+
+def select_files(source, from_idx=0, to_idx=-1, prefix=""):
+    # indices refer to the position in os.listdir(source), same as the sequential parser always did
+    paths = []
+    for i, file in enumerate(os.listdir(source)):
+
+        if i < from_idx:
+            continue
+
+        if i >= to_idx and to_idx != -1:
+            break
+
+        if not file.endswith(".xml") or not file.startswith(prefix):
+            continue
+
+        paths.append(os.path.join(source, file))
+
+    return paths
+
+
+# parses the files with parser_module.parse_file (options are passed on as keyword arguments), either in this
+# process or sharded across a pool of workers; a failing file is reported and skipped instead of stopping the run,
+# proper nouns found by the workers are merged back into the parser's global set and the list of (path, error)
+# pairs that failed is returned; on_parsed(path, outputs) is called in this process for every parsed file with
+# whatever parse_file returned
+def parse_files(parser_module, paths, destination, workers=1, options=None, nouns_attr="proper_nouns",
+                on_parsed=None):
+    options = options or {}
+    failed = []
+    proper_nouns = getattr(parser_module, nouns_attr)
+
+    if workers <= 1:
+        for i, path in enumerate(paths):
+            print("parse(): processing file " + os.path.basename(path))
+            try:
+                outputs = parser_module.parse_file(path, destination, **options)
+                if on_parsed is not None:
+                    on_parsed(path, outputs)
+            except Exception:
+                error = traceback.format_exc()
+                print("parse(): failed to parse " + path + "\n" + error)
+                failed.append((path, error))
+            print(f"parse(): {i + 1}/{len(paths)} files processed\n")
+        return failed
+
+    threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+
+    # spawn instead of fork, forked processes do not play well with torch and CUDA
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(parser_module.__name__, nouns_attr, threads_per_worker, workers)
+    ) as executor:
+        futures = {executor.submit(_parse_file_in_worker, path, destination, options): path for path in paths}
+
+        for i, future in enumerate(as_completed(futures)):
+            try:
+                path, error, found_nouns, outputs = future.result()
+            except Exception:
+                # the worker process itself died (e.g. killed by the OOM killer)
+                path, error, found_nouns, outputs = futures[future], traceback.format_exc(), set(), None
+
+            proper_nouns.update(found_nouns)
+            if error is not None:
+                print("parse(): failed to parse " + path + "\n" + error)
+                failed.append((path, error))
+            elif on_parsed is not None:
+                on_parsed(path, outputs)
+
+            print(f"parse(): {i + 1}/{len(paths)} files processed ({os.path.basename(path)})")
+
+    return failed
@@ -0,0 +1,229 @@
+import queue
+import threading
+import time
+import traceback
+
+from backpressure import is_rejection
+
+# documents per bulk request and the most bytes of documents a request may carry, whichever is reached first
+CHUNK_SIZE = 500
+MAX_CHUNK_BYTES = 10 * 1024 * 1024
+
+# threads sending bulk requests, at most as many requests are in flight at once
+SENDER_THREADS = 4
+
+# chunks the reader thread reads ahead of the senders, bounds the memory held by the upload
+QUEUE_SIZE = 16
+
+# retries of documents rejected with 429 within a chunk, with exponential backoff between them
+MAX_RETRIES = 5
+INITIAL_BACKOFF = 2
+MAX_BACKOFF = 600
+
+# the response carries only the status and error of every document instead of its full result
+BULK_FILTER_PATH = "errors,items.*.status,items.*.error"
+
+_DONE = object()
+
+
+# A slice of a file's documents sent as one bulk request. Lines are 0-based, end_line is exclusive; sequence numbers
+# the chunks of a file and the last chunk of a file is marked, so the file is known to be complete once all chunks
+# up to the last one were sent.
+class Chunk:
+    __slots__ = ("file_name", "index_name", "sequence", "start_line", "end_line", "actions", "size", "last")
+
+    def __init__(self, file_name, index_name, sequence, start_line):
+        self.file_name = file_name
+        self.index_name = index_name
+        self.sequence = sequence
+        self.start_line = start_line
+        self.end_line = start_line
+        self.actions = []
+        self.size = 0
+        self.last = False
+
+
+# splits the documents of every file into chunks of at most chunk_size documents and max_chunk_bytes bytes; files
+# are (file name, path, index name, skip), read_actions(path, index_name, skip) yields (line, bulk entry, size in
+# bytes) for every line of the file, with None for the entry of lines skip(line) is true for. Chunks cover
+# consecutive lines, skipped lines are left out.
+def read_chunks(files, read_actions, chunk_size=CHUNK_SIZE, max_chunk_bytes=MAX_CHUNK_BYTES):
+    for file_name, path, index_name, skip in files:
+        sequence = 0
+        chunk = Chunk(file_name, index_name, sequence, 0)
+
+        for line, action, size in read_actions(path, index_name, skip):
+            if chunk.actions and (action is None or len(chunk.actions) >= chunk_size
+                                  or chunk.size + size > max_chunk_bytes):
+                yield chunk
+                sequence += 1
+                chunk = Chunk(file_name, index_name, sequence, line)
+
+            if action is None:
+                chunk.start_line = chunk.end_line = line + 1
+                continue
+
+            chunk.actions.append(action)
+            chunk.size += size
+            chunk.end_line += 1
+
+        # the last chunk is sent even if it is empty, it completes the file
+        chunk.last = True
+        yield chunk
+
+
+# splits the answer to a bulk request into the documents to send again, the number of documents rejected because the
+# cluster is overloaded and the documents that failed; positions are those of the entries in the first request
+def split_results(response, positions, entries, retry):
+    rejected = []
+    rejections = 0
+    failed = []
+    if response["errors"]:
+        for position, entry, item in zip(positions, entries, response["items"]):
+            result = next(iter(item.values()))
+            if is_rejection(result):
+                rejections += 1
+                if retry:
+                    rejected.append((position, entry))
+                    continue
+            if result.get("status", 200) >= 300:
+                failed.append((position, result))
+    return rejected, rejections, failed
+
+
+def backoff(attempt, initial_backoff=INITIAL_BACKOFF):
+    return min(initial_backoff * 2 ** (attempt - 1), MAX_BACKOFF)
+
+
+# sends NDJSON entries (an action line and a document line each, see uploader.make_entry) to the index as one bulk
+# request; documents rejected because the cluster is overloaded (429) are sent again with exponential backoff.
+# Every request waits for the limiter, if given, and reports its latency and rejections to it. Returns the position
+# in entries and the result of every document that could not be indexed.
+def send_bulk(es, index_name, entries, max_retries=MAX_RETRIES, initial_backoff=INITIAL_BACKOFF, limiter=None):
+    failed = []
+    positions = range(len(entries))
+    for attempt in range(max_retries + 1):
+        if attempt > 0:
+            time.sleep(backoff(attempt, initial_backoff))
+
+        body = b"".join(entries)
+        if limiter is not None:
+            limiter.acquire()
+        start_time = time.time()
+        try:
+            response = es.bulk(operations=body, index=index_name, filter_path=BULK_FILTER_PATH)
+        except Exception:
+            if limiter is not None:
+                limiter.release(time.time() - start_time, failed=True)
+            raise
+
+        rejected, rejections, attempt_failed = split_results(response, positions, entries, attempt < max_retries)
+        failed += attempt_failed
+        if limiter is not None:
+            limiter.release(time.time() - start_time, len(entries), len(body), rejections)
+
+        if not rejected:
+            return failed
+        positions = [position for position, _ in rejected]
+        entries = [entry for _, entry in rejected]
+
+    return failed
+
+
+# sends a chunk, returns the position in the chunk and the result of every document that could not be indexed
+def send_chunk(es, chunk, max_retries=MAX_RETRIES, limiter=None):
+    if not chunk.actions:
+        return []
+
+    try:
+        return send_bulk(es, chunk.index_name, chunk.actions, max_retries, limiter=limiter)
+    except Exception as e:
+        # the whole chunk is lost, e.g. the cluster could not be reached even after the client's retries
+        return [(position, {"error": repr(e)}) for position in range(len(chunk.actions))]
+
+
+# Uploads the files with a reader thread that fills a bounded queue of chunks and a pool of sender threads that
+# send them as bulk requests, as many at once as the limiter (backpressure.AdaptiveLimiter) allows.
+# on_chunk_done(chunk, failed) is called in the calling thread for every chunk sent, with the documents that could not
+# be indexed as returned by send_chunk, and on_file_done(file_name, lines) once all chunks of a file were sent.
+# An exception raised while reading the files is raised again in the calling thread once the chunks already read were
+# sent. Returns the number of documents sent.
+def upload_files(es, files, read_actions, on_chunk_done, on_file_done, threads=SENDER_THREADS, chunk_size=CHUNK_SIZE,
+                 max_chunk_bytes=MAX_CHUNK_BYTES, queue_size=QUEUE_SIZE, limiter=None):
+    chunks = queue.Queue(maxsize=queue_size)
+    results = queue.Queue()
+    read_error = []
+
+    def read():
+        try:
+            for chunk in read_chunks(files, read_actions, chunk_size, max_chunk_bytes):
+                chunks.put(chunk)
+        except Exception as e:
+            print("upload_files(): reading failed\n" + traceback.format_exc())
+            read_error.append(e)
+        finally:
+            for _ in range(threads):
+                chunks.put(_DONE)
+
+    def send():
+        while True:
+            chunk = chunks.get()
+            if chunk is _DONE:
+                results.put(_DONE)
+                return
+
+            results.put((chunk, send_chunk(es, chunk, limiter=limiter)))
+
+    reader = threading.Thread(target=read, name="upload-reader", daemon=True)
+    reader.start()
+    senders = [threading.Thread(target=send, name=f"upload-sender-{i}", daemon=True) for i in range(threads)]
+    for sender in senders:
+        sender.start()
+
+    # chunks sent, documents and failed documents per file, and the number of chunks and lines of files read to the end
+    sent_chunks = {}
+    documents = {}
+    failures = {}
+    total_chunks = {}
+    lines = {}
+
+    start_time = time.time()
+    sent_documents = 0
+    finished_senders = 0
+    while finished_senders < threads:
+        result = results.get()
+        if result is _DONE:
+            finished_senders += 1
+            continue
+
+        chunk, failed = result
+        file_name = chunk.file_name
+        sent_chunks[file_name] = sent_chunks.get(file_name, 0) + 1
+        documents[file_name] = documents.get(file_name, 0) + len(chunk.actions)
+        failures[file_name] = failures.get(file_name, 0) + len(failed)
+        sent_documents += len(chunk.actions)
+
+        for _, result in failed[:1]:
+            print(f"{chunk.index_name}: failed to index a document of {file_name}: {result}")
+        on_chunk_done(chunk, failed)
+
+        if chunk.last:
+            total_chunks[file_name] = chunk.sequence + 1
+            lines[file_name] = chunk.end_line
+
+        if total_chunks.get(file_name) == sent_chunks[file_name]:
+            elapsed = time.time() - start_time
+            print(f"{chunk.index_name}: uploaded {file_name} ({documents[file_name]} documents, "
+                  f"{failures[file_name]} failed), {sent_documents / elapsed:.0f} documents/s overall")
+            on_file_done(file_name, lines.pop(file_name))
+            del sent_chunks[file_name], total_chunks[file_name], documents[file_name], failures[file_name]
+
+    reader.join()
+    for sender in senders:
+        sender.join()
+
+    # the files after the one that could not be read are incomplete, the caller must not treat the upload as finished
+    if read_error:
+        raise read_error[0]
+
+    return sent_documents
@@ -0,0 +1,143 @@
+import ast
+import hashlib
+import json
+import os
+
+# default name of the manifest, kept in the parser's destination directory
+MANIFEST_FILE = "parse_manifest.json"
+
+# parsed files recorded between two writes of the manifest; the manifest is rewritten as a whole, writing it after
+# every file would take time quadratic in the number of files
+SAVE_INTERVAL = 50
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_file(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+# the source files of the module and of every module next to it that it imports, directly or through the others,
+# including imports inside functions
+def local_sources(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    sources = [os.path.abspath(path)]
+    for source in sources:
+        with open(source, "rb") as file:
+            tree = ast.parse(file.read(), source)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                imported = os.path.join(directory, name.split(".")[0] + ".py")
+                if os.path.exists(imported) and imported not in sources:
+                    sources.append(imported)
+    return sorted(sources)
+
+
+# hash of the source code of the parser module and every module of ParsingScripts it builds on
+def code_hash(parser_module):
+    sha256 = hashlib.sha256()
+    for path in local_sources(parser_module.__file__):
+        sha256.update(os.path.basename(path).encode("utf-8") + b"\0")
+        with open(path, "rb") as file:
+            sha256.update(file.read())
+    return sha256.hexdigest()
+
+
+def make_fingerprint(parser_module, translation_model, generation_params, lemmatizer_models, output_format=None):
+    return {
+        "code_hash": code_hash(parser_module),
+        "output": output_format,
+        "models": {
+            "translation": translation_model,
+            "generation_params": generation_params,
+            "lemmatizer": lemmatizer_models,
+        },
+    }
+
+
+# Records for every parsed TEI file the hash of the file, the hash of the parser code and the models used for it,
+# together with the output files. A file whose record still matches is skipped on the next run; when only the
+# models changed the translation and lemma caches miss only for the affected stage. Records are written every
+# SAVE_INTERVAL files and by close(), which the parsers call in a finally block; a killed run loses at most the
+# records of the last SAVE_INTERVAL files, which are parsed again.
+class ParseManifest:
+
+    def __init__(self, destination, file_name=MANIFEST_FILE, save_interval=SAVE_INTERVAL):
+        self.path = os.path.join(destination, file_name)
+        self.save_interval = save_interval
+        self.entries = {}
+        self.hashes = {}
+        self.unsaved = 0
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                self.entries = json.load(file).get("files", {})
+
+    def save(self):
+        # write to a temporary file first, an interrupted run must not leave a truncated manifest behind
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump({"files": self.entries}, file, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+        self.unsaved = 0
+
+    # writes the records not saved yet
+    def close(self):
+        if self.unsaved:
+            self.save()
+
+    # hashes the file, unless its size and modification time are the same as when it was last hashed
+    def xml_hash(self, path):
+        stat = os.stat(path)
+        entry = self.entries.get(os.path.basename(path))
+        if entry and entry.get("xml_size") == stat.st_size and entry.get("xml_mtime") == stat.st_mtime:
+            return entry["xml_hash"]
+        if path not in self.hashes:
+            self.hashes[path] = hash_file(path)
+        return self.hashes[path]
+
+    def is_current(self, path, fingerprint):
+        entry = self.entries.get(os.path.basename(path))
+        if entry is None:
+            return False
+
+        if entry["xml_hash"] != self.xml_hash(path):
+            return False
+        if entry["code_hash"] != fingerprint["code_hash"] or entry["models"] != fingerprint["models"]:
+            return False
+        if entry.get("output") != fingerprint["output"]:
+            return False
+
+        return all(os.path.exists(output) for output in entry["outputs"])
+
+    # splits the paths into those that need to be parsed and those whose outputs are current
+    def outdated(self, paths, fingerprint):
+        outdated = []
+        current = []
+        for path in paths:
+            (current if self.is_current(path, fingerprint) else outdated).append(path)
+        return outdated, current
+
+    def record(self, path, fingerprint, outputs):
+        stat = os.stat(path)
+        self.entries[os.path.basename(path)] = {
+            "xml_hash": self.xml_hash(path),
+            "xml_size": stat.st_size,
+            "xml_mtime": stat.st_mtime,
+            "code_hash": fingerprint["code_hash"],
+            "models": fingerprint["models"],
+            "output": fingerprint["output"],
+            "outputs": list(outputs),
+        }
+        self.unsaved += 1
+        if self.unsaved >= self.save_interval:
+            self.save()
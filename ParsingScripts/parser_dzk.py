@@ -1,15 +1,22 @@
 import json
 import os
 import re
+import sys
 import time
-import xml.etree.ElementTree as ET
 
-import spacy
 from utils import *
+import lemmatizer
+import meeting_pipeline
+import parallel_parse
+import parse_manifest
+from meeting_model import Meeting, Sentence, Word
+from tei_reader import TeiReader
+import translator
+import columnar_io
+from jsonl_io import COMPRESSION_SUFFIXES
+from lemma_cache import LEMMA_CACHE_FILE
+from translation_cache import TRANSLATION_CACHE_FILE
 
-from alive_progress import alive_bar
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-import torch
 import warnings
 
 
@@ -23,47 +30,23 @@ CORPUS_NAME = "DezelniZborKranjski"
 
 prop_nouns = set()
 
-nlp_sl = spacy.load("sl_core_news_md")
-nlp_de = spacy.load("de_core_news_md")
+# Languages the meetings are lemmatized in
+LANGS = ("sl", "de")
 
-# Model for translation
-tokenizer = None
-model = None
-device = "cuda" if torch.cuda.is_available() else "cpu"
-USE_FP16 = torch.cuda.is_available()
-
-
-def ensure_translation_model_loaded(model_name="facebook/nllb-200-distilled-1.3B"):
-    global tokenizer, model, device, USE_FP16
-    if tokenizer is not None and model is not None:
-        return
-
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-    model.eval()
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
-    if device == "cuda" and USE_FP16:
-        # convert model to fp16 for lower memory usage / faster inference on supported GPUs
-        try:
-            model.half()
-        except Exception:
-            print("Warning: could not convert model to fp16")
+# Parameters for generating translations with the NLLB model
+GENERATION_PARAMS = {
+    "num_beams": 3,
+    "early_stopping": False,
+    "length_penalty": 1.3,
+    "max_new_tokens": 512,
+}
 
 
+# translates a single text, the languages are given by their ISO codes
 def translate_text(text, source_lang, target_lang):
-    ensure_translation_model_loaded()
-
-    translated_text = ""
-
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        encoded = tokenizer(text, textreturn_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-        generated_tokens = model.generate(**encoded, forced_bos_token_id=tokenizer.get_lang_id(target_lang))
-
-        translated_text = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-
-    return translated_text
+    return translator.translate_sentences(
+        [text], translator.nllb_lang_code(source_lang), translator.nllb_lang_code(target_lang), GENERATION_PARAMS
+    )[0]
 
 
 # finds all agendas and contents and returns them as a list of dictionaries
@@ -123,97 +106,52 @@ def parse_agendas(xml_root, meeting_id):
     return agendas
 
 
-def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
-    if lang == "sl":
-        nlp = nlp_sl
-    elif lang == "de":
-        nlp = nlp_de
-    else:
+# translations are only ever lemmatized in Slovene or German, proper nouns are only collected from the originals
+def batch_lemmatize(texts, lang, sentence_ids=None, progress=True, n_process=None):
+    if lang not in LANGS:
         print(f"batch_lemmatize(): language '{lang}' not supported")
         return [[] for _ in texts]
 
-    if sentence_ids is None:
-        sentence_ids = [f"0" for _ in texts]
-
-    results = []
-
-    # Disable components not needed for lemmatization to save memory/CPU
-    disable_comps = [c for c in ("parser") if c in nlp.pipe_names]
-    with nlp.select_pipes(disable=disable_comps):
-        with alive_bar(len(texts), title=f"Lemmatizing ({lang})", force_tty=True) as bar:
-            bar(0)
-            for doc, sid in zip(nlp.pipe(texts, batch_size=batch_size, n_process=n_process), sentence_ids):
-                words = []
-                for i, token in enumerate(doc):
-                    word = {}
-                    word["id"] = sid + "." + str(i + 1) + ".(" + lang + ")"
-                    word["type"] = "pc" if token.is_punct else "w"
-                    word["lemma"] = token.lemma_
-                    word["text"] = token.text
-                    word["propn"] = 1 if token.pos_ == "PROPN" else 0
-
-                    # Adjust join attribute (needed to reconstruct the original text)
-                    word["join"] = "natural"
-                    if i < len(doc) - 1 and not token.whitespace_:
-                        word["join"] = "right"
-
-                    words.append(word)
-                results.append(words)
-                bar()
-
-    return results
+    return lemmatizer.batch_lemmatize(texts, lang, sentence_ids, progress=progress, n_process=n_process)
 
 
 def parse_sentence(sentence_root, segment_page, segment_id, speaker):
     global prop_nouns
     sentence_attribs = parse_attribs(sentence_root)
-    sentence = {}
-    sentence["id"] = sentence_attribs["id"]
-    sentence["translations"] = []
-    sentence["segment_page"] = segment_page
-    sentence["segment_id"] = segment_id
-    sentence["speaker"] = speaker
-
-    translation = {}
-    translation["lang"] = sentence_attribs["lang"]
-    translation["speaker"] = sentence["speaker"]
-    translation["original"] = 1
-    translation["text"] = ""
-    translation["words"] = []
+    sentence = Sentence(sentence_attribs["id"], segment_page, segment_id, speaker)
+    translation = sentence.add_translation(sentence_attribs["lang"], "", [], original=1)
 
     # parse original language
     for i, word_root in enumerate(sentence_root):
         word_tag = parse_tag(word_root)
 
         if word_tag == "w" or word_tag == "pc":
-            word = {}
             word_attribs = parse_attribs(word_root)
-            word["id"] = word_attribs["id"]
-            word["type"] = word_tag
-            word["lemma"] = word_attribs["lemma"]
-            word["text"] = word_root.text
-            word["join"] = word_attribs.get("join", "natural")
+            word = Word(
+                word_attribs["id"],
+                type=word_tag,
+                lemma=word_attribs["lemma"],
+                text=word_root.text,
+                join=word_attribs.get("join", "natural")
+            )
 
             # Determine if the word is a proper noun
             upostag = word_attribs.get("msd").split("|")[0].split("=")[1]
             if upostag == "PROPN":
-                word["propn"] = 1
-                prop_nouns.add(word["lemma"])
-            else:
-                word["propn"] = 0
+                word.propn = 1
+                prop_nouns.add(word.lemma)
 
-            if not word_tag == "pc" and not word["text"] == "":
-                translation["text"] += " "
-            translation["text"] += word["text"]
+            if not word_tag == "pc" and not word.text == "":
+                translation.text += " "
+            translation.text += word.text
 
-            translation["words"].append(word)
+            translation.words.append(word)
 
         else:
             print("parse_sentence(): expected child tag 'w' or 'pc', got tag '" + word_tag + "'")
             return False
 
-    sentence["translations"].append(translation)
-    sentence["original_language"] = translation["lang"]
+    sentence.original_language = translation.lang
 
     return sentence
 
@@ -251,86 +189,39 @@ def parse_segment(segment_root, speaker):
     return sentences, notes
 
 
-def parse_speeches(xml_root):
+def parse_speeches(tei_reader):
     sentences = []
     notes = []
-    activeSpeaker = None
-
-    # find debateSection
-    debate_section = xml_root.find(".//ns0:div[@type='debateSection']", NAMESPACE_MAPPINGS)
-    if debate_section is None:
-        return sentences, notes
-
-    def process_node(node, current_speaker):
-        node_sentences = []
-        node_notes = []
-
-        for child in node:
-            tag = parse_tag(child)
-            attribs = parse_attribs(child)
-
-            # utterance or paragraph with a segment child
-            if (tag == "u" or tag == "p") and len(child) > 0 and parse_tag(child[0]) == "seg":
-                # utterances have a speaker, paragraphs do not
-                speaker = current_speaker if tag == "u" else None
-                parsed_sentences, parsed_notes = parse_segment(child[0], speaker)
-                node_sentences.extend(parsed_sentences)
-                node_notes.extend(parsed_notes)
-
-            # speaker note updates current speaker for subsequent siblings
-            elif tag == "note" and attribs.get("type") == "speaker":
-                # sanitize speaker string
-                current_speaker = re.sub(r'[^a-zA-ZäöüßÄÖÜčšžČŠŽ. 0-9]', '', child.text)
-
-            # nested div -> recurse one level deeper (and deeper if needed)
-            elif tag == "div":
-                nested_sentences, nested_notes, current_speaker = process_node(child, current_speaker)
-                node_sentences.extend(nested_sentences)
-                node_notes.extend(nested_notes)
-
-            # ignore other tags
-        return node_sentences, node_notes, current_speaker
-
-    sentences, notes, _ = process_node(debate_section, activeSpeaker)
-    return sentences, notes
+    current_speaker = None
 
+    # the reader streams the debateSection (and its nested divs) in document order
+    for event, payload in tei_reader.events():
+        if event == "speaker":
+            # sanitize speaker string
+            current_speaker = re.sub(r'[^a-zA-ZäöüßÄÖÜčšžČŠŽ. 0-9]', '', payload)
 
-def translate_sentences(sentences, source_lang, target_lang, chunk_size=10, num_beams=3):
-    ensure_translation_model_loaded()
+        # utterances have a speaker, paragraphs do not
+        elif event == "utterance" or event == "paragraph":
+            speaker = current_speaker if event == "utterance" else None
+            parsed_sentences, parsed_notes = parse_segment(payload, speaker)
+            sentences.extend(parsed_sentences)
+            notes.extend(parsed_notes)
 
-    translations = []
-
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        with alive_bar(len(sentences), title=f"Translating {source_lang}→{target_lang}", force_tty=True) as bar:
-            bar(0)
-            for start in range(0, len(sentences), chunk_size):
-                end = start + chunk_size
-                chunk = sentences[start:end]
+    return sentences, notes
 
-                encoded = tokenizer(chunk, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-                generated_tokens = model.generate(
-                    **encoded,
-                    forced_bos_token_id=get_lang_id(tokenizer, target_lang),
-                    num_beams=num_beams,
-                    early_stopping=False,
-                    length_penalty=1.3,
-                    max_new_tokens=512,
-                )
 
-                decoded = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-                translations.extend(decoded)
+def translate_sentences(sentences, source_lang, target_lang):
+    return translator.translate_sentences(sentences, source_lang, target_lang, GENERATION_PARAMS)
 
-                # free intermediate tensors and clear cached GPU memory
-                if device == "cuda":
-                    del encoded, generated_tokens
-                    torch.cuda.empty_cache()
 
-                bar(len(chunk))
+# translates the sentences into several languages, encoding each batch only once
+def translate_sentences_multi(sentences, source_lang, target_langs, progress=True):
+    return translator.translate_sentences_multi(
+        sentences, source_lang, target_langs, GENERATION_PARAMS, progress=progress
+    )
 
-    return translations
 
-# translates the sentences and agendas in a meeting
+# translates the sentences in a meeting, translating the next chunk of sentences while the previous one is lemmatized
 def translate_meeting(meeting):
     start_time = time.time()
 
@@ -342,67 +233,31 @@ def translate_meeting(meeting):
     sl_translations_list = []
 
     # get all sentences in the meeting and put them in lists according to their language, also get their ids
-    for sentence in meeting["sentences"]:
-        if sentence["translations"][0]["lang"] == "de":
-            de_sentence_ids.append(sentence["id"])
-            de_translations_list.append(sentence["translations"][0]["text"])
-        elif sentence["translations"][0]["lang"] == "sl":
-            sl_sentence_ids.append(sentence["id"])
-            sl_translations_list.append(sentence["translations"][0]["text"])
-
-    # translate german to slovene
-    translations_sl = translate_sentences(de_translations_list, 'deu_Latn', 'slv_Latn')
-    mid_time1 = time.time()
-    print("translating to sl took " + str(mid_time1 - start_time) + " seconds")
-
-    # lemmatize slovene translations
-    lemmatizations_sl = batch_lemmatize(translations_sl, 'sl', de_sentence_ids)
-    mid_time2 = time.time()
-    print("lemmatizing sl took " + str(mid_time2 - mid_time1) + " seconds")
-
-
-    for i, (translated_text, lemmatization) in enumerate(zip(translations_sl, lemmatizations_sl)):
-        sentence_id = de_sentence_ids[i]
-        sentence_index = next((idx for (idx, d) in enumerate(meeting["sentences"]) if d["id"] == sentence_id), None)
-        if sentence_index is None:
-            continue
-
-        translation_entry = {
-            "lang": "sl",
-            "original": 0,
-            "speaker": meeting["sentences"][sentence_index]["speaker"],
-            "text": translated_text,
-            "words": lemmatization
-        }
-
-        meeting["sentences"][sentence_index]["translations"].append(translation_entry)
-
-    # translate slovene to german
-    translations_de = translate_sentences(sl_translations_list,'slv_Latn', 'deu_Latn')
-    mid_time3 = time.time()
-    print("translating to de took " + str(mid_time3 - mid_time2) + " seconds")
-
-    # lemmatize german translations
-    lemmatizations_de = batch_lemmatize(translations_de, 'de', sl_sentence_ids)
-    mid_time4 = time.time()
-    print("lemmatizing de took " + str(mid_time4 - mid_time3) + " seconds")
-
-    for i, (translated_text, lemmatization) in enumerate(zip(translations_de, lemmatizations_de)):
-        sentence_id = sl_sentence_ids[i]
-        sentence_index = next((idx for (idx, d) in enumerate(meeting["sentences"]) if d["id"] == sentence_id), None)
-        if sentence_index is None:
-            continue
-
-        translation_entry = {
-            "lang": "de",
-            "original": 0,
-            "speaker": meeting["sentences"][sentence_index]["speaker"],
-            "text": translated_text,
-            "words": lemmatization
-        }
-
-        meeting["sentences"][sentence_index]["translations"].append(translation_entry)
-
+    for sentence in meeting.sentences:
+        if sentence.translations[0].lang == "de":
+            de_sentence_ids.append(sentence.id)
+            de_translations_list.append(sentence.translations[0].text)
+        elif sentence.translations[0].lang == "sl":
+            sl_sentence_ids.append(sentence.id)
+            sl_translations_list.append(sentence.translations[0].text)
+
+    def add_translation(sentence_id, lang, text, words):
+        sentence = meeting.sentence(sentence_id)
+        if sentence is not None:
+            sentence.add_translation(lang, text, words)
+
+    # german to slovene and slovene to german
+    timings = meeting_pipeline.translate_and_lemmatize(
+        [
+            ("deu_Latn", {"slv_Latn": "sl"}, de_sentence_ids, de_translations_list),
+            ("slv_Latn", {"deu_Latn": "de"}, sl_sentence_ids, sl_translations_list),
+        ],
+        lambda texts, source_lang, target_langs: translate_sentences_multi(texts, source_lang, target_langs, False),
+        lambda texts, lang, sentence_ids: batch_lemmatize(texts, lang, sentence_ids, progress=False, n_process=1),
+        add_translation
+    )
+    print("translating took " + str(timings["translate"]) + " seconds, lemmatizing took " + str(
+        timings["lemmatize"]) + " seconds")
 
     end_time = time.time()
     print(
@@ -412,34 +267,30 @@ def translate_meeting(meeting):
     return
 
 
-def parse_zapisnik(xml_root):
+def parse_zapisnik(tei_reader):
     meeting_parse_start_time = time.time()
 
-    meeting = {}
-
-    # get the meeting id
-    meeting["id"] = xml_root.attrib["{http://www.w3.org/XML/1998/namespace}id"]
+    # get speeches first, this streams through the document and collects word coordinates on the way
+    sentences, notes = parse_speeches(tei_reader)
+    xml_root = tei_reader.root
 
-    # get the meeting date
-    meeting["date"] = parse_date_from_id(meeting["id"])
+    # get the meeting id and date
+    meeting_id = tei_reader.meeting_id
+    meeting_date = parse_date_from_id(meeting_id)
 
     # get the meeting title
-    meeting["titles"] = parse_titles(xml_root, NAMESPACE_MAPPINGS)
+    titles = parse_titles(xml_root, NAMESPACE_MAPPINGS)
 
     # get agendas
-    meeting["agendas"] = parse_agendas(xml_root, meeting["id"])
+    agendas = parse_agendas(xml_root, meeting_id)
 
-    # get speeches
-    meeting["sentences"], meeting["notes"] = parse_speeches(xml_root)
+    meeting = Meeting(meeting_id, meeting_date, titles, agendas, sentences, notes, corpus=CORPUS_NAME)
 
     # translate meeting
     translate_meeting(meeting)
 
-    # set corpus
-    meeting["corpus"] = CORPUS_NAME
-
     # gather data about sentences and words
-    coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS)
+    coords_index = tei_reader.coords_index
     transformed_sentences = transform_sentences_fast(meeting, coords_index=coords_index)
     transformed_words = transform_words_fast(meeting, coords_index=coords_index)
 
@@ -449,37 +300,76 @@ def parse_zapisnik(xml_root):
     return meeting, transformed_sentences, transformed_words
 
 
-def parse(source, destination, from_idx=0, to_idx=-1):
-    files = os.listdir(source)
-    for i, file in enumerate(files):
-
-        if i < from_idx:
-            continue
-
-        if i >= to_idx and to_idx != -1:
-            break
-
-        if not file.endswith(".xml") or not file.startswith("DezelniZborKranjski"):
-            continue
-
-        path = os.path.join(source, file)
-
-        xml_tree = ET.parse(path)
-        xml_root = xml_tree.getroot()
-
-        print("parse(): processing file " + file)
-
-        # initialize parser
-        zapisnik, povedi, besede = parse_zapisnik(xml_root)
-
-        # save data to jsonl files
-        file_path = os.path.join(destination, zapisnik["id"] + "_meeting.jsonl")
-        save_to_jsonl([zapisnik], file_path)
-
-        file_path = os.path.join(destination, zapisnik["id"] + "_sentences.jsonl")
-        save_to_jsonl(povedi, file_path)
-
-        file_path = os.path.join(destination, zapisnik["id"] + "_words.jsonl")
-        save_to_jsonl(besede, file_path)
+def parse_file(path, destination, translation_cache_path=None, translation_engine=None, lemma_cache_path=None,
+               compression=None, output_format="jsonl"):
+    translator.configure_translation_engine(**(translation_engine or {}))
+    translator.open_translation_cache(translation_cache_path or os.path.join(destination, TRANSLATION_CACHE_FILE))
+    lemmatizer.open_lemma_cache(lemma_cache_path or os.path.join(destination, LEMMA_CACHE_FILE))
+
+    # initialize parser
+    zapisnik, povedi, besede = parse_zapisnik(TeiReader(path))
+
+    # save data to jsonl (or arrow/parquet) files, sentences and words are streamed from the transforms straight
+    # into the files
+    extension = ".jsonl" + COMPRESSION_SUFFIXES[compression]
+    table_extension = columnar_io.COLUMNAR_SUFFIXES.get(output_format, extension)
+    outputs = [
+        os.path.join(destination, zapisnik.id + "_meeting" + extension),
+        os.path.join(destination, zapisnik.id + "_sentences" + table_extension),
+        os.path.join(destination, zapisnik.id + "_words" + table_extension),
+    ]
+
+    # the transforms are generators, building the documents is timed together with writing them
+    save_start_time = time.time()
+    save_to_jsonl([zapisnik.to_dict()], outputs[0])
+    if output_format in columnar_io.COLUMNAR_SUFFIXES:
+        columnar_io.save_to_columnar(povedi, outputs[1], columnar_io.sentences_schema())
+        columnar_io.save_to_columnar(besede, outputs[2], columnar_io.words_schema())
+    else:
+        save_to_jsonl(povedi, outputs[1])
+        save_to_jsonl(besede, outputs[2])
+    print(f"parse_file(): transformed and saved the meeting in {time.time() - save_start_time} seconds")
+
+    return outputs
+
+
+def parse(source, destination, from_idx=0, to_idx=-1, workers=1, translation_cache_path=None,
+          translation_engine=None, lemma_cache_path=None, force=False, compression=None, output_format="jsonl"):
+    paths = parallel_parse.select_files(source, from_idx, to_idx, prefix=CORPUS_NAME)
+
+    # skip meetings whose outputs were produced from the same XML, parser code and models, unless forced
+    manifest = parse_manifest.ParseManifest(destination)
+    fingerprint = parse_manifest.make_fingerprint(
+        sys.modules[__name__],
+        translator.engine_identifier(**(translation_engine or {})),
+        GENERATION_PARAMS,
+        {lang: lemmatizer.profile_identifier(lang) for lang in LANGS},
+        output_format={"compression": compression, "format": output_format}
+    )
+    if not force:
+        paths, current = manifest.outdated(paths, fingerprint)
+        print(f"parse(): {len(current)} files are up to date, {len(paths)} to parse")
+
+    # workers > 1 shards the files across a process pool, every worker loads its own models once
+    try:
+        failed = parallel_parse.parse_files(
+            sys.modules[__name__],
+            paths,
+            destination,
+            workers,
+            options={
+                "translation_cache_path": translation_cache_path,
+                "translation_engine": translation_engine,
+                "lemma_cache_path": lemma_cache_path,
+                "compression": compression,
+                "output_format": output_format
+            },
+            on_parsed=lambda path, outputs: manifest.record(path, fingerprint, outputs),
+            nouns_attr="prop_nouns"
+        )
+    finally:
+        manifest.close()
 
-        print(f"parse(): {i+1}/{len(files)} files processed\n")
\ No newline at end of file
+    print(f"parse(): parsed {len(paths) - len(failed)}/{len(paths)} files")
+    for path, _ in failed:
+        print("parse(): failed " + path)
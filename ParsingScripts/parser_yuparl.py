@@ -1,18 +1,23 @@
-import xml.etree.ElementTree as ET
 import time
 import os
 import re
+import sys
 
 import requests
-import spacy
-import spacy_transformers
 import cyrtranslit
-import torch
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
-from alive_progress import alive_bar
-from huggingface_hub import snapshot_download
 
 from utils import *
+import lemmatizer
+import meeting_pipeline
+import parallel_parse
+import parse_manifest
+from meeting_model import Meeting, Sentence, Word
+from tei_reader import TeiReader
+import translator
+import columnar_io
+from jsonl_io import COMPRESSION_SUFFIXES
+from lemma_cache import LEMMA_CACHE_FILE
+from translation_cache import TRANSLATION_CACHE_FILE
 
 # Text is either in Slovene or Serbo-Croatian. We consider that the text is in Croatian, if Serbo-Croatian is
 # written with latinic characters and in Serbian if it is written in cyrillic. Since Libretranslate
@@ -28,48 +33,23 @@ CORPUS_NAME = 'Yu1Parl'
 
 proper_nouns = set()
 
-nlp_sl = spacy.load('sl_core_news_md')
-nlp_hr = spacy.load('hr_core_news_md')
-nlp_sr = spacy.load(snapshot_download(repo_id="Tanor/sr_Spacy_Serbian_Model_SrpKor4Tagging_BERTICOVO"))
+# Languages the meetings are lemmatized in
+LANGS = ('sl', 'hr', 'sr')
 
-# Model for translation
-tokenizer = None
-model = None
-device = "cuda" if torch.cuda.is_available() else "cpu"
-USE_FP16 = torch.cuda.is_available()
-
-
-def ensure_translation_model_loaded(model_name="facebook/nllb-200-distilled-1.3B"):
-    global tokenizer, model, device, USE_FP16
-    if tokenizer is not None and model is not None:
-        return
-
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
-    model.eval()
-    device = "cuda" if torch.cuda.is_available() else "cpu"
-    model.to(device)
-    if device == "cuda" and USE_FP16:
-        # convert model to fp16 for lower memory usage / faster inference on supported GPUs
-        try:
-            model.half()
-        except Exception:
-            print("Warning: could not convert model to fp16")
+# Parameters for generating translations with the NLLB model
+GENERATION_PARAMS = {
+    "num_beams": 5,
+    "early_stopping": True,
+    "length_penalty": 1.2,
+    "max_new_tokens": 128,
+}
 
 
+# translates a single text, the languages are given by their ISO codes
 def translate_text(text, source_lang, target_lang):
-    ensure_translation_model_loaded()
-
-    translated_text = ""
-
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        encoded = tokenizer(text, textreturn_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-        generated_tokens = model.generate(**encoded, forced_bos_token_id=tokenizer.get_lang_id(target_lang))
-
-        translated_text = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-
-    return translated_text
+    return translator.translate_sentences(
+        [text], translator.nllb_lang_code(source_lang), translator.nllb_lang_code(target_lang), GENERATION_PARAMS
+    )[0]
 
 
 def parse_agendas(xml_root):
@@ -101,7 +81,7 @@ def parse_agendas(xml_root):
             agenda_hr = []
             agenda_sr = []
             for item in agendas[0]["items"]:
-                serbo_croatian_latinic = translate_text(item['text'], 'sl', 'sr')
+                serbo_croatian_latinic = translate_text(item['text'], 'sl', 'hr')
                 serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(serbo_croatian_latinic)
                 agenda_hr.append({
                     'n': item['n'],
@@ -125,7 +105,7 @@ def parse_agendas(xml_root):
             agenda_sr = []
             for item in agendas[0]["items"]:
                 serbo_croatian_cyrilic = cyrtranslit.to_cyrillic(item['text'])
-                slovene = translate_text(item['text'], 'sr', 'sl')
+                slovene = translate_text(item['text'], 'hr', 'sl')
                 agenda_sl.append({
                     'n': item['n'],
                     'text': slovene
@@ -150,7 +130,7 @@ def parse_agendas(xml_root):
             agenda_hr = []
             for item in agendas[0]["items"]:
                 serbo_croatian_latinic = cyrtranslit.to_latin(item['text'])
-                slovene = translate_text(serbo_croatian_latinic, 'sr', 'sl')
+                slovene = translate_text(serbo_croatian_latinic, 'hr', 'sl')
                 agenda_sl.append({
                     'n': item['n'],
                     'text': slovene
@@ -176,7 +156,7 @@ def parse_agendas(xml_root):
         if hr_agenda is not None and sr_agenda is not None and sl_agenda is None:
             sl_agenda = []
             for item in hr_agenda['items']:
-                slovene = translate_text(item['text'], 'sr', 'sl')
+                slovene = translate_text(item['text'], 'hr', 'sl')
                 sl_agenda.append({
                     'n': item['n'],
                     'text': slovene
@@ -224,52 +204,14 @@ def parse_agendas(xml_root):
 
 
 
-def batch_lemmatize(texts, lang, sentence_ids=None, batch_size=64, n_process=1):
-    global proper_nouns
-
-    if lang == 'sl':
-        nlp = nlp_sl
-    elif lang == 'hr':
-        nlp = nlp_hr
-    elif lang == 'sr':
-        nlp = nlp_sr
-    else:
+def batch_lemmatize(texts, lang, sentence_ids=None, progress=True, n_process=None):
+    if lang not in LANGS:
         print(f"batch_lemmatize(): language '{lang}' not supported")
         return [[] for _ in texts]
 
-    if sentence_ids is None:
-        sentence_ids = [f"0" for _ in texts]
-
-    results = []
-
-    disable_comps = [c for c in ("parser") if c in nlp.pipe_names]
-    with nlp.select_pipes(disable=disable_comps):
-        with alive_bar(len(texts), title=f"Lemmatizing ({lang})", force_tty=True) as bar:
-            bar(0)
-            for doc, sid in zip(nlp.pipe(texts, batch_size=batch_size, n_process=n_process), sentence_ids):
-                words = []
-                for i, token in enumerate(doc):
-                    word = {}
-                    word["id"] = sid + "." + str(i + 1) + ".(" + lang + ")"
-                    word["type"] = "pc" if token.is_punct else "w"
-                    word["lemma"] = token.lemma_
-                    word["text"] = token.text
-                    word["propn"] = 1 if token.pos_ == "PROPN" else 0
-
-                    # Adjust join attribute (needed to reconstruct the original text)
-                    word["join"] = "natural"
-                    if i < len(doc) - 1 and not token.whitespace_:
-                        word["join"] = "right"
-
-                    words.append(word)
-
-                    if token.pos_ == "PROPN":
-                        proper_nouns.add(token.lemma_)
-
-                results.append(words)
-                bar()
-
-    return results
+    return lemmatizer.batch_lemmatize(
+        texts, lang, sentence_ids, proper_nouns=proper_nouns, progress=progress, n_process=n_process
+    )
 
 
 def parse_sentence(sentence_root, segment_page, segment_id, speaker):
@@ -280,20 +222,10 @@ def parse_sentence(sentence_root, segment_page, segment_id, speaker):
         print(f"Invalid language: {sentence_attribs['lang']}. Skipping.")
         return
 
-    sentence = {
-        'id': sentence_attribs['id'],
-        'segment_page': segment_page,
-        'segment_id': segment_id,
-        'speaker': speaker,
-        'translations': []
-    }
+    sentence = Sentence(sentence_attribs['id'], segment_page, segment_id, speaker)
 
-    translation = {
-        'lang': sentence_attribs['lang'],
-        'original': 1,
-        'text': '',
-        'words': []
-    }
+    # the original text is stored without the speaker
+    translation = sentence.add_translation(sentence_attribs['lang'], '', [], original=1, has_speaker=False)
 
     for word_root in sentence_root:
         word_tag = parse_tag(word_root)
@@ -301,26 +233,25 @@ def parse_sentence(sentence_root, segment_page, segment_id, speaker):
         if word_tag == 'w' or word_tag == 'pc':
             word_attribs = parse_attribs(word_root)
             upostag = word_attribs.get("msd").split("|")[0].split("=")[1]
-            word = {
-                'id': word_attribs['id'],
-                'text': word_root.text,
-                'lemma': word_attribs['lemma'],
-                'propn': 1 if upostag == 'PROPN' else 0
-            }
+            word = Word(
+                word_attribs['id'],
+                lemma=word_attribs['lemma'],
+                text=word_root.text,
+                propn=1 if upostag == 'PROPN' else 0
+            )
 
             if upostag == 'PROPN':
-                proper_nouns.add(word['lemma'])
+                proper_nouns.add(word.lemma)
 
-            if not word_tag == "pc" and not word["text"] == "":
-                translation["text"] += " "
-            translation["text"] += word["text"]
-            translation["words"].append(word)
+            if not word_tag == "pc" and not word.text == "":
+                translation.text += " "
+            translation.text += word.text
+            translation.words.append(word)
 
         else:
             print(f"Invalid word tag: {word_tag}. Skipping.")
 
-    sentence["translations"].append(translation)
-    sentence["original_language"] = translation["lang"]
+    sentence.original_language = translation.lang
 
     return sentence
 
@@ -357,84 +288,36 @@ def parse_segment(segment_root, speaker):
     return sentences, notes
 
 
-def parse_speeches(xml_root):
+def parse_speeches(tei_reader):
     sentences = []
     notes = []
-    activeSpeaker = None
-
-    # find debateSection
-    debate_section = xml_root.find(".//ns0:div[@type='debateSection']", NAMESPACE_MAPPINGS)
-    if debate_section is None:
-        return sentences, notes
-
-    def process_node(node, current_speaker):
-        node_sentences = []
-        node_notes = []
-
-        for child in node:
-            tag = parse_tag(child)
-            attribs = parse_attribs(child)
-
-            # utterance or paragraph with a segment child
-            if (tag == "u" or tag == "p") and len(child) > 0 and parse_tag(child[0]) == "seg":
-                # utterances have a speaker, paragraphs do not
-                speaker = current_speaker if tag == "u" else None
-                parsed_sentences, parsed_notes = parse_segment(child[0], speaker)
-                node_sentences.extend(parsed_sentences)
-                node_notes.extend(parsed_notes)
-
-            # speaker note updates current speaker for subsequent siblings
-            elif tag == "note" and attribs.get("type") == "speaker":
-                # sanitize speaker string
-                current_speaker = re.sub(r'[^a-zA-ZäöüßÄÖÜčšžČŠŽ. 0-9]', '', child.text)
-
-            # nested div -> recurse one level deeper (and deeper if needed)
-            elif tag == "div":
-                nested_sentences, nested_notes, current_speaker = process_node(child, current_speaker)
-                node_sentences.extend(nested_sentences)
-                node_notes.extend(nested_notes)
-
-            # ignore other tags
-        return node_sentences, node_notes, current_speaker
-
-    sentences, notes, _ = process_node(debate_section, activeSpeaker)
-    return sentences, notes
-
-
-def translate_sentences(sentences, source_lang, target_lang, chunk_size=10, num_beams=5):
-    ensure_translation_model_loaded()
+    current_speaker = None
 
-    translations = []
+    # the reader streams the debateSection (and its nested divs) in document order
+    for event, payload in tei_reader.events():
+        if event == "speaker":
+            # sanitize speaker string
+            current_speaker = re.sub(r'[^a-zA-ZäöüßÄÖÜčšžČŠŽ. 0-9]', '', payload)
 
-    tokenizer.src_lang = source_lang
-    with torch.no_grad():
-        with alive_bar(len(sentences), title=f"Translating {source_lang}→{target_lang}", force_tty=True) as bar:
-            bar(0)
-            for start in range(0, len(sentences), chunk_size):
-                end = start + chunk_size
-                chunk = sentences[start:end]
+        # utterances have a speaker, paragraphs do not
+        elif event == "utterance" or event == "paragraph":
+            speaker = current_speaker if event == "utterance" else None
+            parsed_sentences, parsed_notes = parse_segment(payload, speaker)
+            sentences.extend(parsed_sentences)
+            notes.extend(parsed_notes)
 
-                encoded = tokenizer(chunk, return_tensors="pt", padding=True, truncation=True, max_length=512).to(device)
-                generated_tokens = model.generate(
-                    **encoded,
-                    forced_bos_token_id=get_lang_id(tokenizer, target_lang),
-                    num_beams=num_beams,
-                    early_stopping=True,
-                    length_penalty=1.2,
-                    max_new_tokens=128,
-                )
+    return sentences, notes
 
-                decoded = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-                translations.extend(decoded)
 
-                # free intermediate tensors and clear cached GPU memory
-                if device == "cuda":
-                    del encoded, generated_tokens
-                    torch.cuda.empty_cache()
+def translate_sentences(sentences, source_lang, target_lang):
+    return translator.translate_sentences(sentences, source_lang, target_lang, GENERATION_PARAMS)
 
-                bar(len(chunk))
 
-    return translations
+# translates the sentences into several languages, encoding each batch only once
+def translate_sentences_multi(sentences, source_lang, target_langs, progress=True):
+    return translator.translate_sentences_multi(
+        sentences, source_lang, target_langs, GENERATION_PARAMS, progress=progress
+    )
 
 
 def translate_meeting(meeting):
@@ -445,145 +328,69 @@ def translate_meeting(meeting):
     sr_ids, sr_texts = [], []
     sl_ids, sl_texts = [], []
 
-    # filter out none sentences
-    meeting['sentences'] = [sentence for sentence in meeting['sentences'] if sentence is not None]
-
-    for sentence in meeting['sentences']:
-        if sentence['original_language'] == 'hr':
-            hr_ids.append(sentence['id'])
-            hr_texts.append(sentence['translations'][0]['text'])
-        elif sentence['original_language'] == 'sr':
-            sr_ids.append(sentence['id'])
-            sr_texts.append(sentence['translations'][0]['text'])
-        elif sentence['original_language'] == 'sl':
-            sl_ids.append(sentence['id'])
-            sl_texts.append(sentence['translations'][0]['text'])
-
-    # HR -> SL, SR
-    if len(hr_texts) > 0:
-        hr2sl = translate_sentences(hr_texts, 'hrv_Latn', 'slv_Latn')
-        hr2sr = translate_sentences(hr_texts, 'hrv_Latn', 'srp_Cyrl')
-
-        lemm_sl = batch_lemmatize(hr2sl, 'sl', hr_ids)
-        lemm_sr = batch_lemmatize(hr2sr, 'sr', hr_ids)
-
-        for i, sid in enumerate(hr_ids):
-            sentence_index = next((index for (index, d) in enumerate(meeting['sentences']) if d['id'] == sid), None)
-            if sentence_index is None:
-                continue
-
-            translation_sl = {
-                'lang': 'sl',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': hr2sl[i],
-                'words': lemm_sl[i]
-            }
-            translation_sr = {
-                'lang': 'sr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': hr2sr[i],
-                'words': lemm_sr[i]
-            }
-
-            meeting['sentences'][sentence_index]['translations'].append(translation_sl)
-            meeting['sentences'][sentence_index]['translations'].append(translation_sr)
-
-    hr_time = time.time()
-    print(f"Translating HR to SL & SR sentences in {hr_time - start_time} seconds")
-
-    # SR -> HR (latinic) and SL
-    if len(sr_texts) > 0:
-        sr2sl = translate_sentences(sr_texts, 'srp_Cyrl', 'slv_Latn')
-        sr2hr = translate_sentences(sr_texts, 'srp_Cyrl', 'hrv_Latn')
-
-        lemm_hr = batch_lemmatize(sr2hr, 'hr', sr_ids)
-        lemm_sl = batch_lemmatize(sr2sl, 'sl', sr_ids)
-
-        for i, sid in enumerate(sr_ids):
-            sentence_index = next((index for (index, d) in enumerate(meeting['sentences']) if d['id'] == sid), None)
-            if sentence_index is None:
-                continue
-
-            translation_hr = {
-                'lang': 'hr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sr2hr[i],
-                'words': lemm_hr[i]
-            }
-            translation_sl = {
-                'lang': 'sl',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sr2sl[i],
-                'words': lemm_sl[i]
-            }
-
-            meeting['sentences'][sentence_index]['translations'].append(translation_hr)
-            meeting['sentences'][sentence_index]['translations'].append(translation_sl)
-
-    sr_time = time.time()
-    print(f"Translating SR to HR & SL sentences in {sr_time - hr_time} seconds")
-
-    # SL -> HR (latin) and SR (cyrillic)
-    if len(sl_texts) > 0:
-        sl2hr = translate_sentences(sl_texts, 'slv_Latn', 'hrv_Latn')
-        sl2sr = translate_sentences(sl_texts, 'slv_Latn', 'srp_Cyrl')
-
-        lemm_hr = batch_lemmatize(sl2hr, 'hr', sl_ids)
-        lemm_sr = batch_lemmatize(sl2sr, 'sr', sl_ids)
-
-        for i, sid in enumerate(sl_ids):
-            sentence_index = next((index for (index, d) in enumerate(meeting['sentences']) if d['id'] == sid), None)
-            if sentence_index is None:
-                continue
-
-            translation_hr = {
-                'lang': 'hr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sl2hr[i],
-                'words': lemm_hr[i]
-            }
-            translation_sr = {
-                'lang': 'sr',
-                'original': 0,
-                'speaker': meeting['sentences'][sentence_index]['speaker'],
-                'text': sl2sr[i],
-                'words': lemm_sr[i]
-            }
-
-            meeting['sentences'][sentence_index]['translations'].append(translation_hr)
-            meeting['sentences'][sentence_index]['translations'].append(translation_sr)
+    for sentence in meeting.sentences:
+        if sentence.original_language == 'hr':
+            hr_ids.append(sentence.id)
+            hr_texts.append(sentence.translations[0].text)
+        elif sentence.original_language == 'sr':
+            sr_ids.append(sentence.id)
+            sr_texts.append(sentence.translations[0].text)
+        elif sentence.original_language == 'sl':
+            sl_ids.append(sentence.id)
+            sl_texts.append(sentence.translations[0].text)
+
+    def add_translation(sentence_id, lang, text, words):
+        sentence = meeting.sentence(sentence_id)
+        if sentence is not None:
+            sentence.add_translation(lang, text, words)
+
+    # the directions share one pipeline, the model translates the next chunk while the previous one is lemmatized
+    timings = meeting_pipeline.translate_and_lemmatize(
+        [
+            # HR -> SL, SR
+            ('hrv_Latn', {'slv_Latn': 'sl', 'srp_Cyrl': 'sr'}, hr_ids, hr_texts),
+            # SR -> HR (latinic) and SL
+            ('srp_Cyrl', {'hrv_Latn': 'hr', 'slv_Latn': 'sl'}, sr_ids, sr_texts),
+            # SL -> HR (latin) and SR (cyrillic)
+            ('slv_Latn', {'hrv_Latn': 'hr', 'srp_Cyrl': 'sr'}, sl_ids, sl_texts),
+        ],
+        lambda texts, source_lang, target_langs: translate_sentences_multi(texts, source_lang, target_langs, False),
+        lambda texts, lang, sentence_ids: batch_lemmatize(texts, lang, sentence_ids, progress=False, n_process=1),
+        add_translation
+    )
 
     end_time = time.time()
-    print(f"Translating SL to HR & SR sentences in {end_time - sr_time} seconds")
+    print(f"Translating took {timings['translate']} seconds, lemmatizing took {timings['lemmatize']} seconds")
     print(f"Translated meeting in {end_time - start_time} seconds")
 
     return
 
 
-def parse_zapisnik(xml_root):
+def parse_zapisnik(tei_reader):
     start_time = time.time()
-    meeting_id = xml_root.attrib['{http://www.w3.org/XML/1998/namespace}id']
-    sentences, notes = parse_speeches(xml_root)
-
-    meeting = {
-        'id': meeting_id,
-        'date': parse_date_from_id(meeting_id),
-        'titles': parse_titles(xml_root, NAMESPACE_MAPPINGS),
-        'agendas': parse_agendas(xml_root),
-        'sentences': sentences,
-        'notes': notes,
-        'corpus': CORPUS_NAME
-    }
+
+    # get speeches first, this streams through the document and collects word coordinates on the way
+    sentences, notes = parse_speeches(tei_reader)
+    xml_root = tei_reader.root
+    meeting_id = tei_reader.meeting_id
+
+    # sentences in unsupported languages are skipped by parse_sentence
+    sentences = [sentence for sentence in sentences if sentence is not None]
+
+    meeting = Meeting(
+        meeting_id,
+        parse_date_from_id(meeting_id),
+        parse_titles(xml_root, NAMESPACE_MAPPINGS),
+        parse_agendas(xml_root),
+        sentences,
+        notes,
+        corpus=CORPUS_NAME
+    )
 
     translate_meeting(meeting)
 
     # gather data about sentences and words
-    coords_index = build_coords_index(xml_root, NAMESPACE_MAPPINGS)
+    coords_index = tei_reader.coords_index
     transformed_sentences = transform_sentences_fast(meeting, coords_index=coords_index)
     transformed_words = transform_words_fast(meeting, coords_index=coords_index)
 
@@ -593,37 +400,76 @@ def parse_zapisnik(xml_root):
     return meeting, transformed_sentences, transformed_words
 
 
-def parse(source, destination, from_idx=0, to_idx=-1):
-    files = os.listdir(source)
-    for i, file in enumerate(files):
-
-        if i < from_idx:
-            continue
-
-        if i >= to_idx and to_idx != -1:
-            break
-
-        if not file.endswith(".xml") or not file.startswith("DezelniZborKranjski"):
-            continue
-
-        path = os.path.join(source, file)
-
-        xml_tree = ET.parse(path)
-        xml_root = xml_tree.getroot()
-
-        print("parse(): processing file " + file)
-
-        # initialize parser
-        zapisnik, povedi, besede = parse_zapisnik(xml_root)
-
-        # save data to jsonl files
-        file_path = os.path.join(destination, zapisnik["id"] + "_meeting.jsonl")
-        save_to_jsonl([zapisnik], file_path)
-
-        file_path = os.path.join(destination, zapisnik["id"] + "_sentences.jsonl")
-        save_to_jsonl(povedi, file_path)
-
-        file_path = os.path.join(destination, zapisnik["id"] + "_words.jsonl")
-        save_to_jsonl(besede, file_path)
-
-        print(f"parse(): {i+1}/{len(files)} files processed\n")
\ No newline at end of file
+def parse_file(path, destination, translation_cache_path=None, translation_engine=None, lemma_cache_path=None,
+               compression=None, output_format="jsonl"):
+    translator.configure_translation_engine(**(translation_engine or {}))
+    translator.open_translation_cache(translation_cache_path or os.path.join(destination, TRANSLATION_CACHE_FILE))
+    lemmatizer.open_lemma_cache(lemma_cache_path or os.path.join(destination, LEMMA_CACHE_FILE))
+
+    # initialize parser
+    zapisnik, povedi, besede = parse_zapisnik(TeiReader(path))
+
+    # save data to jsonl (or arrow/parquet) files, sentences and words are streamed from the transforms straight
+    # into the files
+    extension = ".jsonl" + COMPRESSION_SUFFIXES[compression]
+    table_extension = columnar_io.COLUMNAR_SUFFIXES.get(output_format, extension)
+    outputs = [
+        os.path.join(destination, zapisnik.id + "_meeting" + extension),
+        os.path.join(destination, zapisnik.id + "_sentences" + table_extension),
+        os.path.join(destination, zapisnik.id + "_words" + table_extension),
+    ]
+
+    # the transforms are generators, building the documents is timed together with writing them
+    save_start_time = time.time()
+    save_to_jsonl([zapisnik.to_dict()], outputs[0])
+    if output_format in columnar_io.COLUMNAR_SUFFIXES:
+        columnar_io.save_to_columnar(povedi, outputs[1], columnar_io.sentences_schema())
+        columnar_io.save_to_columnar(besede, outputs[2], columnar_io.words_schema())
+    else:
+        save_to_jsonl(povedi, outputs[1])
+        save_to_jsonl(besede, outputs[2])
+    print(f"parse_file(): transformed and saved the meeting in {time.time() - save_start_time} seconds")
+
+    return outputs
+
+
+def parse(source, destination, from_idx=0, to_idx=-1, workers=1, translation_cache_path=None,
+          translation_engine=None, lemma_cache_path=None, force=False, compression=None, output_format="jsonl"):
+    paths = parallel_parse.select_files(source, from_idx, to_idx, prefix=CORPUS_NAME)
+
+    # skip meetings whose outputs were produced from the same XML, parser code and models, unless forced
+    manifest = parse_manifest.ParseManifest(destination)
+    fingerprint = parse_manifest.make_fingerprint(
+        sys.modules[__name__],
+        translator.engine_identifier(**(translation_engine or {})),
+        GENERATION_PARAMS,
+        {lang: lemmatizer.profile_identifier(lang) for lang in LANGS},
+        output_format={"compression": compression, "format": output_format}
+    )
+    if not force:
+        paths, current = manifest.outdated(paths, fingerprint)
+        print(f"parse(): {len(current)} files are up to date, {len(paths)} to parse")
+
+    # workers > 1 shards the files across a process pool, every worker loads its own models once
+    try:
+        failed = parallel_parse.parse_files(
+            sys.modules[__name__],
+            paths,
+            destination,
+            workers,
+            options={
+                "translation_cache_path": translation_cache_path,
+                "translation_engine": translation_engine,
+                "lemma_cache_path": lemma_cache_path,
+                "compression": compression,
+                "output_format": output_format
+            },
+            on_parsed=lambda path, outputs: manifest.record(path, fingerprint, outputs),
+            nouns_attr="proper_nouns"
+        )
+    finally:
+        manifest.close()
+
+    print(f"parse(): parsed {len(paths) - len(failed)}/{len(paths)} files")
+    for path, _ in failed:
+        print("parse(): failed " + path)
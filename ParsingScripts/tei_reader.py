@@ -0,0 +1,92 @@
+from utils import parse_coordinates, parse_tag
+
+# lxml parses noticeably faster and can free processed elements more aggressively, but is optional
+try:
+    from lxml import etree
+    USING_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as etree
+    USING_LXML = False
+
+XML_ID = "{http://www.w3.org/XML/1998/namespace}id"
+
+
+class _OpenElement:
+    __slots__ = ("element", "tag", "in_debate", "children", "first_child")
+
+    def __init__(self, element, tag, in_debate, first_child):
+        self.element = element
+        self.tag = tag
+        # True for the debateSection div and the divs nested directly inside it
+        self.in_debate = in_debate
+        self.children = 0
+        self.first_child = first_child
+
+
+# Reads a TEI meeting in a single streaming pass instead of keeping the whole tree alive. While events() is
+# consumed, the reader collects the coordinates of every word and punctuation and clears the speeches that
+# were already handed out, so only the header and front matter stay in memory. After the events are consumed,
+# root holds what is left of the tree (titles, agendas, ...) and coords_index maps word ids to coordinates.
+class TeiReader:
+
+    def __init__(self, path):
+        self.path = path
+        self.root = None
+        self.meeting_id = None
+        self.coords_index = {}
+
+    # yields ("speaker", text), ("utterance", seg) and ("paragraph", seg) in document order, mirroring the
+    # traversal of the debateSection done by the parsers: segs are only valid until the next event is requested
+    def events(self):
+        parser_options = {"huge_tree": True} if USING_LXML else {}
+        open_elements = []
+        debate_found = False
+
+        for event, element in etree.iterparse(self.path, events=("start", "end"), **parser_options):
+            if event == "start":
+                tag = parse_tag(element)
+                parent = open_elements[-1] if open_elements else None
+
+                if parent is None:
+                    self.root = element
+                    self.meeting_id = element.attrib.get(XML_ID)
+                else:
+                    parent.children += 1
+
+                in_debate = False
+                if tag == "div":
+                    if parent is not None and parent.in_debate:
+                        in_debate = True
+                    elif not debate_found and element.get("type") == "debateSection":
+                        in_debate = True
+                        debate_found = True
+
+                first_child = parent is not None and parent.children == 1
+                open_elements.append(_OpenElement(element, tag, in_debate, first_child))
+                continue
+
+            current = open_elements.pop()
+            parent = open_elements[-1] if open_elements else None
+            grandparent = open_elements[-2] if len(open_elements) > 1 else None
+
+            if current.tag == "w" or current.tag == "pc":
+                word_id = element.attrib.get(XML_ID) or element.attrib.get("id")
+                if word_id:
+                    coordinates = parse_coordinates(element)
+                    if coordinates:
+                        self.coords_index[word_id] = coordinates
+
+            # utterance or paragraph whose first child is a segment
+            elif current.tag == "seg" and current.first_child and parent.tag in ("u", "p") \
+                    and grandparent is not None and grandparent.in_debate:
+                yield ("utterance" if parent.tag == "u" else "paragraph"), element
+                element.clear()
+
+            # speaker note updates the current speaker for subsequent segments
+            elif current.tag == "note" and parent is not None and parent.in_debate \
+                    and element.get("type") == "speaker":
+                yield "speaker", element.text
+
+            # drop speeches that were already processed from the tree
+            if parent is not None and parent.in_debate and current.tag in ("u", "p", "note", "div"):
+                parent.element.remove(element)
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import sqlite3
+import threading
+
+# default name of the cache file, created in the parser's destination directory
+TRANSLATION_CACHE_FILE = "translation_cache.sqlite"
+
+# SQLite limits the number of host parameters in a single statement
+_LOOKUP_BATCH_SIZE = 500
+
+# open caches by path, so every process opens each cache file only once
+_open_caches = {}
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+# Persistent, content-addressed store of machine translations. An entry is keyed by the model, the language
+# pair, the generation parameters and the hash of the source text, so changing any of them produces misses
+# instead of stale translations. Safe to share between the processes of a parallel parse.
+class TranslationCache:
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=120, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS translations ("
+            " key TEXT PRIMARY KEY,"
+            " model TEXT NOT NULL,"
+            " source_lang TEXT NOT NULL,"
+            " target_lang TEXT NOT NULL,"
+            " params TEXT NOT NULL,"
+            " translation TEXT NOT NULL"
+            ")"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(model_name, source_lang, target_lang, params, text):
+        return _sha256("\0".join([model_name, source_lang, target_lang, params, _sha256(text)]))
+
+    # returns the cache key of every sentence and the translations of those that are cached
+    def lookup(self, model_name, source_lang, target_lang, generation_params, sentences):
+        params = json.dumps(generation_params, sort_keys=True)
+        keys = [self.make_key(model_name, source_lang, target_lang, params, text) for text in sentences]
+        return keys, self.get_many(set(keys))
+
+    def store(self, model_name, source_lang, target_lang, generation_params, keys, translations):
+        params = json.dumps(generation_params, sort_keys=True)
+        self.put_many([
+            (key, model_name, source_lang, target_lang, params, translation)
+            for key, translation in zip(keys, translations)
+        ])
+
+    def get_many(self, keys):
+        keys = list(keys)
+        found = {}
+        with self.lock:
+            for start in range(0, len(keys), _LOOKUP_BATCH_SIZE):
+                batch = keys[start:start + _LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = self.connection.execute(
+                    f"SELECT key, translation FROM translations WHERE key IN ({placeholders})", batch
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, entries):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO translations (key, model, source_lang, target_lang, params, translation) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                entries
+            )
+            self.connection.commit()
+
+
+def get_translation_cache(path):
+    if path not in _open_caches:
+        _open_caches[path] = TranslationCache(path)
+    return _open_caches[path]
@@ -0,0 +1,325 @@
+import functools
+import hashlib
+import os
+
+from alive_progress import alive_bar
+
+from batching import auto_token_budget, plan_batches
+from translation_cache import get_translation_cache
+from utils import get_lang_id
+
+# Model for translation
+TRANSLATION_MODEL_NAME = "facebook/nllb-200-distilled-1.3B"
+
+# NLLB codes of the corpus languages, the engines only know the NLLB ones
+NLLB_LANG_CODES = {
+    "de": "deu_Latn",
+    "sl": "slv_Latn",
+    "hr": "hrv_Latn",
+    "sr": "srp_Cyrl",
+}
+
+# Padded source tokens per translation batch, None estimates it from the free memory on every call
+TRANSLATION_TOKEN_BUDGET = None
+
+# Persistent cache of translations, opened by the parsers' parse_file
+translation_cache = None
+
+# Engine used for translating, created on first use from the configured engine options; torch, transformers and
+# ctranslate2 are only imported then, so importing the parsers stays cheap
+translation_engine = None
+engine_options = {"engine": "transformers"}
+
+
+_HASH_BLOCK_SIZE = 1 << 20
+
+
+# hash of the files of a converted model; converted NLLB models of every size share the vocabulary and the config,
+# so the weights are hashed too. Computed once per process and path
+@functools.lru_cache(maxsize=None)
+def model_fingerprint(model_path):
+    sha256 = hashlib.sha256()
+    for file_name in sorted(os.listdir(model_path)):
+        path = os.path.join(model_path, file_name)
+        if not os.path.isfile(path):
+            continue
+        sha256.update(file_name.encode("utf-8") + b"\0")
+        with open(path, "rb") as file:
+            for block in iter(lambda: file.read(_HASH_BLOCK_SIZE), b""):
+                sha256.update(block)
+    return sha256.hexdigest()[:16]
+
+
+# the identifier of the engine created from these options, known without loading the model; a converted model is
+# identified by its files, so two conversions never share cached translations
+def engine_identifier(engine="transformers", model_name=TRANSLATION_MODEL_NAME, compute_type="int8", model_path=None,
+                      **_):
+    if engine == "ctranslate2":
+        identifier = f"{model_name}@ctranslate2-{compute_type}"
+        if model_path is not None:
+            identifier += "-" + model_fingerprint(os.path.abspath(model_path))
+        return identifier
+    return model_name
+
+
+# Runs NLLB with PyTorch through transformers; fp16 on CUDA, fp32 on CPU
+class TransformersEngine:
+
+    def __init__(self, model_name=TRANSLATION_MODEL_NAME, intra_threads=0, inter_threads=0, **_):
+        import torch
+        from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+
+        if intra_threads:
+            torch.set_num_threads(intra_threads)
+        if inter_threads:
+            try:
+                torch.set_num_interop_threads(inter_threads)
+            except RuntimeError:
+                print("Warning: could not set inter-op threads, torch has already started parallel work")
+
+        # the cache key, translations of this engine are the ones the cache was originally filled with
+        self.identifier = engine_identifier("transformers", model_name)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name)
+        self.model.eval()
+        self.device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.model.to(self.device)
+        if self.device == "cuda":
+            # convert model to fp16 for lower memory usage / faster inference on supported GPUs
+            try:
+                self.model.half()
+            except Exception:
+                print("Warning: could not convert model to fp16")
+
+    # translates texts[i] into every language in targets[i]; the encoder runs once per batch and its outputs are
+    # reused for each target language, returns {target_lang: {text: translation}}
+    def translate_batches_multi(self, texts, source_lang, targets, generation_params, max_batch_size=64,
+                                progress=True):
+        import torch
+        from transformers.modeling_outputs import BaseModelOutput
+
+        tokenizer = self.tokenizer
+        model = self.model
+
+        tokenizer.src_lang = source_lang
+        input_ids = tokenizer(texts, truncation=True, max_length=512)["input_ids"]
+
+        # sentences of similar length are batched together up to a budget of padded tokens instead of a fixed count
+        token_budget = TRANSLATION_TOKEN_BUDGET or auto_token_budget(
+            model, self.device, generation_params["num_beams"]
+        )
+        batches = plan_batches([len(ids) for ids in input_ids], token_budget, max_batch_size)
+
+        target_langs = sorted(set().union(*targets))
+        translations = {target_lang: {} for target_lang in target_langs}
+
+        with torch.no_grad():
+            title = f"Translating {source_lang}→{','.join(target_langs)}"
+            with alive_bar(sum(len(t) for t in targets), title=title, force_tty=True, disable=not progress) as bar:
+                bar(0)
+                for batch in batches:
+                    encoded = tokenizer.pad({"input_ids": [input_ids[i] for i in batch]}, return_tensors="pt")
+                    encoded = encoded.to(self.device)
+                    encoder_hidden_states = model.get_encoder()(**encoded).last_hidden_state
+
+                    for target_lang in target_langs:
+                        rows = [row for row, i in enumerate(batch) if target_lang in targets[i]]
+                        if not rows:
+                            continue
+
+                        # generate() expands the encoder outputs for beam search in place, so every target gets its own
+                        index = torch.tensor(rows, device=encoder_hidden_states.device)
+                        encoder_outputs = BaseModelOutput(
+                            last_hidden_state=encoder_hidden_states.index_select(0, index)
+                        )
+                        generated_tokens = model.generate(
+                            encoder_outputs=encoder_outputs,
+                            attention_mask=encoded["attention_mask"].index_select(0, index),
+                            forced_bos_token_id=get_lang_id(tokenizer, target_lang),
+                            **generation_params
+                        )
+
+                        decoded = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
+                        for row, translation in zip(rows, decoded):
+                            translations[target_lang][texts[batch[row]]] = translation
+
+                        bar(len(rows))
+
+                    # free intermediate tensors and clear cached GPU memory
+                    if self.device == "cuda":
+                        del encoded, encoder_hidden_states
+                        torch.cuda.empty_cache()
+
+        return translations
+
+
+# Runs NLLB converted to CTranslate2 with int8 weights, which is several times faster than PyTorch on CPUs. The
+# model has to be converted first, e.g.:
+#   ct2-transformers-converter --model facebook/nllb-200-distilled-1.3B --quantization int8 --output_dir nllb-ct2-int8
+class CTranslate2Engine:
+
+    # sentences handed to CTranslate2 at once, it sorts and batches them by length itself
+    SLICE_SIZE = 256
+    # tokens per batch when TRANSLATION_TOKEN_BUDGET is not set
+    TOKEN_BUDGET = 4096
+
+    def __init__(self, model_path=None, model_name=TRANSLATION_MODEL_NAME, intra_threads=0, inter_threads=1,
+                 compute_type="int8", **_):
+        import ctranslate2
+        from transformers import AutoTokenizer
+
+        if model_path is None:
+            raise ValueError("CTranslate2Engine needs the path to a converted model (--translation-model-path)")
+
+        self.identifier = engine_identifier("ctranslate2", model_name, compute_type, model_path)
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.translator = ctranslate2.Translator(
+            model_path,
+            device="cpu",
+            compute_type=compute_type,
+            intra_threads=intra_threads,
+            inter_threads=inter_threads or 1
+        )
+
+    def translate_batches_multi(self, texts, source_lang, targets, generation_params, max_batch_size=64,
+                                progress=True):
+        tokenizer = self.tokenizer
+
+        tokenizer.src_lang = source_lang
+        source_tokens = [
+            tokenizer.convert_ids_to_tokens(ids)
+            for ids in tokenizer(texts, truncation=True, max_length=512)["input_ids"]
+        ]
+
+        target_langs = sorted(set().union(*targets))
+        translations = {target_lang: {} for target_lang in target_langs}
+
+        title = f"Translating {source_lang}→{','.join(target_langs)}"
+        with alive_bar(sum(len(t) for t in targets), title=title, force_tty=True, disable=not progress) as bar:
+            bar(0)
+            for target_lang in target_langs:
+                indices = [i for i in range(len(texts)) if target_lang in targets[i]]
+
+                for start in range(0, len(indices), self.SLICE_SIZE):
+                    chunk = indices[start:start + self.SLICE_SIZE]
+                    results = self.translator.translate_batch(
+                        [source_tokens[i] for i in chunk],
+                        target_prefix=[[target_lang]] * len(chunk),
+                        max_batch_size=TRANSLATION_TOKEN_BUDGET or self.TOKEN_BUDGET,
+                        batch_type="tokens",
+                        beam_size=generation_params["num_beams"],
+                        length_penalty=generation_params["length_penalty"],
+                        max_decoding_length=generation_params["max_new_tokens"] + 1,
+                    )
+
+                    for i, result in zip(chunk, results):
+                        # drop the forced target language token
+                        tokens = result.hypotheses[0][1:]
+                        translations[target_lang][texts[i]] = tokenizer.decode(
+                            tokenizer.convert_tokens_to_ids(tokens), skip_special_tokens=True
+                        )
+
+                    bar(len(chunk))
+
+        return translations
+
+
+TRANSLATION_ENGINES = {
+    "transformers": TransformersEngine,
+    "ctranslate2": CTranslate2Engine,
+}
+
+
+# selects the engine used by the following translations, e.g. configure_translation_engine("ctranslate2",
+# model_path="nllb-ct2-int8", intra_threads=8); a loaded engine is kept if the options did not change
+def configure_translation_engine(engine="transformers", **options):
+    global translation_engine, engine_options
+
+    if engine not in TRANSLATION_ENGINES:
+        raise ValueError(f"Unknown translation engine '{engine}', expected one of {list(TRANSLATION_ENGINES)}")
+
+    new_options = {"engine": engine, **options}
+    if new_options != engine_options:
+        engine_options = new_options
+        translation_engine = None
+
+
+def get_translation_engine():
+    global translation_engine
+    if translation_engine is None:
+        options = dict(engine_options)
+        translation_engine = TRANSLATION_ENGINES[options.pop("engine")](**options)
+    return translation_engine
+
+
+def open_translation_cache(path):
+    global translation_cache
+    translation_cache = get_translation_cache(path)
+
+
+# the NLLB code of a language given by its ISO code (as in the TEI files) or by its NLLB code
+def nllb_lang_code(lang):
+    if lang in NLLB_LANG_CODES.values():
+        return lang
+    try:
+        return NLLB_LANG_CODES[lang]
+    except KeyError:
+        raise ValueError(f"Unknown language '{lang}', expected one of {list(NLLB_LANG_CODES)}") from None
+
+
+def translate_sentences(sentences, source_lang, target_lang, generation_params, max_batch_size=64):
+    translations = translate_sentences_multi(sentences, source_lang, [target_lang], generation_params, max_batch_size)
+    return translations[target_lang]
+
+
+# translates the sentences into every target language, returns {target_lang: translations in input order}; only
+# sentences missing from the translation cache are sent to the engine, which is loaded only then, and every distinct
+# text only once. Pass progress=False when translating from a background thread, progress bars of concurrent stages
+# garble the output.
+def translate_sentences_multi(sentences, source_lang, target_langs, generation_params, max_batch_size=64,
+                              progress=True):
+    # the engine is only loaded when some sentences are not cached
+    identifier = engine_identifier(**engine_options)
+
+    lookups = {}
+    for target_lang in target_langs:
+        if translation_cache is not None:
+            lookups[target_lang] = translation_cache.lookup(
+                identifier, source_lang, target_lang, generation_params, sentences
+            )
+        else:
+            lookups[target_lang] = (list(range(len(sentences))), {})
+
+    # distinct texts that still miss a translation into at least one of the targets
+    pending = {}
+    for target_lang, (keys, found) in lookups.items():
+        for key, text in zip(keys, sentences):
+            if key not in found:
+                pending.setdefault(text, set()).add(target_lang)
+
+    texts = list(pending)
+    print(f"Translating {source_lang}→{','.join(target_langs)}: {len(texts)}/{len(sentences)} sentences not cached")
+
+    translated = get_translation_engine().translate_batches_multi(
+        texts, source_lang, [pending[text] for text in texts], generation_params, max_batch_size, progress
+    ) if texts else {}
+
+    results = {}
+    for target_lang, (keys, found) in lookups.items():
+        new_keys = []
+        new_translations = []
+        for key, text in zip(keys, sentences):
+            if key not in found:
+                found[key] = translated[target_lang][text]
+                new_keys.append(key)
+                new_translations.append(found[key])
+
+        if translation_cache is not None and new_keys:
+            translation_cache.store(
+                identifier, source_lang, target_lang, generation_params, new_keys, new_translations
+            )
+
+        results[target_lang] = [found[key] for key in keys]
+
+    return results
@@ -0,0 +1,207 @@
+import bisect
+import json
+import os
+import sqlite3
+
+# default name of the journal, created in the working directory like the state file it replaces
+JOURNAL_FILE = "upload_journal.sqlite"
+
+# the per file state of earlier versions of the uploader, migrated into the journal
+STATE_FILE = "uploader_state.json"
+
+
+# Journal of an upload. Every bulk request is recorded once it was answered, as the range of lines of its file it
+# covered, so an interrupted upload resumes with the lines that were not sent yet. Documents Elasticsearch did not
+# index are kept, with their bulk entry and the reason, in a retry queue that is sent again on the next run instead
+# of the whole file. A file whose size or modification time changed is uploaded again from the start.
+class UploadJournal:
+
+    def __init__(self, path=JOURNAL_FILE):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=120)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            " file TEXT PRIMARY KEY,"
+            " size INTEGER,"
+            " mtime REAL,"
+            " done INTEGER NOT NULL DEFAULT 0"
+            ")"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " file TEXT NOT NULL,"
+            " start_line INTEGER NOT NULL,"
+            " end_line INTEGER NOT NULL,"
+            " PRIMARY KEY (file, start_line)"
+            ")"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS failures ("
+            " file TEXT NOT NULL,"
+            " line INTEGER NOT NULL,"
+            " index_name TEXT NOT NULL,"
+            " entry BLOB NOT NULL,"
+            " status INTEGER,"
+            " reason TEXT,"
+            " attempts INTEGER NOT NULL DEFAULT 1,"
+            " PRIMARY KEY (file, line)"
+            ")"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT"
+            ")"
+        )
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    # forgets everything, e.g. when the indices were deleted
+    def clear(self):
+        with self.connection:
+            self.connection.execute("DELETE FROM files")
+            self.connection.execute("DELETE FROM chunks")
+            self.connection.execute("DELETE FROM failures")
+
+    # the journal belongs to the indices it was written for (a version of the indices, or the live indices), it is
+    # started over when uploading into other indices
+    def start(self, target):
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'target'").fetchone()
+        if row is not None and row[0] != target:
+            print(f"{self.path} was written for {row[0]}, starting over for {target}")
+            self.clear()
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('target', ?)", (target,))
+            if row is None or row[0] != target:
+                self.connection.execute("DELETE FROM meta WHERE key = 'finished'")
+
+    # the target is complete, e.g. the aliases were moved to the version
+    def finish(self):
+        with self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('finished', '1')")
+
+    # the target the journal was written for, unless it was finished, None for a new journal
+    def unfinished_target(self):
+        rows = dict(self.connection.execute("SELECT key, value FROM meta WHERE key IN ('target', 'finished')"))
+        if "finished" in rows:
+            return None
+        return rows.get("target")
+
+    # files marked done in the old state file are marked done in the journal, the others are uploaded again
+    def migrate_state(self, state_path=STATE_FILE):
+        if not os.path.exists(state_path):
+            return
+
+        with open(state_path, "r", encoding="utf-8") as file:
+            state = json.load(file)
+
+        done = [(file_name,) for file_name, entry in state.items() if entry.get("isDone")]
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO files (file, size, mtime, done) VALUES (?, NULL, NULL, 1)", done
+            )
+        os.replace(state_path, state_path + ".migrated")
+        print(f"Migrated {len(done)} uploaded file(s) from {state_path} to {self.path}")
+
+    # starts the file over if it is not the file that was journaled (migrated files are trusted as they are)
+    def check_file(self, file_name, path):
+        stat = os.stat(path)
+        row = self.connection.execute("SELECT size, mtime FROM files WHERE file = ?", (file_name,)).fetchone()
+        if row is not None and row[0] is None:
+            return
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime:
+            return
+
+        with self.connection:
+            if row is not None:
+                print(f"{file_name} changed since it was uploaded, uploading it again")
+                self.connection.execute("DELETE FROM chunks WHERE file = ?", (file_name,))
+                self.connection.execute("DELETE FROM failures WHERE file = ?", (file_name,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (file, size, mtime, done) VALUES (?, ?, ?, 0)",
+                (file_name, stat.st_size, stat.st_mtime)
+            )
+
+    # a predicate telling whether a line of the file was sent, None if no line was
+    def sent_filter(self, file_name):
+        ranges = self.sent_ranges(file_name)
+        if not ranges:
+            return None
+
+        starts = [start_line for start_line, _ in ranges]
+
+        def is_sent(line):
+            i = bisect.bisect_right(starts, line) - 1
+            return i >= 0 and line < ranges[i][1]
+
+        return is_sent
+
+    def is_done(self, file_name):
+        row = self.connection.execute("SELECT done FROM files WHERE file = ?", (file_name,)).fetchone()
+        return row is not None and row[0] == 1
+
+    # the sorted, merged (start_line, end_line) ranges of the file that were sent
+    def sent_ranges(self, file_name):
+        ranges = []
+        rows = self.connection.execute(
+            "SELECT start_line, end_line FROM chunks WHERE file = ? ORDER BY start_line", (file_name,)
+        )
+        for start_line, end_line in rows:
+            if ranges and start_line <= ranges[-1][1]:
+                ranges[-1][1] = max(ranges[-1][1], end_line)
+            else:
+                ranges.append([start_line, end_line])
+        return [tuple(sent_range) for sent_range in ranges]
+
+    # records a sent chunk; failures are (line, index name, entry, status, reason) of its documents that were not
+    # indexed
+    def record_chunk(self, file_name, start_line, end_line, failures=()):
+        with self.connection:
+            if end_line > start_line:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO chunks (file, start_line, end_line) VALUES (?, ?, ?)",
+                    (file_name, start_line, end_line)
+                )
+            self._record_failures(file_name, failures)
+
+    def _record_failures(self, file_name, failures):
+        self.connection.executemany(
+            "INSERT INTO failures (file, line, index_name, entry, status, reason) VALUES (?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (file, line) DO UPDATE SET"
+            " entry = excluded.entry, status = excluded.status, reason = excluded.reason, attempts = attempts + 1",
+            [(file_name, line, index_name, entry, status, reason)
+             for line, index_name, entry, status, reason in failures]
+        )
+
+    # once all lines of the file were sent, its chunks are collapsed into a single row
+    def file_done(self, file_name, lines):
+        with self.connection:
+            self.connection.execute("UPDATE files SET done = 1 WHERE file = ?", (file_name,))
+            self.connection.execute("DELETE FROM chunks WHERE file = ?", (file_name,))
+            if lines > 0:
+                self.connection.execute(
+                    "INSERT INTO chunks (file, start_line, end_line) VALUES (?, 0, ?)", (file_name, lines)
+                )
+
+    # the retry queue: (file, line, index name, entry) of every document that was not indexed
+    def failures(self):
+        return self.connection.execute(
+            "SELECT file, line, index_name, entry FROM failures ORDER BY index_name, file, line"
+        ).fetchall()
+
+    # removes the documents that were indexed on a retry from the queue and updates the others
+    def record_retry(self, indexed, failures):
+        with self.connection:
+            self.connection.executemany("DELETE FROM failures WHERE file = ? AND line = ?", indexed)
+            for file_name, line, index_name, entry, status, reason in failures:
+                self._record_failures(file_name, [(line, index_name, entry, status, reason)])
+
+    # the number of documents in the retry queue by reason
+    def failure_summary(self):
+        return self.connection.execute(
+            "SELECT reason, COUNT(*) FROM failures GROUP BY reason ORDER BY COUNT(*) DESC"
+        ).fetchall()
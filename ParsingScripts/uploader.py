@@ -1,10 +1,23 @@
+import asyncio
 import json
 import os
-import time
+import re
 
-from elasticsearch import Elasticsearch, helpers
+from elasticsearch import Elasticsearch
 
-STATE_FILE = "uploader_state.json"
+import async_uploader
+import backpressure
+import index_versions
+import parallel_uploader
+from columnar_io import format_of, jsonl_name, read_columnar
+from jsonl_io import dumps, open_input, strip_compression
+from upload_journal import JOURNAL_FILE, UploadJournal
+
+# documents per bulk request in sequential mode
+SEQUENTIAL_CHUNK_SIZE = 100
+
+# the journal's target of a blue/green build, followed by the version
+BLUE_GREEN_TARGET_PREFIX = "version "
 
 
 MEETINGS_INDEX_NAME = "meetings-index"
@@ -426,6 +439,88 @@ WORDS_INDEX_MAPPING = {
     }
 }
 
+# Lean profile of the words index, one document per token makes it by far the largest index. Only what the
+# application searches by is indexed: text, lemma and speaker (without positions and norms; a word is a single token
+# and the speaker is only searched with a match query requiring all of its terms, never a phrase, so positions and
+# frequencies are not needed), the meeting, sentence and language filters, original and wpos, and
+# word_id.sort for paging. Nothing is sorted or aggregated on besides word_id.sort, so no other field keeps doc values;
+# coordinates, pos, propn, join, type and segment_id are only displayed and live in _source alone, which is stored
+# with the stronger compression.
+LEAN_WORDS_INDEX_SETTINGS = {
+    **WORDS_INDEX_SETTINGS,
+    "index.codec": "best_compression",
+}
+
+_LEAN_TEXT = {
+    "type": "text",
+    "analyzer": "custom_text_analyzer",
+    "index_options": "docs",
+    "norms": False
+}
+_LEAN_FILTER = {
+    "type": "keyword",
+    "doc_values": False
+}
+_DISPLAY_ONLY_KEYWORD = {
+    "type": "keyword",
+    "index": False,
+    "doc_values": False
+}
+_DISPLAY_ONLY_NUMBER = {
+    "type": "integer",
+    "index": False,
+    "doc_values": False
+}
+
+LEAN_WORDS_INDEX_MAPPING = {
+    "properties": {
+        "coordinates": {
+            "type": "object",
+            "enabled": False
+        },
+        "lang": _LEAN_FILTER,
+        "lemma": _LEAN_TEXT,
+        "meeting_id": _LEAN_FILTER,
+        "original": {
+            "type": "byte",
+            "doc_values": False
+        },
+        "pos": _DISPLAY_ONLY_NUMBER,
+        "propn": {
+            "type": "byte",
+            "index": False,
+            "doc_values": False
+        },
+        "segment_id": _DISPLAY_ONLY_KEYWORD,
+        "sentence_id": _LEAN_FILTER,
+        "speaker": _LEAN_TEXT,
+        "text": _LEAN_TEXT,
+        "word_id": {
+            "type": "keyword",
+            "doc_values": False,
+            "fields": {
+                "sort": {
+                    "type": "icu_collation_keyword",
+                    "index": False,
+                    "numeric": True
+                }
+            }
+        },
+        "wpos": {
+            "type": "integer",
+            "doc_values": False
+        },
+        "join": _DISPLAY_ONLY_KEYWORD,
+        "type": _DISPLAY_ONLY_KEYWORD
+    }
+}
+
+# settings and mapping of the words index by profile
+WORDS_INDEX_PROFILES = {
+    "default": (WORDS_INDEX_SETTINGS, WORDS_INDEX_MAPPING),
+    "lean": (LEAN_WORDS_INDEX_SETTINGS, LEAN_WORDS_INDEX_MAPPING),
+}
+
 PLACES_INDEX_SETTINGS = {
     "index.number_of_replicas": 0,
     "index.refresh_interval": "-1",
@@ -436,20 +531,6 @@ ATTENDEES_INDEX_SETTINGS = {
 }
 
 
-def load_progress():
-    if os.path.exists(STATE_FILE):
-        with open(STATE_FILE, 'r', encoding="utf-8") as file:
-            state = json.load(file)
-            return state
-
-    return dict()
-
-
-def save_progress(state):
-    with open(STATE_FILE, 'w', encoding="utf-8") as file:
-        json.dump(state, file)
-
-
 def set_refresh_interval(es: Elasticsearch, index_name: str, interval: str = "1s"):
     body = {
         "index": {
@@ -464,36 +545,139 @@ def set_refresh_interval(es: Elasticsearch, index_name: str, interval: str = "1s
         print(f"Error updating refresh_interval for '{index_name}': {e}")
 
 
-# upload a list of elements to Elasticsearch
-def upload_to_elasticsearch(es, elements, index_name):
-    actions = []
-    for element in elements:
-        doc = json.loads(element)
-        action = {
-            "_op_type": "index",
-            "_index": index_name,
-            "_source": doc,
-        }
+# the index every kind of file is uploaded to, by the end of its name without compression or columnar suffix
+FILE_INDICES = [
+    ("_meeting.jsonl", MEETINGS_INDEX_NAME),
+    ("_sentences.jsonl", SENTENCES_INDEX_NAME),
+    ("_words.jsonl", WORDS_INDEX_NAME),
+    ("krajevna_imena.jsonl", PLACES_INDEX_NAME),
+    ("poslanci.jsonl", ATTENDEES_INDEX_NAME),
+]
+
+# bulk requests in flight per index in async mode; words files are by far the largest
+ASYNC_INDEX_CONCURRENCY = {
+    MEETINGS_INDEX_NAME: 2,
+    SENTENCES_INDEX_NAME: 2,
+    WORDS_INDEX_NAME: 4,
+    PLACES_INDEX_NAME: 1,
+    ATTENDEES_INDEX_NAME: 1,
+}
 
-        # Set _id to avoid duplicates
-        if "id" in doc:
-            action["_id"] = doc["id"]
-        elif "word_id" in doc:
-            action["_id"] = doc["word_id"]
-        elif "sentence_id" in doc:
-            action["_id"] = doc["sentence_id"]
+# settings and mappings the indices are created with, with the default profile of the words index
+INDEX_DEFINITIONS = {
+    MEETINGS_INDEX_NAME: (MEETINGS_INDEX_SETTINGS, MEETINGS_INDEX_MAPPING),
+    SENTENCES_INDEX_NAME: (SENTENCES_INDEX_SETTINGS, SENTENCES_INDEX_MAPPING),
+    WORDS_INDEX_NAME: (WORDS_INDEX_SETTINGS, WORDS_INDEX_MAPPING),
+    PLACES_INDEX_NAME: (PLACES_INDEX_SETTINGS, {}),
+    ATTENDEES_INDEX_NAME: (ATTENDEES_INDEX_SETTINGS, {}),
+}
+
+
+# files may be gzip or zstd compressed (.jsonl.gz, .jsonl.zst), sentences and words may also be Arrow or Parquet
+# files; returns None for files that are not uploaded
+def index_for_file(file_name):
+    file_name = jsonl_name(strip_compression(file_name))
+    for suffix, index_name in FILE_INDICES:
+        if file_name.endswith(suffix):
+            return index_name
+    return None
+
+
+# the field the _id of every document is taken from, per index; for these indices the id is found in the raw JSON
+# line, so the documents are passed to Elasticsearch as they are in the file, without being decoded and encoded again.
+# The meeting id is the first key of a meeting, the other ids are the only keys of their name in a document.
+ID_PATTERNS = {
+    MEETINGS_INDEX_NAME: re.compile(rb'^\{\s*"id":\s*"([^"\\]*)"'),
+    SENTENCES_INDEX_NAME: re.compile(rb'"sentence_id":\s*"([^"\\]*)"'),
+    WORDS_INDEX_NAME: re.compile(rb'"word_id":\s*"([^"\\]*)"'),
+}
+
+
+# reads the documents of a file one by one: raw JSON lines (bytes) of a (compressed) JSONL file, or dicts of an
+# Arrow/Parquet file
+def iter_elements(file_path):
+    if format_of(file_path) is not None:
+        yield from read_columnar(file_path)
+        return
+
+    with open_input(file_path, binary=True) as file:
+        yield from file
+
+
+# the bulk action line and the document line of an element (a JSON line or a dict), as NDJSON
+def make_entry(element, index_name):
+    if isinstance(element, (bytes, str)):
+        line = element.encode("utf-8") if isinstance(element, str) else element
+        pattern = ID_PATTERNS.get(index_name)
+        match = pattern.search(line) if pattern is not None else None
+        if match is not None:
+            return b'{"index":{"_id":"' + match.group(1) + b'"}}\n' + line.rstrip(b"\r\n") + b"\n"
+
+        # an id with escaped characters, or a file without a known id field
+        element = json.loads(line)
+
+    # Set _id to avoid duplicates
+    action = {}
+    if "id" in element:
+        action["_id"] = element["id"]
+    elif "word_id" in element:
+        action["_id"] = element["word_id"]
+    elif "sentence_id" in element:
+        action["_id"] = element["sentence_id"]
+
+    return dumps({"index": action}) + b"\n" + dumps(element) + b"\n"
+
+
+# yields the line, the bulk entry and its size in bytes of every document in the file; lines skip(line) is true for
+# are yielded without an entry
+def read_actions(file_path, index_name, skip=None):
+    for line, element in enumerate(iter_elements(file_path)):
+        if skip is not None and skip(line):
+            yield line, None, 0
+            continue
+
+        entry = make_entry(element, index_name)
+        yield line, entry, len(entry)
+
+
+# "type: reason" of the error of a bulk item
+def failure_reason(result):
+    error = result.get("error")
+    if isinstance(error, dict):
+        return f"{error.get('type')}: {error.get('reason')}"
+    return str(error)
 
-        actions.append(action)
 
-    # if actions list is longer than 100, split it into multiple lists and upload them separately
-    failed_count = 0
-    for i in range(0, len(actions), 100):
-        _, failed = helpers.bulk(es, actions[i:i + 100], stats_only=True)
-        failed_count += failed
+# sends the retry queue of the journal, the documents that are indexed now are removed from it
+def retry_failures(es, journal, limiter, chunk_size):
+    failures = journal.failures()
+    if not failures:
+        return
 
-    print(f"{index_name}: Uploaded {len(actions)} element(s) to Elasticsearch.")
+    print(f"Retrying {len(failures)} document(s) that were not indexed before")
+    for start in range(0, len(failures), chunk_size):
+        batch = failures[start:start + chunk_size]
+        by_index = {}
+        for failure in batch:
+            by_index.setdefault(failure[2], []).append(failure)
 
-    return failed_count == 0
+        indexed = []
+        failed = []
+        for index_name, index_failures in by_index.items():
+            entries = [entry for _, _, _, entry in index_failures]
+            results = dict(parallel_uploader.send_bulk(es, index_name, entries, limiter=limiter))
+            for position, (file_name, line, _, entry) in enumerate(index_failures):
+                if position in results:
+                    result = results[position]
+                    failed.append((file_name, line, index_name, entry, result.get("status"), failure_reason(result)))
+                else:
+                    indexed.append((file_name, line))
+
+        journal.record_retry(indexed, failed)
+
+
+def index_definitions(words_profile="default"):
+    return {**INDEX_DEFINITIONS, WORDS_INDEX_NAME: WORDS_INDEX_PROFILES[words_profile]}
 
 
 def create_index(es, index_name, settings, mappings, delete_index_if_exists):
@@ -507,75 +691,207 @@ def create_index(es, index_name, settings, mappings, delete_index_if_exists):
         es.indices.create(index=index_name, settings=settings, mappings=mappings)
 
 
-def upload(source_dir, elasticsearch_host, elasticsearch_port, delete_index_if_exists=False):
-    # initialize the Elasticsearch client
-    es = Elasticsearch(
-        [{'host': elasticsearch_host, 'port': elasticsearch_port, 'scheme': 'http'}],
-        max_retries=20,
-        request_timeout=180,
-        http_compress=True,
-        retry_on_timeout=True
+# sends one chunk at a time; the limiter spaces out the requests when the cluster is overloaded
+def upload_sequential(es, files, limiter, on_chunk_done, on_file_done):
+    for chunk in parallel_uploader.read_chunks(files, read_actions, chunk_size=SEQUENTIAL_CHUNK_SIZE):
+        on_chunk_done(chunk, parallel_uploader.send_chunk(es, chunk, limiter=limiter))
+
+        if chunk.last:
+            print(f"{chunk.index_name}: uploaded {chunk.file_name}")
+            on_file_done(chunk.file_name, chunk.end_line)
+
+
+# a reader thread chunks the files by document count and bytes, sender threads send the chunks concurrently
+def upload_parallel(es, files, limiter, on_chunk_done, on_file_done, chunk_size, max_chunk_bytes):
+    parallel_uploader.upload_files(
+        es,
+        files,
+        read_actions,
+        on_chunk_done,
+        on_file_done,
+        threads=limiter.max_concurrency,
+        chunk_size=chunk_size,
+        max_chunk_bytes=max_chunk_bytes,
+        limiter=limiter
     )
 
-    # Create the Elasticsearch indices if they don't exist
-    create_index(es, MEETINGS_INDEX_NAME, MEETINGS_INDEX_SETTINGS, MEETINGS_INDEX_MAPPING, delete_index_if_exists)
-    create_index(es, SENTENCES_INDEX_NAME, SENTENCES_INDEX_SETTINGS, SENTENCES_INDEX_MAPPING, delete_index_if_exists)
-    create_index(es, WORDS_INDEX_NAME, WORDS_INDEX_SETTINGS, WORDS_INDEX_MAPPING, delete_index_if_exists)
-    create_index(es, PLACES_INDEX_NAME, PLACES_INDEX_SETTINGS, {}, delete_index_if_exists)
-    create_index(es, ATTENDEES_INDEX_NAME, ATTENDEES_INDEX_SETTINGS, {}, delete_index_if_exists)
-
-    state = load_progress()
 
-    # Upload the data to Elasticsearch
-    jsonl_files = os.listdir(source_dir)
-    for i, jsonl_file in enumerate(jsonl_files):
+# all indices at once from an event loop, with a pool of workers per index that start with the largest files
+def upload_async(host, port, files, limiter, on_chunk_done, on_file_done, chunk_size, max_chunk_bytes,
+                 index_concurrency):
+    from elasticsearch import AsyncElasticsearch
+
+    async def run():
+        es = AsyncElasticsearch(**client_options(host, port, limiter.max_concurrency))
+        try:
+            await async_uploader.upload_files(
+                es,
+                files,
+                read_actions,
+                on_chunk_done,
+                on_file_done,
+                index_concurrency,
+                chunk_size=chunk_size,
+                max_chunk_bytes=max_chunk_bytes,
+                limiter=limiter
+            )
+        finally:
+            await es.close()
+
+    asyncio.run(run())
+
+
+# "words=4,meetings=1" -> {"words-index": 4, "meetings-index": 1}, on top of the default concurrency of every index
+def parse_index_concurrency(text):
+    concurrency = dict(ASYNC_INDEX_CONCURRENCY)
+    for item in filter(None, (text or "").split(",")):
+        name, _, value = item.partition("=")
+        index_name = name.strip() if name.strip().endswith("-index") else name.strip() + "-index"
+        if index_name not in INDEX_DEFINITIONS:
+            raise ValueError(f"Unknown index '{name}' in '{text}'")
+        concurrency[index_name] = int(value)
+    return concurrency
+
+
+def client_options(host, port, connections):
+    return {
+        "hosts": [{'host': host, 'port': port, 'scheme': 'http'}],
+        "max_retries": 20,
+        "request_timeout": 180,
+        "http_compress": True,
+        "retry_on_timeout": True,
+        # every request in flight needs its own connection
+        "connections_per_node": max(connections, 10),
+    }
 
-        if jsonl_file in state and state[jsonl_file]["isDone"]:
-            print(f"skipping file {jsonl_file}\n")
-            continue
 
-        if i > 0 and i % 500 == 0:
-            time.sleep(60)
-            print("Going to sleep for 60s so we dont crash elastic")
+def upload(source_dir, elasticsearch_host, elasticsearch_port, delete_index_if_exists=False, mode="sequential",
+           threads=parallel_uploader.SENDER_THREADS, chunk_size=parallel_uploader.CHUNK_SIZE,
+           max_chunk_bytes=parallel_uploader.MAX_CHUNK_BYTES, target_latency=backpressure.TARGET_LATENCY,
+           journal_path=JOURNAL_FILE, index_concurrency=None, blue_green=False, version=None,
+           replicas=index_versions.PRODUCTION_REPLICAS, max_segments=index_versions.MAX_SEGMENTS,
+           keep_versions=index_versions.KEEP_VERSIONS, words_profile="default"):
+    index_concurrency = index_concurrency or ASYNC_INDEX_CONCURRENCY
+    if mode == "async":
+        async_uploader.require_aiohttp()
+
+    if mode == "parallel":
+        max_concurrency = threads
+    elif mode == "async":
+        max_concurrency = sum(index_concurrency.get(index_name, async_uploader.DEFAULT_CONCURRENCY)
+                              for index_name in INDEX_DEFINITIONS)
+    else:
+        max_concurrency = 1
 
-        state[jsonl_file] = dict()
-        state[jsonl_file]["isDone"] = False
+    # initialize the Elasticsearch client
+    es = Elasticsearch(**client_options(elasticsearch_host, elasticsearch_port, max_concurrency))
+
+    journal = UploadJournal(journal_path)
+
+    # the index the documents of every index are uploaded to; in blue/green mode a new version of it, which the
+    # application's alias is moved to once it is complete. Without a version an unfinished build is resumed, so a
+    # build interrupted before midnight does not start over under the next day's version; otherwise a new version is
+    # chosen that does not collide with today's earlier builds. A version the aliases already serve is never reloaded
+    definitions = index_definitions(words_profile)
+    if blue_green:
+        if version is None:
+            unfinished = journal.unfinished_target()
+            if unfinished is not None and unfinished.startswith(BLUE_GREEN_TARGET_PREFIX):
+                version = unfinished[len(BLUE_GREEN_TARGET_PREFIX):]
+                print(f"Resuming the unfinished build of version {version} recorded in {journal_path}")
+            else:
+                version = index_versions.new_version(es, definitions)
+        targets = {alias: index_versions.versioned_name(alias, version) for alias in definitions}
+        for alias, (settings, mappings) in definitions.items():
+            index_versions.create_versioned_index(es, targets[alias], settings, mappings, delete_index_if_exists)
+    else:
+        targets = {index_name: index_name for index_name in definitions}
+        # Create the Elasticsearch indices if they don't exist
+        for index_name, (settings, mappings) in definitions.items():
+            create_index(es, index_name, settings, mappings, delete_index_if_exists)
+
+    journal.start(BLUE_GREEN_TARGET_PREFIX + version if blue_green else "live indices")
+    if delete_index_if_exists:
+        journal.clear()
+    if not blue_green:
+        journal.migrate_state()
+
+    # Upload the data to Elasticsearch, resuming files that were partly uploaded
+    selected = []
+    files = []
+    for jsonl_file in os.listdir(source_dir):
+        index_name = index_for_file(jsonl_file)
+        if index_name is None:
+            print("unknown file: " + jsonl_file + " skipping upload")
+            continue
 
         file_path = os.path.join(source_dir, jsonl_file)
-        if jsonl_file.endswith("_meeting.jsonl"):
-            with open(file_path, "r", encoding="utf-8") as file:
-                meetings = file.readlines()
-                state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, meetings, MEETINGS_INDEX_NAME)
-        elif jsonl_file.endswith("_sentences.jsonl"):
-            with open(file_path, "r", encoding="utf-8") as file:
-                sentences = file.readlines()
-                state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, sentences, SENTENCES_INDEX_NAME)
-        elif jsonl_file.endswith("_words.jsonl"):
-            with open(file_path, "r", encoding="utf-8") as file:
-                words = file.readlines()
-                state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, words, WORDS_INDEX_NAME)
-        elif jsonl_file == "krajevna_imena.jsonl":
-            with open(file_path, "r", encoding="utf-8") as file:
-                krajevna_imena = file.readlines()
-                state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, krajevna_imena, PLACES_INDEX_NAME)
-        elif jsonl_file == "poslanci.jsonl":
-            with open(file_path, "r", encoding="utf-8") as file:
-                poslanci = file.readlines()
-                state[jsonl_file]["isDone"] = upload_to_elasticsearch(es, poslanci, ATTENDEES_INDEX_NAME)
-        else:
-            print("unknown file: " + jsonl_file + " skipping upload")
+        selected.append(jsonl_file)
+        journal.check_file(jsonl_file, file_path)
+        if journal.is_done(jsonl_file):
+            print(f"skipping file {jsonl_file}\n")
             continue
 
-        print("uploaded: " + jsonl_file)
-        print(f"progress: {i}/{len(jsonl_files)}\n")
+        files.append((jsonl_file, file_path, targets[index_name], journal.sent_filter(jsonl_file)))
 
-        save_progress(state)
+    done = [0]
 
-    set_refresh_interval(es, MEETINGS_INDEX_NAME)
-    set_refresh_interval(es, SENTENCES_INDEX_NAME)
-    set_refresh_interval(es, WORDS_INDEX_NAME)
-    set_refresh_interval(es, PLACES_INDEX_NAME)
-    set_refresh_interval(es, ATTENDEES_INDEX_NAME)
+    def on_chunk_done(chunk, failed):
+        journal.record_chunk(chunk.file_name, chunk.start_line, chunk.end_line, [
+            (chunk.start_line + position, chunk.index_name, chunk.actions[position], result.get("status"),
+             failure_reason(result))
+            for position, result in failed
+        ])
 
-    print("Uploaded meetings, sentences and words to Elasticsearch")
+    def on_file_done(jsonl_file, lines):
+        journal.file_done(jsonl_file, lines)
+        done[0] += 1
+        print(f"progress: {done[0]}/{len(files)}\n")
 
+    # the number of requests in flight adapts to the load of the cluster, up to the number of threads or workers
+    limiter = backpressure.AdaptiveLimiter(es, max_concurrency=max_concurrency, target_latency=target_latency)
+    limiter.start()
+    try:
+        retry_failures(es, journal, limiter, chunk_size)
+        if mode == "parallel":
+            upload_parallel(es, files, limiter, on_chunk_done, on_file_done, chunk_size, max_chunk_bytes)
+        elif mode == "async":
+            upload_async(elasticsearch_host, elasticsearch_port, files, limiter, on_chunk_done, on_file_done,
+                         chunk_size, max_chunk_bytes,
+                         {targets[alias]: concurrency for alias, concurrency in index_concurrency.items()})
+        else:
+            upload_sequential(es, files, limiter, on_chunk_done, on_file_done)
+    finally:
+        limiter.stop()
+
+    failures = journal.failure_summary()
+    for reason, count in failures:
+        print(f"{count} document(s) not indexed, kept for the next run: {reason}")
+
+    if blue_green:
+        if failures:
+            journal.close()
+            print(f"Not switching to version {version}, upload again to retry the documents that were not indexed")
+            return
+
+        # the new version replaces the complete old one only if every file was read and sent to the end
+        unfinished = [jsonl_file for jsonl_file in selected if not journal.is_done(jsonl_file)]
+        if unfinished:
+            journal.close()
+            print(f"Not switching to version {version}, {len(unfinished)} file(s) were not uploaded completely: "
+                  + ", ".join(sorted(unfinished)))
+            return
+
+        for index_name in targets.values():
+            index_versions.finish_index(es, index_name, replicas, max_segments)
+        index_versions.swap_aliases(es, targets)
+        journal.finish()
+        journal.close()
+        for alias, index_name in targets.items():
+            index_versions.delete_old_versions(es, alias, index_name, keep_versions)
+    else:
+        journal.close()
+        for index_name in INDEX_DEFINITIONS:
+            set_refresh_interval(es, index_name)
+
+    print("Uploaded meetings, sentences and words to Elasticsearch")
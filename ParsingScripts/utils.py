@@ -1,11 +1,12 @@
 import json
 
+from jsonl_io import write_jsonl
 
+
+# streams the elements (a list or a generator) to the file, compressed if the path ends with .gz or .zst
 def save_to_jsonl(elements, file_path):
-    with open(file_path, "w", encoding="utf-8") as file:
-        for element in elements:
-            file.write(json.dumps(element, ensure_ascii=False) + "\n")
-    print("Saved " + str(len(elements)) + " elements to " + file_path)
+    count = write_jsonl(elements, file_path)
+    print("Saved " + str(count) + " elements to " + file_path)
 
 
 def parse_attribs(elem):
@@ -87,89 +88,70 @@ def build_coords_index(xml_root, namespace_mappings):
     return id_to_coords
 
 
+# meeting is a meeting_model.Meeting; yields the documents of the sentences index one by one, so they can be
+# written out without holding them all in memory; the documents are built while they are written, the time taken
+# shows up in the parsers' save step
 def transform_sentences_fast(meeting, coords_index=None):
     if coords_index is None:
         raise ValueError("coords_index is required for transform_sentences_fast")
 
-    import time
-    time_start = time.time()
-
-    transformed_sentences = []
-    for sentence in meeting.get("sentences", []):
+    for sentence in meeting.sentences:
         coords = []
 
         # prefer the original translation (original == 1)
-        orig = next((t for t in sentence.get("translations", []) if t.get("original") == 1), None)
+        orig = sentence.original
         if orig:
-            for w in orig.get("words", []):
-                wid = w.get("id")
-                if not wid:
-                    continue
-                if wid in coords_index:
-                    coords.extend(coords_index[wid])
-
-        transformed_sentences.append({
-            "meeting_id": meeting.get("id"),
-            "sentence_id": sentence.get("id"),
-            "segment_id": sentence.get("segment_id"),
-            "speaker": sentence.get("speaker"),
+            for w in orig.words:
+                if w.id in coords_index:
+                    coords.extend(coords_index[w.id])
+
+        yield {
+            "meeting_id": meeting.id,
+            "sentence_id": sentence.id,
+            "segment_id": sentence.segment_id,
+            "speaker": sentence.speaker,
             "coordinates": coords,
             "translations": [
-                {"text": t.get("text"), "lang": t.get("lang"), "original": t.get("original")}
-                for t in sentence.get("translations", [])
+                {"text": t.text, "lang": t.lang, "original": t.original}
+                for t in sentence.translations
             ],
-        })
-
-    time_end = time.time()
-    print("transform_sentences_fast(): transformed sentences in " + str(time_end - time_start) + " seconds")
-
-    return transformed_sentences
+        }
 
 
+# yields the documents of the words index one by one
 def transform_words_fast(meeting, coords_index=None):
     if coords_index is None:
         raise ValueError("coords_index is required for transform_words_fast")
 
-    import time
-    time_start = time.time()
-
-    transformed_words = []
-
-    for sentence in meeting.get("sentences", []):
-        for translation in sentence.get("translations", []):
+    for sentence in meeting.sentences:
+        for translation in sentence.translations:
+            words = translation.words
 
             word_index = 0
-            for i, word in enumerate(translation.get("words", [])):
-                # `word` is a dict produced by lemmanize_text or original parse,
-                # use its fields directly
-                prev_join = translation["words"][i - 1].get("join") if i > 0 else None
+            for i, word in enumerate(words):
+                prev_join = words[i - 1].join if i > 0 else None
                 word_index = word_index + 1 if i > 0 and prev_join != "right" else word_index
 
-                wid = word.get("id")
-                coordinates = coords_index.get(wid, []) if (translation.get("original") == 1 and wid) else []
+                wid = word.id
+                coordinates = coords_index.get(wid, []) if (translation.original == 1 and wid) else []
 
-                transformed_words.append({
-                    "meeting_id": meeting.get("id"),
-                    "sentence_id": sentence.get("id"),
-                    "segment_id": sentence.get("segment_id"),
+                yield {
+                    "meeting_id": meeting.id,
+                    "sentence_id": sentence.id,
+                    "segment_id": sentence.segment_id,
                     "word_id": wid,
-                    "type": word.get("type"),
-                    "join": word.get("join"),
-                    "text": word.get("text"),
-                    "lemma": word.get("lemma"),
-                    "speaker": sentence.get("speaker"),
+                    "type": word.type,
+                    "join": word.join,
+                    "text": word.text,
+                    "lemma": word.lemma,
+                    "speaker": sentence.speaker,
                     "pos": i,
                     "wpos": word_index,
                     "coordinates": coordinates,
-                    "lang": translation.get("lang"),
-                    "original": translation.get("original"),
-                    "propn": word.get("propn", 0)
-                })
-
-    time_end = time.time()
-    print("transform_words_fast(): transformed words in " + str(time_end - time_start) + " seconds")
-
-    return transformed_words
+                    "lang": translation.lang,
+                    "original": translation.original,
+                    "propn": word.propn
+                }
 
 
 def get_lang_id(tokenizer, lang_code):